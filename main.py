@@ -1,33 +1,61 @@
 import sys
 import os
-import re
-import requests
-from fastapi import FastAPI, HTTPException, Form, BackgroundTasks
-from fastapi.responses import FileResponse, PlainTextResponse
+import json
+import httpx
+from fastapi import FastAPI, HTTPException, Form, BackgroundTasks, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 # モジュールパス追加
 sys.path.append(os.path.join(os.path.dirname(__file__), "module"))
 
 # LLMは最終出力のときにだけ呼ぶ
-from module.llm.llm_client import generate_emotion_from_prompt_with_context
+from module.llm.llm_client import (
+    generate_emotion_from_prompt_with_context_async,
+    stream_emotion_from_prompt_with_context_async,
+)
 
-from module.utils.utils import load_history, append_history, logger
-from module.emotion.main_emotion import save_response_to_memory, write_structured_emotion_data
+from module.utils.utils import load_history_async, append_history_async, logger
+from module.emotion.main_emotion import (
+    store_reply_emotion,
+    store_reply_emotion_async,
+)
 from module.emotion.emotion_stats import (
-    load_current_emotion,
-    merge_emotion_vectors,
-    save_current_emotion,
+    load_current_emotion_async,
+    update_current_emotion_async,
     summarize_feeling,
 )
 # 検索はローカル抽出結果（構成比＋キーワード）をキーにする
-from module.response.response_index import search_index_response, load_and_categorize_index, load_index
+from module.response.response_index import search_index_top_k_async
 # ローカル抽出（NRCLex＋MeCab）
 from module.emotion.local_emotion import generate_fallback_emotion_data
 
-from module.response.main_response import collect_all_category_responses
+from module.response.main_response import collect_all_category_responses_async
 from module.oblivion.oblivion_module import run_oblivion_cleanup_all
-from module.voice.voice_processing import synthesize_voice
+from module.voice.voice_processing import synthesize_voice_async, close_async_http_client
+from module.utils.log_sink import shutdown_log_sink
+from module.mongo.mongo_client import close_mongo_client
+from module.mongo.async_mongo_client import close_async_mongo_client
+from module.mongo.mongo_indexes import ensure_indexes, MONGO_ENSURE_INDEXES
+from module.emotion.emotion_state_store import EMOTION_STATE_STORE_ENABLED, ensure_snapshot_collection
+from module.utils.json_block import strip_json_block
+from module.llm.structured_output import STRUCTURED_OUTPUT_MODE
+from module.utils.request_context import (
+    start_request_context,
+    end_request_context,
+    current_request_context,
+    bind_request_context,
+)
+from module.utils.metrics import (
+    span,
+    start_request_timing,
+    end_request_timing,
+    format_server_timing,
+    render_prometheus,
+    CHAT_REQUESTS,
+    CHAT_TIMING_HEADERS,
+)
 
 app = FastAPI()
 
@@ -36,149 +64,266 @@ class UserMessage(BaseModel):
 
 # 応答テキストから末尾のJSONブロックを除去（UI表示用）
 def sanitize_output_for_display(text: str) -> str:
-    pattern = r'({.*})'
-    matches = re.findall(pattern, text, re.DOTALL)
-    if matches:
-        return text.replace(matches[-1], '').strip()
-    return text.strip()
+    return strip_json_block(text)
 
 @app.get("/")
 def get_ui():
     return FileResponse("static/index.html")
 
+# Prometheus テキスト形式のメトリクス
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/history")
-def get_history():
+async def get_history():
     try:
-        return {"history": load_history()}
+        return {"history": await load_history_async()}
     except Exception:
         logger.exception("履歴取得中に例外が発生しました")
         raise HTTPException(status_code=500, detail="履歴の取得中にエラーが発生しました。")
 
 @app.post("/chat")
 async def chat(
+    request: Request,
+    response: Response,
     message: str = Form(...),
     background_tasks: BackgroundTasks | None = None
 ):
     logger.debug("✅ /chat エンドポイントに到達")
     logger.info("✅ debug() 実行済み")
 
+    # ステージ別レイテンシ（X-Debug-Timing: 1 か CHAT_TIMING_HEADERS=1 でヘッダに内訳を付与）
+    timing_token = start_request_timing()
+    # リクエスト単位のメモ（現在感情・履歴検索・JSONパースを1ターンで1回に）
+    memo_token = start_request_context()
+    with_timing_header = CHAT_TIMING_HEADERS or request.headers.get("X-Debug-Timing") == "1"
+
     try:
         user_input = message
         logger.debug(f"📥 ユーザー入力取得完了: {user_input}")
 
-        # 履歴追加（user）
-        append_history("user", user_input)
-        logger.debug("📝 ユーザー履歴追加完了")
+        emotion_data, memories, best_match = await prepare_chat_turn(user_input)
+
+        # 最終応答：感情構成比と参照を踏まえて生成（ここで初めてLLMを呼ぶ）
+        with span("chat.llm"):
+            final_response, final_emotion = await generate_emotion_from_prompt_with_context_async(
+                user_input=user_input,
+                emotion_structure=emotion_data.get("構成比", {}),  # ←検索用の軽量構成比をそのまま渡す
+                best_match=best_match,
+                memories=memories
+            )
+
+        visible_response, summary = await complete_chat_turn(final_response, final_emotion, background_tasks)
+
+        CHAT_REQUESTS.inc(status="ok")
+        logger.debug(f"🧠 リクエスト内メモ: {end_request_context(memo_token)}")
+        timings = end_request_timing(timing_token)
+        if with_timing_header:
+            response.headers["Server-Timing"] = format_server_timing(timings)
+
+        return {
+            "response": visible_response,
+            "summary": summary
+        }
+
+    except Exception as e:
+        CHAT_REQUESTS.inc(status="error")
+        end_request_context(memo_token)
+        end_request_timing(timing_token)
+        logger.error(f"❌ エラー発生: {e}")
+        return PlainTextResponse("エラーが発生しました。", status_code=500)
+
+# Server-Sent Events の1イベント
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# /chat のストリーミング版（SSE）。LLMのトークンを届いた順に "token" イベントで流し（末尾の感情JSONは流さない）、
+# 音声合成・保存・感情更新のあとに "final" イベントで感情構成比・summary・VoiceVox／Live2D設定を送る。
+@app.post("/chat/stream")
+async def chat_stream(
+    request: Request,
+    message: str = Form(...),
+    background_tasks: BackgroundTasks | None = None
+):
+    logger.debug("✅ /chat/stream エンドポイントに到達")
+    with_timing_header = CHAT_TIMING_HEADERS or request.headers.get("X-Debug-Timing") == "1"
+
+    async def event_stream():
+        # コンテキスト変数はこのジェネレータ内で開始・終了する。
+        # クライアントが途中で切断すると yield で GeneratorExit（await 中なら CancelledError）が
+        # 投げられるので、後片付けと件数の記録は finally で行う
+        timing_token = start_request_timing()
+        memo_token = start_request_context()
+        status = "cancelled"
+        try:
+            user_input = message
+            emotion_data, memories, best_match = await prepare_chat_turn(user_input)
 
-        # 現在感情ロード（ログ用）
-        current_emotion = load_current_emotion()
-        logger.debug(f"🎯 [INFO] 現在感情ベクトル: {current_emotion}")
+            final_response, final_emotion = "", {}
+            with span("chat.llm"):
+                async for kind, payload in stream_emotion_from_prompt_with_context_async(
+                    user_input=user_input,
+                    emotion_structure=emotion_data.get("構成比", {}),
+                    best_match=best_match,
+                    memories=memories
+                ):
+                    if kind == "token":
+                        yield _sse_event("token", {"text": payload})
+                    else:
+                        final_response, final_emotion = payload
 
-        # ローカル抽出：構成比＋キーワード
-        status, emotion_data = generate_fallback_emotion_data(user_input)
-        if status != "ok":
-            logger.warning("⚠ ローカル感情抽出に失敗。空の構成比で続行")
-            emotion_data = {"構成比": {}, "keywords": []}
+            visible_response, summary = await complete_chat_turn(final_response, final_emotion, background_tasks)
 
-        # 感情インデックス検索（MongoDB Atlas）
-        response_text = ""
-        best_match = search_index_response(
+            status = "ok"
+            logger.debug(f"🧠 リクエスト内メモ: {end_request_context(memo_token)}")
+            timings = end_request_timing(timing_token)
+            memo_token = timing_token = None
+            final_event = {
+                "response": visible_response,
+                "emotion": final_emotion.get("構成比", {}),
+                "summary": summary,
+                "voicevox_settings": final_emotion.get("voicevox_settings"),
+                "live2d": final_emotion.get("live2d")
+            }
+            # ストリームではヘッダを後から付けられないので、内訳は final イベントに載せる
+            if with_timing_header:
+                final_event["server_timing"] = format_server_timing(timings)
+            yield _sse_event("final", final_event)
+
+        except Exception as e:
+            status = "error"
+            logger.error(f"❌ ストリーミング中にエラー発生: {e}")
+            yield _sse_event("error", {"message": "エラーが発生しました。"})
+
+        finally:
+            CHAT_REQUESTS.inc(status=status)
+            if status == "cancelled":
+                logger.info("🔌 クライアントが切断したためストリームを終了")
+            if memo_token is not None:
+                end_request_context(memo_token)
+            if timing_token is not None:
+                end_request_timing(timing_token)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 1ターン分の前処理：履歴追加・ローカル抽出・記憶検索（LLM呼び出しの手前まで）
+async def prepare_chat_turn(user_input: str) -> tuple[dict, list, dict | None]:
+    # 履歴追加（user）
+    await append_history_async("user", user_input)
+    logger.debug("📝 ユーザー履歴追加完了")
+
+    # 現在感情ロード（ログ用）
+    current_emotion = await load_current_emotion_async()
+    logger.debug(f"🎯 [INFO] 現在感情ベクトル: {current_emotion}")
+
+    # ローカル抽出：構成比＋キーワード
+    with span("chat.local_extraction"):
+        # 翻訳API＋NRCLex＋MeCab は同期処理なのでスレッドプールで実行
+        status, emotion_data = await run_in_threadpool(generate_fallback_emotion_data, user_input)
+    if status != "ok":
+        logger.warning("⚠ ローカル感情抽出に失敗。空の構成比で続行")
+        emotion_data = {"構成比": {}, "keywords": []}
+
+    # 感情インデックス検索（MongoDB Atlas）
+    response_text = ""
+    with span("chat.search_index"):
+        memories = await search_index_top_k_async(
             emotion_structure={
                 "構成比": emotion_data.get("構成比", {}),
                 "keywords": emotion_data.get("keywords", [])
             }
         )
+    # スコア最上位の記憶を参照の中心にする（残りはプロンプトに候補として渡す）
+    best_match = memories[0]["document"] if memories else None
 
-        if best_match:
-            logger.info("[STEP] インデックスにマッチした応答を取得")
-            response_text = best_match.get("応答", "")
-            if response_text:
-                append_history("assistant", response_text)
-        else:
-            # フォールバック：主要感情＋当日でカテゴリ別に探す
-            from datetime import datetime as _dt
-            dominant_emotion = next(iter(emotion_data.get("構成比", {})), None)
-            if dominant_emotion:
-                today = _dt.now().strftime("%Y-%m-%d")
-                matched = collect_all_category_responses(
+    if best_match:
+        logger.info("[STEP] インデックスにマッチした応答を取得")
+        response_text = best_match.get("応答", "")
+        if response_text:
+            await append_history_async("assistant", response_text)
+    else:
+        # フォールバック：主要感情＋当日でカテゴリ別に探す
+        from datetime import datetime as _dt
+        dominant_emotion = next(iter(emotion_data.get("構成比", {})), None)
+        if dominant_emotion:
+            today = _dt.now().strftime("%Y-%m-%d")
+            with span("chat.collect_category_responses"):
+                matched = await collect_all_category_responses_async(
                     emotion_name=dominant_emotion,
                     date_str=today
                 )
-                for cat in ["short", "intermediate", "long"]:
-                    if matched.get(cat):
-                        response_text = matched[cat].get("応答", "")
-                        logger.info(f"[STEP] 履歴から {cat} カテゴリの応答を返却")
-                        if response_text:
-                            append_history("assistant", response_text)
-                        break
-
-            if not response_text:
-                logger.warning("[WARN] 履歴にも一致する応答が見つかりませんでした")
-                response_text = "ごめんなさい、うまく思い出せませんでした。"
-                append_history("assistant", response_text)
+            for cat in ["short", "intermediate", "long"]:
+                if matched.get(cat):
+                    response_text = matched[cat].get("応答", "")
+                    logger.info(f"[STEP] 履歴から {cat} カテゴリの応答を返却")
+                    if response_text:
+                        await append_history_async("assistant", response_text)
+                    break
 
-        # 最終応答：感情構成比と参照を踏まえて生成（ここで初めてLLMを呼ぶ）
-        final_response, final_emotion = generate_emotion_from_prompt_with_context(
-            user_input=user_input,
-            emotion_structure=emotion_data.get("構成比", {}),  # ←検索用の軽量構成比をそのまま渡す
-            best_match=best_match
-        )
-        append_history("assistant", final_response)
+        if not response_text:
+            logger.warning("[WARN] 履歴にも一致する応答が見つかりませんでした")
+            response_text = "ごめんなさい、うまく思い出せませんでした。"
+            await append_history_async("assistant", response_text)
 
-        # 音声合成（VoiceVox）
-        voice_settings = final_emotion.get("voicevox_settings")
-        if voice_settings:
-            audio_binary = synthesize_voice(final_response, voice_settings)
-            with open("output.wav", "wb") as f:
-                f.write(audio_binary)
+    return emotion_data, memories, best_match
 
-        # 構造データ抽出・保存（最終応答に対して）
-        parsed_emotion_data = save_response_to_memory(final_response)
+# 1ターン分の後処理：履歴追加・音声合成・構造データ保存・現在感情の更新。戻り値は（表示用テキスト, summary）
+async def complete_chat_turn(final_response: str, final_emotion: dict, background_tasks: BackgroundTasks | None) -> tuple[str, dict]:
+    await append_history_async("assistant", final_response)
+
+    # 音声合成（VoiceVox）
+    voice_settings = final_emotion.get("voicevox_settings")
+    if voice_settings:
+        with span("chat.voicevox"):
+            audio_binary = await synthesize_voice_async(final_response, voice_settings)
+            await run_in_threadpool(_write_audio_file, "output.wav", audio_binary)
+
+    # 構造データ保存：LLM 応答から取り出し済みの感情データをそのまま保存する
+    # （final_response は表示用で末尾JSONを除いてあるので再パースしない。構造化出力・キャッシュも同じ）
+    with span("chat.store_structured_data"):
+        parsed_emotion_data = await store_reply_emotion_async(final_emotion)
         if parsed_emotion_data:
-            write_structured_emotion_data(parsed_emotion_data)
             emotion_to_merge = parsed_emotion_data.get("構成比", final_emotion)
         else:
             logger.warning("⚠ 構造データ抽出失敗 → 直接生成した感情構成比を使用")
             emotion_to_merge = final_emotion
 
-        # 現在感情の更新
-        latest_emotion = load_current_emotion()
-        merged_emotion = merge_emotion_vectors(
-            current=latest_emotion,
-            new=emotion_to_merge,
+    # 現在感情の更新
+    with span("chat.emotion_merge"):
+        merged_emotion = await update_current_emotion_async(
+            emotion_to_merge,
             weight_new=0.3,
             decay_factor=0.9,
             normalize=True
         )
-        save_current_emotion(merged_emotion)
         summary = summarize_feeling(merged_emotion)
 
-        # 背景で忘却処理
-        if background_tasks:
-            background_tasks.add_task(process_and_cleanup_emotion_data, final_response)
-
-        visible_response = sanitize_output_for_display(final_response)
+    # 背景で忘却処理
+    if background_tasks:
+        background_tasks.add_task(process_and_cleanup_emotion_data, final_emotion, current_request_context())
 
-        return {
-            "response": visible_response,
-            "summary": summary
-        }
+    return sanitize_output_for_display(final_response), summary
 
-    except Exception as e:
-        logger.error(f"❌ エラー発生: {e}")
-        return PlainTextResponse("エラーが発生しました。", status_code=500)
+def _write_audio_file(path: str, audio_binary: bytes):
+    with open(path, "wb") as f:
+        f.write(audio_binary)
 
-def store_emotion_structured_data(response_text: str):
+def store_emotion_structured_data(final_emotion: dict):
     logger.info("🧩 store_emotion_structured_data() が呼び出されました")
-    parsed_emotion_data = save_response_to_memory(response_text)
-    if parsed_emotion_data:
-        write_structured_emotion_data(parsed_emotion_data)
-    else:
-        logger.warning("⚠ 背景タスク：構造データの抽出に失敗したため、保存をスキップ")
+    if not store_reply_emotion(final_emotion):
+        logger.warning("⚠ 背景タスク：応答に感情データが無いため、保存をスキップ")
 
-def process_and_cleanup_emotion_data(response_text: str):
+def process_and_cleanup_emotion_data(final_emotion: dict, request_context=None):
     logger.info("🔄 感情データの保存と忘却処理を開始します")
-    store_emotion_structured_data(response_text)
+    # /chat 本体で取り出し済みの感情データを使う（構造化出力では /chat 本体で保存済み）
+    if STRUCTURED_OUTPUT_MODE == "off":
+        with bind_request_context(request_context):
+            store_emotion_structured_data(final_emotion)
     logger.info("🧹 感情データ保存後、忘却処理を実行します")
     run_oblivion_cleanup_all()
     logger.info("✅ 感情データ保存＋忘却処理 完了")
@@ -188,9 +333,25 @@ def process_and_cleanup_emotion_data(response_text: str):
 async def on_startup():
     logger.info("🚀 システム起動チェック開始")
     try:
-        resp = requests.get("http://localhost:50021/speakers")
+        async with httpx.AsyncClient(timeout=5) as http:
+            resp = await http.get("http://localhost:50021/speakers")
         resp.raise_for_status()
         logger.info("🔈 VoiceVoxエンジンに接続成功")
     except Exception as e:
         logger.warning(f"⚠️ VoiceVoxエンジンに接続できませんでした: {e}")
+    # インデックス作成（既存ならスキップされる）
+    if MONGO_ENSURE_INDEXES:
+        # 時系列コレクションは最初の書き込みより前に作っておく（自動作成だと通常のコレクションになる）
+        if EMOTION_STATE_STORE_ENABLED:
+            await run_in_threadpool(ensure_snapshot_collection)
+        await run_in_threadpool(ensure_indexes)
     logger.info("✅ 起動前チェック完了")
+
+# 終了時：キューに残ったログを書き出す
+@app.on_event("shutdown")
+async def on_shutdown():
+    logger.info("🛑 シャットダウン処理開始")
+    await close_async_http_client()
+    await close_async_mongo_client()
+    shutdown_log_sink()
+    close_mongo_client()
@@ -3,39 +3,90 @@ import os
 import json
 from collections import Counter
 
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
 from module.utils.utils import logger
+from module.utils.metrics import timed
+from module.utils.single_flight import single_flight
+from module.emotion.personality_profile import (
+    PERSONALITY_PROFILE_ENABLED,
+    load_personality_counts,
+    load_personality_counts_async,
+)
 from module.params import emotion_map
 
 # MongoDBからlongカテゴリのemotionをカウントし、出現頻度の高い感情トップ4（日本語）を返す。
 # Count emotions in the 'long' category from MongoDB and return the top 4 most frequent emotions (in Japanese).
+# 同時に呼ばれたら1回の走査結果を共有する
+@single_flight("get_top_long_emotions")
+@timed("db.get_top_long_emotions")
 def get_top_long_emotions():
+    if PERSONALITY_PROFILE_ENABLED:
+        # 集計済みプロファイル（保存時に $inc で更新）から引く
+        try:
+            return _top4_japanese(load_personality_counts())
+        except Exception as e:
+            logger.warning(f"⚠ 人格プロファイルを使えないため long を走査します: {e}")
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        collection = db["emotion_data"]
+        collection = get_collection("emotion_data")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
 
         logger.info("📡 MongoDBクライアント接続完了 → longカテゴリを走査")  # MongoDB client connected → scanning 'long' category
         long_docs = collection.find({"category": "long"})
 
         counter = Counter()
         for i, doc in enumerate(long_docs, start=1):
-            emotion_en = str(doc.get("emotion", "")).strip()
-            if not emotion_en:
-                logger.warning(f"[WARN] doc {i} にemotionフィールドが存在しない")  # doc {i} has no 'emotion' field
-                continue
-            counter[emotion_en] += 1
-            logger.debug(f"[DEBUG] doc {i}: emotion = {emotion_en}")
+            _count_emotion(counter, i, doc)
 
-        total = sum(counter.values())
-        logger.debug(f"[DEBUG] 主感情カウント合計: {total} 件")  # Total main emotion count: {total}
+        return _top4_japanese(counter)
 
-        top4_en = counter.most_common(4)
-        top4_jp = [(emotion_map.get(en, en), count) for en, count in top4_en]
+    except Exception as e:
+        logger.error(f"[ERROR] MongoDBからlongカテゴリ感情の取得に失敗: {e}")  # Failed to retrieve 'long' category emotions from MongoDB
+        return []
+
+# 非同期版
+# Async variant
+@single_flight("get_top_long_emotions")
+@timed("db.get_top_long_emotions")
+async def get_top_long_emotions_async():
+    if PERSONALITY_PROFILE_ENABLED:
+        try:
+            return _top4_japanese(await load_personality_counts_async())
+        except Exception as e:
+            logger.warning(f"⚠ 人格プロファイルを使えないため long を走査します: {e}")
+    try:
+        collection = get_async_collection("emotion_data")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+
+        logger.info("📡 MongoDBクライアント接続完了 → longカテゴリを走査")  # MongoDB client connected → scanning 'long' category
+        counter = Counter()
+        i = 0
+        async for doc in collection.find({"category": "long"}):
+            i += 1
+            _count_emotion(counter, i, doc)
 
-        logger.info(f"🧭 現在人格傾向（日本語）: {dict(top4_jp)}")  # Current personality tendencies (Japanese)
-        return top4_jp
+        return _top4_japanese(counter)
 
     except Exception as e:
         logger.error(f"[ERROR] MongoDBからlongカテゴリ感情の取得に失敗: {e}")  # Failed to retrieve 'long' category emotions from MongoDB
         return []
+
+def _count_emotion(counter: Counter, i: int, doc: dict):
+    emotion_en = str(doc.get("emotion", "")).strip()
+    if not emotion_en:
+        logger.warning(f"[WARN] doc {i} にemotionフィールドが存在しない")  # doc {i} has no 'emotion' field
+        return
+    counter[emotion_en] += 1
+    logger.debug(f"[DEBUG] doc {i}: emotion = {emotion_en}")
+
+def _top4_japanese(counter: Counter) -> list:
+    total = sum(counter.values())
+    logger.debug(f"[DEBUG] 主感情カウント合計: {total} 件")  # Total main emotion count: {total}
+
+    top4_en = counter.most_common(4)
+    top4_jp = [(emotion_map.get(en, en), count) for en, count in top4_en]
+
+    logger.info(f"🧭 現在人格傾向（日本語）: {dict(top4_jp)}")  # Current personality tendencies (Japanese)
+    return top4_jp
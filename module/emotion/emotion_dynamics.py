@@ -0,0 +1,196 @@
+# module/emotion/emotion_dynamics.py
+import threading
+
+import numpy as np
+
+import module.emotion.emotion_stats as stats
+from module.params import emotion_map_reverse
+
+# merge_emotion_vectors の配列版。32感情を固定の並び（スロット）に置き、
+# 半減期・FAST_DECAY / STICKY・相互抑制の係数を前もって配列にしておく。
+# dict 版と同じく「値を持つキー」だけが結果に残るよう、値と一緒に presence（キーの有無）を持ち回る。
+# 複数の状態をまとめて合成する batch API（リプレイ・シミュレーション用）もここに置く。
+# Array-backed emotion dynamics: fixed 32-slot vectors plus a presence mask, parity with the dict version.
+
+
+class EmotionDynamics:
+    def __init__(self, names: list[str] | None = None):
+        self.names = list(names if names is not None else emotion_map_reverse.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        size = len(self.names)
+
+        self.half_life = np.array(
+            [max(1.0, stats.HALF_LIFE_SEC.get(name, stats.DEFAULT_HALF_LIFE)) for name in self.names], dtype=np.float64
+        )
+        self.fast = np.array([name in stats.FAST_DECAY for name in self.names], dtype=bool)
+        self.sticky = np.array([name in stats.STICKY for name in self.names], dtype=bool)
+        self.high_arousal = np.array([self.index[n] for n in stats.HIGH_AROUSAL if n in self.index], dtype=np.intp)
+
+        # 相互抑制は dict 版と同じく「抑制元ごとに順番に」かける（前の抑制元の結果が次の抑制元の値になる）
+        self.inhibit = [
+            (self.index[src], np.array([self.index[t] for t in sinks], dtype=np.intp), np.array(list(sinks.values())))
+            for src, sinks in stats.CROSS_INHIBIT.items()
+            if src in self.index and all(t in self.index for t in sinks)
+        ]
+        # 設定に並びの外の感情名があると dict 版と結果のキーが変わるので、その場合は配列版を使わない
+        self.supported = (
+            size > 0
+            and len(self.inhibit) == len(stats.CROSS_INHIBIT)
+            and len(self.high_arousal) == len(stats.HIGH_AROUSAL)
+        )
+
+    # =========================
+    # dict ⇔ 配列
+    # =========================
+
+    def to_array(self, vec: dict) -> tuple[np.ndarray, np.ndarray] | None:
+        """(値, presence)。数値にできない値は無いものとして扱う。並びの外のキーがあれば None"""
+        values = np.zeros(len(self.names), dtype=np.float64)
+        present = np.zeros(len(self.names), dtype=bool)
+        for key, value in vec.items():
+            i = self.index.get(key)
+            if i is None:
+                return None
+            try:
+                values[i] = float(value)
+            except (ValueError, TypeError):
+                continue
+            present[i] = True
+        return values, present
+
+    def to_dict(self, values: np.ndarray, present: np.ndarray, digits: int | None = None) -> dict:
+        if digits is None:
+            return {self.names[i]: float(values[i]) for i in np.flatnonzero(present)}
+        return {self.names[i]: round(float(values[i]), digits) for i in np.flatnonzero(present)}
+
+    # =========================
+    # 合成
+    # =========================
+
+    def merge_batch(
+        self,
+        current: np.ndarray,
+        current_present: np.ndarray,
+        new: np.ndarray,
+        new_present: np.ndarray,
+        dt,
+        weight_new=None,
+        normalize: bool = True,
+        rounded: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (B, 32) の状態をまとめて合成し (値, presence) を返す。dt・weight_new はスカラーか長さ B。
+        normalize かつ rounded なら dict 版と同じく小数2桁に丸める。
+        """
+        current = np.where(current_present, np.asarray(current, dtype=np.float64), 0.0)
+        new = np.where(new_present, np.asarray(new, dtype=np.float64), 0.0)
+        batch = current.shape[0]
+        dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), (batch,))[:, None]
+
+        # 時間減衰（dt <= 0 のときは dict 版と同じくそのまま）
+        decay = 0.5 ** (np.maximum(dt, 0.0) / self.half_life)
+        decayed = np.where(dt > 0, np.maximum(current * decay, 0.0), current)
+
+        # 適応アルファ（高覚醒の感情ほど新規ベクトル寄り）と感情ごとの補正
+        if weight_new is None:
+            arousal = np.clip(new[:, self.high_arousal].sum(axis=1), 0.0, 100.0) / 100.0
+            alpha = stats.ALPHA_MIN + (stats.ALPHA_MAX - stats.ALPHA_MIN) * arousal
+        else:
+            alpha = np.broadcast_to(np.asarray(weight_new, dtype=np.float64), (batch,))
+        a = np.repeat(alpha[:, None], len(self.names), axis=1)
+        a = np.where(self.fast, np.minimum(1.0, a * 1.15), a)
+        a = np.where(self.sticky, np.maximum(0.0, a * 0.85), a)
+        target = np.maximum(0.0, (1.0 - a) * decayed + a * new)
+
+        # スパイク制御＋リフラクトリ
+        present = current_present | new_present
+        big_spike = ((new - decayed >= stats.BIG_SPIKE_THRESHOLD) & present).any(axis=1)
+        target = np.where(
+            big_spike[:, None] & self.fast,
+            np.minimum(target, decayed + stats.MAX_DELTA_UP * 0.5),
+            target
+        )
+        merged = decayed + np.clip(target - decayed, -stats.MAX_DELTA_DOWN, stats.MAX_DELTA_UP)
+        merged = np.where(present, merged, 0.0)
+        present = present.copy()
+
+        # 相互抑制（抑制先は値が 0 でも結果のキーに加わる）
+        for src, targets, coeffs in self.inhibit:
+            s_val = merged[:, src]
+            active = s_val > 0
+            if not active.any():
+                continue
+            inhibited = np.maximum(0.0, merged[:, targets] * (1.0 - coeffs * s_val[:, None] / 100.0))
+            merged[:, targets] = np.where(active[:, None], inhibited, merged[:, targets])
+            present[:, targets] |= active[:, None]
+
+        # ホメオスタシス（平均は値を持つキーだけで取る）
+        count = present.sum(axis=1)
+        mean = np.where(count > 0, np.where(present, merged, 0.0).sum(axis=1) / np.maximum(count, 1), 0.0)
+        merged = np.maximum(merged + (mean[:, None] - merged) * stats.HOMEOSTASIS_STRENGTH, 0.0)
+        merged = np.where(present, merged, 0.0)
+
+        if normalize:
+            total = merged.sum(axis=1, keepdims=True)
+            merged = np.where(total > 0, 100.0 * merged / np.where(total > 0, total, 1.0), 0.0)
+            if rounded:
+                merged = np.round(merged, 2)
+        return merged, present
+
+    def merge(
+        self,
+        current: dict,
+        corr_new: dict,
+        dt: float,
+        weight_new: float | None = None,
+        normalize: bool = True
+    ) -> dict | None:
+        """dict 版 merge_emotion_dicts と同じ入出力。配列で扱えない入力なら None"""
+        if not self.supported:
+            return None
+        cur = self.to_array(current)
+        new = self.to_array(corr_new)
+        if cur is None or new is None:
+            return None
+        values, present = self.merge_batch(
+            cur[0][None, :], cur[1][None, :], new[0][None, :], new[1][None, :],
+            dt, weight_new=weight_new, normalize=normalize, rounded=False
+        )
+        return self.to_dict(values[0], present[0], digits=2 if normalize else None)
+
+    def merge_many(
+        self,
+        currents: list[dict],
+        news: list[dict],
+        dts,
+        weight_new=None,
+        normalize: bool = True
+    ) -> list[dict] | None:
+        """複数の (current, new) を1回の配列演算で合成する。news は型補正前でもよい"""
+        if not self.supported:
+            return None
+        if not currents:
+            return []
+        arrays = [self.to_array(v) for v in currents] + [self.to_array(stats._correct_new_vector(v)) for v in news]
+        if any(a is None for a in arrays):
+            return None
+        cur, new = arrays[:len(currents)], arrays[len(currents):]
+        values, present = self.merge_batch(
+            np.stack([v for v, _ in cur]), np.stack([p for _, p in cur]),
+            np.stack([v for v, _ in new]), np.stack([p for _, p in new]),
+            dts, weight_new=weight_new, normalize=normalize, rounded=False
+        )
+        digits = 2 if normalize else None
+        return [self.to_dict(values[i], present[i], digits=digits) for i in range(len(currents))]
+
+
+_dynamics = None
+_dynamics_lock = threading.Lock()
+
+
+def get_emotion_dynamics() -> EmotionDynamics:
+    global _dynamics
+    with _dynamics_lock:
+        if _dynamics is None:
+            _dynamics = EmotionDynamics()
+        return _dynamics
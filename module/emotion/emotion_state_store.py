@@ -0,0 +1,341 @@
+# module/emotion/emotion_state_store.py
+import os
+import copy
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+from module.mongo.mongo_client import get_collection, get_connection_manager
+from module.mongo.async_mongo_client import get_async_collection
+from module.utils.utils import logger
+from module.utils.metrics import counter
+
+# 現在感情の保存先。更新のたびに current_emotion へ1件追加し、読むたびに timestamp で並べ替える代わりに、
+# - 最新の状態はプロセス内に持ち、MongoDB にはドキュメント1件（_id="current"）を find_one_and_update で上書きする
+#   （version を $inc するので、expected_version を渡せば楽観ロックにもなる）
+# - 履歴は EMOTION_SNAPSHOT_INTERVAL_SEC ごとに時系列コレクションへスナップショットとして追記し、
+#   古いものは EMOTION_SNAPSHOT_BUCKET_SEC ごとの平均1件にまとめる（compact_snapshots）
+# 他プロセスの書き込みは EMOTION_STATE_REFRESH_SEC ごとの読み直し（_id 指定の1件）で拾う。
+# 読んで合成して書く処理（emotion_stats.update_current_emotion）は読んだ version を expected_version に渡し、
+# 競合したら読み直して合成し直す（古いプロセス内コピーで他の書き込みを上書きしない）。
+# Write-through current-emotion state: one upserted document plus downsampled time-series snapshots.
+
+EMOTION_STATE_STORE_ENABLED = os.getenv("EMOTION_STATE_STORE_ENABLED", "1") == "1"
+EMOTION_STATE_REFRESH_SEC = float(os.getenv("EMOTION_STATE_REFRESH_SEC", "30"))
+# version 競合時に読み直して合成し直す回数
+EMOTION_STATE_MAX_RETRIES = int(os.getenv("EMOTION_STATE_MAX_RETRIES", "3"))
+# スナップショットの間隔（0 以下で毎回）
+EMOTION_SNAPSHOT_INTERVAL_SEC = float(os.getenv("EMOTION_SNAPSHOT_INTERVAL_SEC", "300"))
+# これより古い生のスナップショットを、バケットごとの平均1件にまとめる
+EMOTION_SNAPSHOT_DOWNSAMPLE_AFTER_SEC = float(os.getenv("EMOTION_SNAPSHOT_DOWNSAMPLE_AFTER_SEC", str(7 * 86400)))
+EMOTION_SNAPSHOT_BUCKET_SEC = int(os.getenv("EMOTION_SNAPSHOT_BUCKET_SEC", "3600"))
+# スナップショットの保持期間（時系列コレクションの expireAfterSeconds）
+EMOTION_SNAPSHOT_RETENTION_DAYS = int(os.getenv("EMOTION_SNAPSHOT_RETENTION_DAYS", "365"))
+
+STATE_COLLECTION = "current_emotion_state"
+STATE_ID = "current"
+SNAPSHOT_COLLECTION = "current_emotion_snapshots"
+# 旧形式（更新ごとに1件追加）。状態ドキュメントがまだ無いときだけ読む
+LEGACY_COLLECTION = "current_emotion"
+
+EMOTION_STATE_EVENTS = counter(
+    "yumia_emotion_state_events_total", "Current-emotion state store reads / writes / snapshots / conflicts", ("event",)
+)
+
+
+def _empty_state() -> dict:
+    return {"emotion_vector": {}, "timestamp": None, "version": 0}
+
+
+def _state_from_document(doc: dict | None) -> dict:
+    if not doc:
+        return _empty_state()
+    return {
+        "emotion_vector": doc.get("emotion_vector", {}) or {},
+        "timestamp": doc.get("timestamp"),
+        "version": int(doc.get("version", 0))
+    }
+
+
+def _state_update(emotion_vector: dict, timestamp: str) -> dict:
+    return {
+        "$set": {
+            "emotion_vector": emotion_vector,
+            "timestamp": timestamp,
+            "updated_at": datetime.now(timezone.utc)
+        },
+        "$inc": {"version": 1}
+    }
+
+
+def _state_query(expected_version: int | None) -> tuple[dict, bool]:
+    """(query, upsert)。expected_version=0 は「状態ドキュメントがまだ無い」ので、無ければ作る（先に作られていれば重複キーで競合）"""
+    query = {"_id": STATE_ID}
+    if expected_version is not None:
+        query["version"] = expected_version
+    return query, expected_version in (None, 0)
+
+
+def _snapshot_document(state: dict) -> dict:
+    return {
+        "ts": datetime.now(timezone.utc),
+        "meta": {"resolution": "raw"},
+        "emotion_vector": state["emotion_vector"],
+        "version": state["version"]
+    }
+
+
+class EmotionStateStore:
+    def __init__(
+        self,
+        refresh_interval: float = EMOTION_STATE_REFRESH_SEC,
+        snapshot_interval: float = EMOTION_SNAPSHOT_INTERVAL_SEC,
+        clock=time.monotonic
+    ):
+        self.refresh_interval = refresh_interval
+        self.snapshot_interval = snapshot_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = None
+        self._loaded_at = 0.0
+        self._snapshot_at = None
+
+    # =========================
+    # プロセス内の状態
+    # =========================
+
+    def _cached(self) -> dict | None:
+        with self._lock:
+            if self._state is not None and self._clock() - self._loaded_at < self.refresh_interval:
+                EMOTION_STATE_EVENTS.inc(event="hit")
+                return copy.deepcopy(self._state)
+        return None
+
+    def _set(self, state: dict) -> dict:
+        with self._lock:
+            self._state = copy.deepcopy(state)
+            self._loaded_at = self._clock()
+            return copy.deepcopy(state)
+
+    def _snapshot_due(self) -> bool:
+        with self._lock:
+            now = self._clock()
+            if self._snapshot_at is not None and now - self._snapshot_at < self.snapshot_interval:
+                return False
+            self._snapshot_at = now
+            return True
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    # =========================
+    # 同期版
+    # =========================
+
+    def load(self) -> dict:
+        """{"emotion_vector", "timestamp", "version"} を返す"""
+        state = self._cached()
+        if state is not None:
+            return state
+        collection = get_collection(STATE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        doc = collection.find_one({"_id": STATE_ID})
+        if doc is None:
+            doc = self._load_legacy()
+        EMOTION_STATE_EVENTS.inc(event="load")
+        return self._set(_state_from_document(doc))
+
+    def _load_legacy(self) -> dict | None:
+        legacy = get_collection(LEGACY_COLLECTION)
+        if legacy is None:
+            return None
+        doc = legacy.find_one(sort=[("timestamp", -1)])
+        if doc is not None:
+            logger.info("ℹ 状態ドキュメントが無いため旧形式の current_emotion から現在感情を読み込み")
+            doc = {**doc, "version": 0}
+        return doc
+
+    def save(self, emotion_vector: dict, timestamp: str, expected_version: int | None = None) -> dict | None:
+        """
+        状態ドキュメントを上書きして新しい状態を返す。
+        expected_version を渡した場合、その間に他から更新されていれば保存せず None（呼び出し側で読み直して再計算）。
+        """
+        collection = get_collection(STATE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        query, upsert = _state_query(expected_version)
+        try:
+            doc = collection.find_one_and_update(
+                query,
+                _state_update(emotion_vector, timestamp),
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            doc = None
+        if doc is None:
+            EMOTION_STATE_EVENTS.inc(event="conflict")
+            self.invalidate()
+            return None
+        EMOTION_STATE_EVENTS.inc(event="write")
+        state = self._set(_state_from_document(doc))
+        if self._snapshot_due():
+            self._append_snapshot(state)
+        return state
+
+    def _append_snapshot(self, state: dict):
+        try:
+            collection = get_collection(SNAPSHOT_COLLECTION)
+            if collection is not None:
+                collection.insert_one(_snapshot_document(state))
+                EMOTION_STATE_EVENTS.inc(event="snapshot")
+        except Exception as e:
+            logger.warning(f"⚠ 現在感情のスナップショット保存に失敗: {e}")
+
+    # =========================
+    # 非同期版
+    # =========================
+
+    async def load_async(self) -> dict:
+        state = self._cached()
+        if state is not None:
+            return state
+        collection = get_async_collection(STATE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        doc = await collection.find_one({"_id": STATE_ID})
+        if doc is None:
+            legacy = get_async_collection(LEGACY_COLLECTION)
+            if legacy is not None:
+                doc = await legacy.find_one(sort=[("timestamp", -1)])
+                if doc is not None:
+                    logger.info("ℹ 状態ドキュメントが無いため旧形式の current_emotion から現在感情を読み込み")
+                    doc = {**doc, "version": 0}
+        EMOTION_STATE_EVENTS.inc(event="load")
+        return self._set(_state_from_document(doc))
+
+    async def save_async(self, emotion_vector: dict, timestamp: str, expected_version: int | None = None) -> dict | None:
+        collection = get_async_collection(STATE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        query, upsert = _state_query(expected_version)
+        try:
+            doc = await collection.find_one_and_update(
+                query,
+                _state_update(emotion_vector, timestamp),
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            doc = None
+        if doc is None:
+            EMOTION_STATE_EVENTS.inc(event="conflict")
+            self.invalidate()
+            return None
+        EMOTION_STATE_EVENTS.inc(event="write")
+        state = self._set(_state_from_document(doc))
+        if self._snapshot_due():
+            try:
+                snapshots = get_async_collection(SNAPSHOT_COLLECTION)
+                if snapshots is not None:
+                    await snapshots.insert_one(_snapshot_document(state))
+                    EMOTION_STATE_EVENTS.inc(event="snapshot")
+            except Exception as e:
+                logger.warning(f"⚠ 現在感情のスナップショット保存に失敗: {e}")
+        return state
+
+
+_store = EmotionStateStore()
+
+
+def get_emotion_state_store() -> EmotionStateStore:
+    return _store
+
+
+# =========================
+# スナップショットの保守
+# =========================
+
+def ensure_snapshot_collection(db=None) -> bool:
+    """スナップショット用の時系列コレクションを作る（既にあれば何もしない）。作成したら True"""
+    db = db if db is not None else get_connection_manager().get_database()
+    if db is None:
+        logger.error("❌ MongoDBに接続できないためスナップショット用コレクションの作成をスキップ")
+        return False
+    try:
+        if SNAPSHOT_COLLECTION in db.list_collection_names():
+            return False
+        db.create_collection(
+            SNAPSHOT_COLLECTION,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "minutes"},
+            expireAfterSeconds=EMOTION_SNAPSHOT_RETENTION_DAYS * 86400
+        )
+        logger.info(f"🗂️ 時系列コレクション作成: {SNAPSHOT_COLLECTION}")
+        return True
+    except CollectionInvalid:
+        return False
+    except Exception as e:
+        # 時系列コレクション非対応のサーバーでは通常のコレクションとして自動作成される
+        logger.warning(f"⚠ 時系列コレクションの作成に失敗（通常のコレクションで続行）: {e}")
+        return False
+
+
+def _bucket_start(ts: datetime, bucket_sec: int) -> datetime:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % bucket_sec, tz=timezone.utc)
+
+
+def _average_vectors(vectors: list[dict]) -> dict:
+    keys = {k for vector in vectors for k in vector}
+    return {k: round(sum(float(v.get(k, 0.0)) for v in vectors) / len(vectors), 2) for k in sorted(keys)}
+
+
+def downsample_snapshots(snapshots: list[dict], bucket_sec: int = EMOTION_SNAPSHOT_BUCKET_SEC) -> list[tuple[dict, list]]:
+    """生のスナップショットをバケットごとにまとめ、[(平均のスナップショット, 元の _id 一覧), ...] を返す"""
+    buckets = {}
+    for snapshot in snapshots:
+        buckets.setdefault(_bucket_start(snapshot["ts"], bucket_sec), []).append(snapshot)
+    result = []
+    for start, items in sorted(buckets.items()):
+        summary = {
+            "ts": start,
+            "meta": {"resolution": "downsampled", "bucket_sec": bucket_sec},
+            "emotion_vector": _average_vectors([item.get("emotion_vector", {}) for item in items]),
+            "version": max(int(item.get("version", 0)) for item in items),
+            "samples": len(items)
+        }
+        result.append((summary, [item["_id"] for item in items]))
+    return result
+
+
+def compact_snapshots(
+    older_than_sec: float = EMOTION_SNAPSHOT_DOWNSAMPLE_AFTER_SEC,
+    bucket_sec: int = EMOTION_SNAPSHOT_BUCKET_SEC
+) -> dict:
+    """
+    older_than_sec より古い生のスナップショットを bucket_sec ごとの平均1件に置き換える。
+    ※ 時系列コレクションの任意条件での削除は MongoDB 7.0 以降
+    """
+    result = {"buckets": 0, "removed": 0}
+    try:
+        collection = get_collection(SNAPSHOT_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=older_than_sec)
+        raw = list(collection.find({"meta.resolution": "raw", "ts": {"$lt": threshold}}))
+        for summary, ids in downsample_snapshots(raw, bucket_sec):
+            collection.insert_one(summary)
+            deleted = collection.delete_many({"_id": {"$in": ids}})
+            result["buckets"] += 1
+            result["removed"] += deleted.deleted_count
+        logger.info(f"🗜️ 現在感情スナップショットを圧縮: {result['removed']} 件 → {result['buckets']} 件")
+    except Exception as e:
+        logger.error(f"[ERROR] 現在感情スナップショットの圧縮に失敗: {e}")
+    return result
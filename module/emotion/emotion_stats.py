@@ -5,7 +5,11 @@ import math
 from datetime import datetime, timezone
 
 from module.utils.utils import logger
-from module.mongo.mongo_client import get_mongo_client
+from module.utils.metrics import timed
+from module.utils.request_context import request_memoized, remember
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.emotion.emotion_state_store import EMOTION_STATE_STORE_ENABLED, EMOTION_STATE_MAX_RETRIES, get_emotion_state_store
 from module.params import emotion_map, emotion_map_reverse
 
 # =========================
@@ -43,13 +47,17 @@ def normalize_composition_vector(raw_composition: dict) -> dict:
 # 現在感情：読み書き
 # =========================
 
+# 同じリクエスト内では1回だけ読む（保存時に remember で最新値に差し替える）
+# EMOTION_STATE_STORE_ENABLED なら状態ストア（プロセス内＋上書きされる1件のドキュメント）から読む
+@request_memoized("current_emotion")
+@timed("db.load_current_emotion")
 def load_current_emotion():
     """互換：ベクトルのみ返す（従来通り）"""
     try:
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            col = db["current_emotion"]
+        if EMOTION_STATE_STORE_ENABLED:
+            return get_emotion_state_store().load()["emotion_vector"]
+        col = get_collection("current_emotion")
+        if col is not None:
             latest = col.find_one(sort=[("timestamp", -1)])
             return latest.get("emotion_vector", {}) if latest else {}
     except Exception as e:
@@ -59,10 +67,11 @@ def load_current_emotion():
 def load_current_emotion_with_meta():
     """新規：ベクトル＋メタ（timestamp）を返す"""
     try:
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            col = db["current_emotion"]
+        if EMOTION_STATE_STORE_ENABLED:
+            state = get_emotion_state_store().load()
+            return {"emotion_vector": state["emotion_vector"], "timestamp": state["timestamp"]}
+        col = get_collection("current_emotion")
+        if col is not None:
             latest = col.find_one(sort=[("timestamp", -1)])
             if latest:
                 return {
@@ -73,21 +82,107 @@ def load_current_emotion_with_meta():
         logger.error(f"[ERROR] 現在感情(with meta)の読み込みに失敗: {e}")
     return {"emotion_vector": {}, "timestamp": None}
 
+@timed("db.save_current_emotion")
 def save_current_emotion(emotion_vector: dict):
     try:
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            col = db["current_emotion"]
+        if EMOTION_STATE_STORE_ENABLED:
+            get_emotion_state_store().save(emotion_vector, _now_utc_str())
+            remember("current_emotion", emotion_vector)
+            logger.info("[INFO] 現在感情をMongoDBに保存しました")
+            return
+        col = get_collection("current_emotion")
+        if col is not None:
             entry = {
                 "timestamp": _now_utc_str(),
                 "emotion_vector": emotion_vector
             }
             col.insert_one(entry)
+            remember("current_emotion", emotion_vector)
+            logger.info("[INFO] 現在感情をMongoDBに保存しました")
+    except Exception as e:
+        logger.error(f"[ERROR] 現在感情の保存に失敗: {e}")
+
+# 非同期版（/chat のイベントループから呼ぶ）
+@request_memoized("current_emotion")
+@timed("db.load_current_emotion")
+async def load_current_emotion_async():
+    try:
+        if EMOTION_STATE_STORE_ENABLED:
+            return (await get_emotion_state_store().load_async())["emotion_vector"]
+        col = get_async_collection("current_emotion")
+        if col is not None:
+            latest = await col.find_one(sort=[("timestamp", -1)])
+            return latest.get("emotion_vector", {}) if latest else {}
+    except Exception as e:
+        logger.error(f"[ERROR] 現在感情の読み込みに失敗: {e}")
+    return {}
+
+@timed("db.save_current_emotion")
+async def save_current_emotion_async(emotion_vector: dict):
+    try:
+        if EMOTION_STATE_STORE_ENABLED:
+            await get_emotion_state_store().save_async(emotion_vector, _now_utc_str())
+            remember("current_emotion", emotion_vector)
+            logger.info("[INFO] 現在感情をMongoDBに保存しました")
+            return
+        col = get_async_collection("current_emotion")
+        if col is not None:
+            entry = {
+                "timestamp": _now_utc_str(),
+                "emotion_vector": emotion_vector
+            }
+            await col.insert_one(entry)
+            remember("current_emotion", emotion_vector)
             logger.info("[INFO] 現在感情をMongoDBに保存しました")
     except Exception as e:
         logger.error(f"[ERROR] 現在感情の保存に失敗: {e}")
 
+# 現在感情に new を合成して保存し、合成後のベクトルを返す（merge_options は merge_emotion_vectors へ）。
+# 状態ストアでは読んだ version を expected_version に渡し、他のワーカーが先に書いていたら読み直して合成し直す。
+@timed("db.update_current_emotion")
+def update_current_emotion(new: dict, **merge_options) -> dict:
+    if not EMOTION_STATE_STORE_ENABLED:
+        merged = merge_emotion_vectors(load_current_emotion(), new, **merge_options)
+        save_current_emotion(merged)
+        return merged
+    merged = {}
+    try:
+        store = get_emotion_state_store()
+        for _ in range(EMOTION_STATE_MAX_RETRIES + 1):
+            state = store.load()
+            merged = merge_emotion_vectors(state["emotion_vector"], new, **merge_options)
+            if store.save(merged, _now_utc_str(), expected_version=state["version"]) is not None:
+                remember("current_emotion", merged)
+                logger.info("[INFO] 現在感情をMongoDBに保存しました")
+                return merged
+            logger.warning(f"⚠ 現在感情の更新が競合（version={state['version']}）→ 読み直して再合成")
+        logger.error(f"[ERROR] 現在感情の更新が {EMOTION_STATE_MAX_RETRIES + 1} 回競合したため保存を見送り")
+    except Exception as e:
+        logger.error(f"[ERROR] 現在感情の更新に失敗: {e}")
+    return merged
+
+@timed("db.update_current_emotion")
+async def update_current_emotion_async(new: dict, **merge_options) -> dict:
+    if not EMOTION_STATE_STORE_ENABLED:
+        merged = merge_emotion_vectors(await load_current_emotion_async(), new, **merge_options)
+        await save_current_emotion_async(merged)
+        return merged
+    merged = {}
+    try:
+        store = get_emotion_state_store()
+        for _ in range(EMOTION_STATE_MAX_RETRIES + 1):
+            state = await store.load_async()
+            merged = merge_emotion_vectors(state["emotion_vector"], new, **merge_options)
+            if await store.save_async(merged, _now_utc_str(), expected_version=state["version"]) is not None:
+                remember("current_emotion", merged)
+                logger.info("[INFO] 現在感情をMongoDBに保存しました")
+                return merged
+            logger.warning(f"⚠ 現在感情の更新が競合（version={state['version']}）→ 読み直して再合成")
+        logger.error(f"[ERROR] 現在感情の更新が {EMOTION_STATE_MAX_RETRIES + 1} 回競合したため保存を見送り")
+    except Exception as e:
+        logger.error(f"[ERROR] 現在感情の更新に失敗: {e}")
+    return merged
+
 # =========================
 # 感情ダイナミクス設定
 # =========================
@@ -131,6 +226,11 @@ ALPHA_MIN, ALPHA_MAX = 0.15, 0.45  # 新規ベクトルへの重み範囲
 
 HIGH_AROUSAL = {"怒り", "驚き", "恐れ"}
 
+# 1件ずつの合成（/chat の毎ターン）も32感情の配列（NumPy）で行うか。既定は dict 版：
+# 1件だけでは配列の組み立て・np.where の固定費が勝ち、dict 版の方が約5倍速い。
+# 配列版は複数の状態をまとめて合成する EmotionDynamics.merge_many / merge_batch（リプレイ等）で使う
+EMOTION_DYNAMICS_VECTORIZED = os.getenv("EMOTION_DYNAMICS_VECTORIZED", "0") == "1"
+
 # =========================
 # ダイナミクス関数
 # =========================
@@ -188,7 +288,7 @@ def _normalize(vec: dict) -> dict:
     total = sum(max(0.0, float(v)) for v in vec.values())
     if total <= 0:
         return {k: 0.0 for k in vec.keys()}
-    return {k: round(100.0 * max(0.0, float(v)) / total, 2) for k in vec.keys()}
+    return {k: round(100.0 * max(0.0, float(v)) / total, 2) for k, v in vec.items()}
 
 # =========================
 # 感情ベクトル合成
@@ -210,9 +310,22 @@ def merge_emotion_vectors(
     - ホメオスタシス（弱）
     - 適応的ブレンド（高覚醒時は反応速い）
 
-    互換のため weight_new/decay_factor 引数は受け取るが内部では未使用。
+    互換のため decay_factor 引数は受け取るが内部では未使用。
     """
     # 1) 型補正
+    corr_new = _correct_new_vector(new)
+    dt = _seconds_since(current_timestamp)
+
+    if EMOTION_DYNAMICS_VECTORIZED:
+        from module.emotion.emotion_dynamics import get_emotion_dynamics
+
+        merged = get_emotion_dynamics().merge(current, corr_new, dt, weight_new=weight_new, normalize=normalize)
+        if merged is not None:
+            return merged
+    return merge_emotion_dicts(current, corr_new, dt, weight_new=weight_new, normalize=normalize)
+
+# "喜び:40%" のようなキーを感情名に直し、数値にできない値は捨てる
+def _correct_new_vector(new: dict) -> dict:
     corr_new = {}
     for k, v in new.items():
         kk = k.split(":", 1)[0].strip() if isinstance(k, str) and ":" in k else k
@@ -220,9 +333,17 @@ def merge_emotion_vectors(
             corr_new[kk] = float(v)
         except (ValueError, TypeError):
             continue
+    return corr_new
 
+def merge_emotion_dicts(
+    current: dict,
+    corr_new: dict,
+    dt: float,
+    weight_new: float | None = None,
+    normalize: bool = True
+) -> dict:
+    """dict 版の合成本体（corr_new は型補正済み、dt は current からの経過秒）"""
     # 2) 時間減衰（currentに対して）
-    dt = _seconds_since(current_timestamp)
     decayed = _apply_time_decay(current, dt)
 
     # 3) 適応アルファ（新規寄与）
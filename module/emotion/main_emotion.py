@@ -2,43 +2,37 @@
 
 import os
 import json
-import re
 from datetime import datetime
 
 from module.utils.utils import logger
-from module.mongo.mongo_client import get_mongo_client
-from module.emotion.index_emotion import save_index_data
+from module.utils.metrics import timed
+from module.utils.json_block import find_json_block
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.emotion.index_emotion import save_index_data, save_index_data_async
+from module.response.memory_record_cache import get_memory_record_cache
+from module.emotion.personality_profile import record_long_emotion, record_long_emotion_async
+from module.llm.structured_output import storable_emotion_record
 from module.params import emotion_map, emotion_map_reverse
 
 
 # 応答テキストの中から感情構造JSONを抽出し、辞書形式で返す。
 # Extract emotion structure JSON from response text and return as a dictionary.
+# 同じリクエスト内（/chat 本体と背景タスク）の再パースは find_json_block のメモで省く
 def save_response_to_memory(response_text: str) -> dict | None:
     try:
         logger.debug("💾 save_response_to_memory 開始")  # save_response_to_memory start
 
-        # まず完全なJSONかどうかを試す
-        # First, try if it's a complete JSON
-        try:
-            parsed = json.loads(response_text)
-            logger.info(f"[INFO] JSONパース成功（直接）: {parsed}")  # JSON parse succeeded (direct)
-            return parsed
-        except json.JSONDecodeError:
-            logger.warning("⚠ JSONパース失敗。混在形式の可能性あり → 正規表現で抽出を試行")  # JSON parse failed, possibly mixed format → try extraction by regex
-
-        # 🔍 正規表現で { ... } ブロックを複数抽出し、末尾から順に試す
-        # Extract multiple { ... } blocks by regex and try from the end
-        matches = re.findall(r'({.*})', response_text, re.DOTALL)
-        if matches:
-            for match in reversed(matches):
-                try:
-                    parsed = json.loads(match)
-                    logger.info(f"[INFO] JSONパース成功（正規抽出）: {parsed}")  # JSON parse succeeded (regex extraction)
-                    return parsed
-                except json.JSONDecodeError as e:
-                    logger.warning(f"[WARN] 抽出JSONパース失敗: {e}")  # Extracted JSON parse failed
+        # 🔍 テキスト全体／混在形式のどちらも、末尾の { ... } ブロックを1回の走査で探す
+        # Find the trailing { ... } block in a single pass (whole-JSON or mixed text)
+        block = find_json_block(response_text)
+        if block is not None and block.data is not None:
+            logger.info(f"[INFO] JSONパース成功: {block.data}")  # JSON parse succeeded
+            return block.data
+        if block is None:
+            logger.warning("[WARN] JSON候補が見つかりません")  # No JSON candidate found
         else:
-            logger.warning("[WARN] 正規表現によるJSON候補抽出に失敗")  # Failed to extract JSON candidate by regex
+            logger.warning("[WARN] 抽出JSONパース失敗")  # Extracted JSON parse failed
 
     except Exception as e:
         logger.error(f"❌ 構造データ抽出中に例外発生: {e}")  # Exception occurred during structure data extraction
@@ -46,48 +40,74 @@ def save_response_to_memory(response_text: str) -> dict | None:
     logger.info("📭 JSON抽出に失敗。Noneを返します。")  # JSON extraction failed, returning None
     return None
 
+# 保存用ドキュメントを組み立てる（同期／非同期の保存処理で共用）。主感情が翻訳できなければ None。
+# Build the document to store (shared by sync / async writers). Returns None if the main emotion is unknown.
+def build_emotion_document(data: dict) -> dict | None:
+    # 主感情を英語に変換
+    # Convert main emotion to English
+    main_emotion_ja = data.get("主感情", "")
+    main_emotion_en = emotion_map_reverse.get(main_emotion_ja)
+    if not main_emotion_en:
+        logger.warning(f"⚠ 主感情が未定義または翻訳不可: {main_emotion_ja}")  # Main emotion undefined or not translatable
+        return None
+
+    # 重みに応じてカテゴリを決定
+    # Determine category based on weight
+    weight = int(data.get("重み", 0))
+    if weight >= 95:
+        category = "long"
+    elif weight >= 80:
+        category = "intermediate"
+    else:
+        category = "short"
+
+    # 保存形式整形
+    # Format for saving
+    return {
+        "emotion": main_emotion_en,
+        "category": category,
+        "data": data.copy(),
+        "履歴": [data.copy()]  # History
+    }
+
+# 保存した履歴を記憶レコードキャッシュにも入れる（直後の参照で emotion_data を引き直さない）
+# memory_lookup と同じく data.履歴[].date で引ける記録だけを、日付ごとに最初の1件入れる
+# Populate the memory record cache with what memory_lookup would return for the document just written
+def cache_written_record(document: dict):
+    cache = get_memory_record_cache()
+    if cache is None:
+        return
+    history = (document.get("data") or {}).get("履歴") or []
+    seen = set()
+    for record in history:
+        date = record.get("date") if isinstance(record, dict) else None
+        if not date or date in seen:
+            continue
+        seen.add(date)
+        cache.put_written(document["emotion"], document["category"], date, record)
+
 # 抽出済みの感情構造データ（JSON）を MongoDB Atlas の emotion_db.emotion_data に保存する。
 # Save the extracted emotion structure data (JSON) to MongoDB Atlas emotion_db.emotion_data.
+@timed("db.write_structured_emotion_data")
 def write_structured_emotion_data(data: dict):
     try:
-        client = get_mongo_client()
-        if client is None:
+        collection = get_collection("emotion_data")
+        if collection is None:
             logger.error("❌ MongoDBクライアント取得に失敗")  # Failed to obtain MongoDB client
             return
 
-        db = client["emotion_db"]
-        collection = db["emotion_data"]
-
-        # 主感情を英語に変換
-        # Convert main emotion to English
-        main_emotion_ja = data.get("主感情", "")
-        main_emotion_en = emotion_map_reverse.get(main_emotion_ja)
-        if not main_emotion_en:
-            logger.warning(f"⚠ 主感情が未定義または翻訳不可: {main_emotion_ja}")  # Main emotion undefined or not translatable
+        document = build_emotion_document(data)
+        if document is None:
             return
-
-        # 重みに応じてカテゴリを決定
-        # Determine category based on weight
-        weight = int(data.get("重み", 0))
-        if weight >= 95:
-            category = "long"
-        elif weight >= 80:
-            category = "intermediate"
-        else:
-            category = "short"
-
-        # 保存形式整形
-        # Format for saving
-        document = {
-            "emotion": main_emotion_en,
-            "category": category,
-            "data": data.copy(),
-            "履歴": [data.copy()]  # History
-        }
+        main_emotion_en = document["emotion"]
+        category = document["category"]
 
         # MongoDBへ保存（新規挿入）
         # Save to MongoDB (insert)
         result = collection.insert_one(document)
+        cache_written_record(document)
+        if category == "long":
+            record_long_emotion(main_emotion_en)
         logger.info(f"✅ MongoDB保存成功: _id={result.inserted_id}, 感情={main_emotion_en}, カテゴリ={category}")  # MongoDB save successful
         
         # 🔄 インデックスにも同時保存
@@ -103,3 +123,57 @@ def write_structured_emotion_data(data: dict):
 
     except Exception as e:
         logger.error(f"❌ 感情構造データ保存失敗: {e}")  # Failed to save emotion structure data
+
+# 非同期版（/chat のイベントループから呼ぶ）
+# Async variant called from the /chat event loop
+@timed("db.write_structured_emotion_data")
+async def write_structured_emotion_data_async(data: dict):
+    try:
+        collection = get_async_collection("emotion_data")
+        if collection is None:
+            logger.error("❌ MongoDBクライアント取得に失敗")  # Failed to obtain MongoDB client
+            return
+
+        document = build_emotion_document(data)
+        if document is None:
+            return
+        main_emotion_en = document["emotion"]
+        category = document["category"]
+
+        result = await collection.insert_one(document)
+        cache_written_record(document)
+        if category == "long":
+            await record_long_emotion_async(main_emotion_en)
+        logger.info(f"✅ MongoDB保存成功: _id={result.inserted_id}, 感情={main_emotion_en}, カテゴリ={category}")  # MongoDB save successful
+
+        if "date" in data:
+            await save_index_data_async(
+                data=data,
+                emotion_en=main_emotion_en,
+                category=category
+            )
+        else:
+            logger.warning("⚠ dateが存在しないためインデックス保存スキップ")  # Skipped index saving because date is missing
+
+    except Exception as e:
+        logger.error(f"❌ 感情構造データ保存失敗: {e}")  # Failed to save emotion structure data
+
+# LLM 応答から取り出し済みの感情データ（末尾JSON／構造化出力／応答キャッシュ）を保存する。
+# 表示用テキストは JSON を除いてあるので再パースしない。保存した記録（無ければ None）を返す。
+# Persist the emotion data already parsed from the reply instead of re-parsing the display text
+def reply_emotion_record(final_emotion: dict | None) -> dict | None:
+    if not final_emotion:
+        return None
+    return storable_emotion_record(final_emotion)
+
+def store_reply_emotion(final_emotion: dict | None) -> dict | None:
+    record = reply_emotion_record(final_emotion)
+    if record:
+        write_structured_emotion_data(record)
+    return record
+
+async def store_reply_emotion_async(final_emotion: dict | None) -> dict | None:
+    record = reply_emotion_record(final_emotion)
+    if record:
+        await write_structured_emotion_data_async(record)
+    return record
@@ -0,0 +1,202 @@
+# module/emotion/personality_profile.py
+import os
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.utils.utils import logger
+from module.utils.metrics import counter, timed
+
+# 人格傾向（long カテゴリの主感情ごとの件数）を、集計済みの小さなドキュメントとして持つ。
+# long 保存時に $inc で1件ずつ足す。$group での全件集計はプロファイルが無いときと、
+# 手動（python -m module.emotion.personality_profile）で誤差を戻すときだけ
+# （忘却は short / intermediate だけが対象なので long の件数は変わらない）。
+# 読む側はプロセス内のコピーを使い、PERSONALITY_PROFILE_TTL_SEC ごとにドキュメント1件を読み直すだけ
+# （emotion_data の long を毎回全件走査しない）。
+# Materialized personality profile: per-emotion counts of 'long' memories, maintained incrementally.
+
+PERSONALITY_PROFILE_ENABLED = os.getenv("PERSONALITY_PROFILE_ENABLED", "1") == "1"
+PERSONALITY_PROFILE_TTL_SEC = float(os.getenv("PERSONALITY_PROFILE_TTL_SEC", "300"))
+
+PROFILE_COLLECTION = "personality_profile"
+PROFILE_ID = "long_emotions"
+
+PROFILE_EVENTS = counter(
+    "yumia_personality_profile_events_total", "Personality profile reads / increments / rebuilds", ("event",)
+)
+
+_lock = threading.Lock()
+_counts = None  # Counter（未読込なら None）
+_loaded_at = 0.0
+
+
+def _fresh_counts() -> Counter | None:
+    with _lock:
+        if _counts is not None and time.monotonic() - _loaded_at < PERSONALITY_PROFILE_TTL_SEC:
+            PROFILE_EVENTS.inc(event="hit")
+            return Counter(_counts)
+    return None
+
+
+def _set_counts(counts: dict) -> Counter:
+    global _counts, _loaded_at
+    with _lock:
+        _counts = Counter({k: v for k, v in counts.items() if v > 0})
+        _loaded_at = time.monotonic()
+        return Counter(_counts)
+
+
+def _apply_local(emotion_en: str, delta: int):
+    with _lock:
+        if _counts is not None:
+            _counts[emotion_en] += delta
+            if _counts[emotion_en] <= 0:
+                del _counts[emotion_en]
+
+
+def invalidate_personality_profile():
+    global _counts
+    with _lock:
+        _counts = None
+
+
+def _group_pipeline() -> list[dict]:
+    return [
+        {"$match": {"category": "long"}},
+        {"$group": {"_id": "$emotion", "count": {"$sum": 1}}}
+    ]
+
+
+def _profile_document(rows: list[dict]) -> dict:
+    # "Joy" と "Joy " のように空白だけ違う値は、従来の全件走査と同じく1つの感情として足し合わせる
+    counts = Counter()
+    for row in rows:
+        name = str(row.get("_id") or "").strip()
+        if name:
+            counts[name] += row["count"]
+    return {"counts": dict(counts), "total": sum(counts.values()), "rebuilt_at": datetime.now(timezone.utc)}
+
+
+# =========================
+# 差分更新（保存・忘却時）
+# =========================
+
+def _increment_update(emotion_en: str, delta: int) -> dict:
+    return {
+        "$inc": {f"counts.{emotion_en}": delta, "total": delta},
+        "$set": {"updated_at": datetime.now(timezone.utc)}
+    }
+
+
+def record_long_emotion(emotion_en: str, delta: int = 1):
+    """long の記憶を保存（delta=1）／削除（delta=-1）したときに呼ぶ"""
+    if not PERSONALITY_PROFILE_ENABLED or not emotion_en:
+        return
+    try:
+        collection = get_collection(PROFILE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        result = collection.update_one({"_id": PROFILE_ID}, _increment_update(emotion_en, delta))
+        if result.matched_count == 0:
+            # プロファイルがまだ無い：1感情だけのプロファイルを作らず、保存済みの分も含めて集計する
+            rebuild_personality_profile()
+            return
+        _apply_local(emotion_en, delta)
+        PROFILE_EVENTS.inc(event="increment")
+    except Exception as e:
+        logger.warning(f"⚠ 人格プロファイルの更新に失敗（次回の再集計で反映）: {e}")
+        invalidate_personality_profile()
+
+
+async def record_long_emotion_async(emotion_en: str, delta: int = 1):
+    if not PERSONALITY_PROFILE_ENABLED or not emotion_en:
+        return
+    try:
+        collection = get_async_collection(PROFILE_COLLECTION)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        result = await collection.update_one({"_id": PROFILE_ID}, _increment_update(emotion_en, delta))
+        if result.matched_count == 0:
+            await rebuild_personality_profile_async()
+            return
+        _apply_local(emotion_en, delta)
+        PROFILE_EVENTS.inc(event="increment")
+    except Exception as e:
+        logger.warning(f"⚠ 人格プロファイルの更新に失敗（次回の再集計で反映）: {e}")
+        invalidate_personality_profile()
+
+
+# =========================
+# 再集計（初回・手動）
+# =========================
+
+@timed("db.rebuild_personality_profile")
+def rebuild_personality_profile() -> Counter:
+    """emotion_data の long を $group で数え直し、プロファイルを置き換える"""
+    data_collection = get_collection("emotion_data")
+    profile_collection = get_collection(PROFILE_COLLECTION)
+    if data_collection is None or profile_collection is None:
+        raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+    document = _profile_document(list(data_collection.aggregate(_group_pipeline())))
+    profile_collection.replace_one({"_id": PROFILE_ID}, document, upsert=True)
+    counts = _set_counts(document["counts"])
+    PROFILE_EVENTS.inc(event="rebuild")
+    logger.info(f"🧭 人格プロファイルを再集計: long {document['total']} 件 / {len(document['counts'])} 種")
+    return counts
+
+
+@timed("db.rebuild_personality_profile")
+async def rebuild_personality_profile_async() -> Counter:
+    data_collection = get_async_collection("emotion_data")
+    profile_collection = get_async_collection(PROFILE_COLLECTION)
+    if data_collection is None or profile_collection is None:
+        raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+    cursor = await data_collection.aggregate(_group_pipeline())
+    document = _profile_document(await cursor.to_list(None))
+    await profile_collection.replace_one({"_id": PROFILE_ID}, document, upsert=True)
+    counts = _set_counts(document["counts"])
+    PROFILE_EVENTS.inc(event="rebuild")
+    logger.info(f"🧭 人格プロファイルを再集計: long {document['total']} 件 / {len(document['counts'])} 種")
+    return counts
+
+
+# =========================
+# 読み出し
+# =========================
+
+@timed("db.load_personality_profile")
+def load_personality_counts() -> Counter:
+    """主感情（英語）ごとの long 件数。プロファイルがまだ無ければ集計して作る"""
+    counts = _fresh_counts()
+    if counts is not None:
+        return counts
+    collection = get_collection(PROFILE_COLLECTION)
+    if collection is None:
+        raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+    document = collection.find_one({"_id": PROFILE_ID})
+    if document is None:
+        return rebuild_personality_profile()
+    PROFILE_EVENTS.inc(event="load")
+    return _set_counts(document.get("counts", {}))
+
+
+@timed("db.load_personality_profile")
+async def load_personality_counts_async() -> Counter:
+    counts = _fresh_counts()
+    if counts is not None:
+        return counts
+    collection = get_async_collection(PROFILE_COLLECTION)
+    if collection is None:
+        raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+    document = await collection.find_one({"_id": PROFILE_ID})
+    if document is None:
+        return await rebuild_personality_profile_async()
+    PROFILE_EVENTS.inc(event="load")
+    return _set_counts(document.get("counts", {}))
+
+
+if __name__ == "__main__":
+    rebuild_personality_profile()
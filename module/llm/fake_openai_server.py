@@ -0,0 +1,273 @@
+# module/llm/fake_openai_server.py
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from module.utils.utils import logger
+from module.params import emotion_map
+
+# OpenAI 互換の chat.completions を返すローカルの代役サーバー（負荷試験・オフライン開発用）。
+# 応答は emotion_prompt の出力形式（応答文 + 構成比の一文 + 末尾の感情JSON）に合わせて組み立てる。
+# 応答時間の分布・ストリーミングの速さ・エラーの混入率を環境変数で変えられる。
+#   起動: python -m module.llm.fake_openai_server --port 8001
+#   接続: OPENAI_BASE_URL=http://127.0.0.1:8001/v1 で本体を起動（llm_client がこのURLへ向ける）
+# OpenAI-compatible stand-in server for offline load testing of /chat.
+
+# 応答時間（ストリーミングでは最初のトークンまで）の分布: lognormal | uniform | constant
+FAKE_LLM_LATENCY_DIST = os.getenv("FAKE_LLM_LATENCY_DIST", "lognormal")
+FAKE_LLM_LATENCY_MEDIAN_SEC = float(os.getenv("FAKE_LLM_LATENCY_MEDIAN_SEC", "1.2"))
+# lognormal の σ（大きいほど裾が重い）／ uniform の幅（中央値 ± この秒数）
+FAKE_LLM_LATENCY_SPREAD = float(os.getenv("FAKE_LLM_LATENCY_SPREAD", "0.5"))
+# ストリーミング時のトークン送出速度（0 以下で待たない）
+FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "40"))
+# エラー混入率と返すステータス、ハング（応答を返さない）率と待つ秒数
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_ERROR_STATUSES = tuple(int(s) for s in os.getenv("FAKE_LLM_ERROR_STATUSES", "429,500,503").split(",") if s)
+FAKE_LLM_HANG_RATE = float(os.getenv("FAKE_LLM_HANG_RATE", "0"))
+FAKE_LLM_HANG_SEC = float(os.getenv("FAKE_LLM_HANG_SEC", "120"))
+# 乱数の種（指定すれば応答時間・エラーの出方を再現できる）
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED")
+
+# ストリーミング1チャンクあたりの文字数
+STREAM_CHUNK_CHARS = 3
+
+REPLY_TEMPLATES = (
+    "そうなんですね。{topic}のお話、ちゃんと聞いていますよ。",
+    "{topic}のこと、教えてくれてありがとうございます。少し考えてみますね。",
+    "なるほど、{topic}ですか。あなたと話していると、いろいろな気持ちが動きます。",
+    "{topic}について、私も覚えておきたいと思いました。",
+)
+
+
+class FakeLLMBehaviour:
+    """応答時間・エラーの出方。既定値は環境変数から"""
+
+    def __init__(
+        self,
+        latency_dist: str = FAKE_LLM_LATENCY_DIST,
+        latency_median: float = FAKE_LLM_LATENCY_MEDIAN_SEC,
+        latency_spread: float = FAKE_LLM_LATENCY_SPREAD,
+        tokens_per_sec: float = FAKE_LLM_TOKENS_PER_SEC,
+        error_rate: float = FAKE_LLM_ERROR_RATE,
+        error_statuses: tuple = FAKE_LLM_ERROR_STATUSES,
+        hang_rate: float = FAKE_LLM_HANG_RATE,
+        hang_sec: float = FAKE_LLM_HANG_SEC,
+        seed=FAKE_LLM_SEED
+    ):
+        self.latency_dist = latency_dist
+        self.latency_median = latency_median
+        self.latency_spread = latency_spread
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses or (500,)
+        self.hang_rate = hang_rate
+        self.hang_sec = hang_sec
+        self._random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        if self.latency_median <= 0:
+            return 0.0
+        if self.latency_dist == "constant":
+            return self.latency_median
+        if self.latency_dist == "uniform":
+            return max(self._random.uniform(self.latency_median - self.latency_spread, self.latency_median + self.latency_spread), 0.0)
+        # lognormal: 中央値 = exp(μ)
+        return self._random.lognormvariate(0.0, self.latency_spread) * self.latency_median
+
+    def sample_failure(self) -> int | str | None:
+        """失敗させるならステータスコードか "hang"、成功なら None"""
+        roll = self._random.random()
+        if roll < self.hang_rate:
+            return "hang"
+        if roll < self.hang_rate + self.error_rate:
+            return self._random.choice(self.error_statuses)
+        return None
+
+    def token_interval(self) -> float:
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+
+# =========================
+# 応答の組み立て
+# =========================
+
+def _last_user_text(messages: list) -> str:
+    for message in reversed(messages or []):
+        if message.get("role") == "user":
+            content = message.get("content") or ""
+            # build_user_prompt の「ユーザー発言: ...」行があればそれを使う
+            for line in str(content).splitlines():
+                if line.startswith("ユーザー発言:"):
+                    return line.split(":", 1)[1].strip()
+            return str(content)
+    return ""
+
+
+def build_fake_emotion(user_text: str) -> dict:
+    """入力から決定的に感情構造を作る（同じ入力なら同じ構造）"""
+    seed = int(hashlib.sha1(user_text.encode("utf-8")).hexdigest()[:8], 16)
+    picker = random.Random(seed)
+    names = list(emotion_map.values())
+    chosen = picker.sample(names, k=min(3, len(names)))
+    first = picker.choice((40, 50, 60))
+    second = (100 - first) // 2 + picker.choice((0, 10))
+    composition = {chosen[0]: first, chosen[1]: second, chosen[2]: 100 - first - second}
+    topic = user_text.strip()[:12] or "今日"
+    keywords = [w for w in (topic[:4], topic[4:8]) if w] or ["会話"]
+    return {
+        "date": "",
+        "データ種別": "emotion",
+        "重み": picker.randint(20, 80),
+        "主感情": chosen[0],
+        "構成比": composition,
+        "状況": f"ユーザーが「{topic}」について話した場面",
+        "心理反応": "話を受け止めて、穏やかに応じようとした",
+        "関係性変化": "会話を通して少し距離が縮まった",
+        "関連": [topic[:6] or "会話"],
+        "keywords": keywords
+    }
+
+
+def build_fake_reply(user_text: str) -> tuple[str, dict]:
+    emotion = build_fake_emotion(user_text)
+    seed = int(hashlib.sha1(user_text.encode("utf-8")).hexdigest()[8:16], 16)
+    topic = user_text.strip()[:12] or "今日"
+    sentence = REPLY_TEMPLATES[seed % len(REPLY_TEMPLATES)].format(topic=topic)
+    ratio = "、".join(f"{name}:{value}%" for name, value in emotion["構成比"].items())
+    return f"{sentence}\n（感情　{ratio}）", emotion
+
+
+def _structured_emotion(emotion: dict) -> dict:
+    structured = {k: v for k, v in emotion.items() if k not in ("date", "データ種別")}
+    structured["構成比"] = [{"感情": name, "割合": value} for name, value in emotion["構成比"].items()]
+    return structured
+
+
+def build_completion_content(body: dict) -> tuple[str | None, list | None]:
+    """(content, tool_calls)。response_format / tools が指定されていれば構造化出力の形で返す"""
+    text, emotion = build_fake_reply(_last_user_text(body.get("messages")))
+    structured = json.dumps({"response": text, "emotion": _structured_emotion(emotion)}, ensure_ascii=False)
+    tools = body.get("tools") or []
+    if tools:
+        name = tools[0].get("function", {}).get("name", "tool")
+        call = {"id": "call_fake", "type": "function", "function": {"name": name, "arguments": structured}}
+        return None, [call]
+    if (body.get("response_format") or {}).get("type") == "json_schema":
+        return structured, None
+    return f"{text}\n\n{json.dumps(emotion, ensure_ascii=False, indent=2)}", None
+
+
+def _usage(body: dict, content: str) -> dict:
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages") or [])
+    return {"prompt_tokens": prompt_chars, "completion_tokens": len(content), "total_tokens": prompt_chars + len(content)}
+
+
+def _completion_response(body: dict, completion_id: str, created: int) -> dict:
+    content, tool_calls = build_completion_content(body)
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+        "usage": _usage(body, content or tool_calls[0]["function"]["arguments"])
+    }
+
+
+def _chunk(completion_id: str, created: int, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream_completion(body: dict, completion_id: str, created: int, behaviour: FakeLLMBehaviour):
+    model = body.get("model", "fake")
+    content, _ = build_completion_content({**body, "tools": None})
+    yield _chunk(completion_id, created, model, {"role": "assistant", "content": ""})
+    interval = behaviour.token_interval()
+    for i in range(0, len(content), STREAM_CHUNK_CHARS):
+        if interval:
+            await asyncio.sleep(interval)
+        yield _chunk(completion_id, created, model, {"content": content[i:i + STREAM_CHUNK_CHARS]})
+    yield _chunk(completion_id, created, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+def _error_response(status: int) -> JSONResponse:
+    error_type = "rate_limit_error" if status == 429 else "server_error"
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"fake {status}（FAKE_LLM_ERROR_RATE による注入）", "type": error_type, "code": None}}
+    )
+
+
+# =========================
+# アプリ
+# =========================
+
+def create_app(behaviour: FakeLLMBehaviour | None = None) -> FastAPI:
+    behaviour = behaviour or FakeLLMBehaviour()
+    app = FastAPI(title="fake-openai")
+    app.state.behaviour = behaviour
+    app.state.requests = 0
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "created": 0, "owned_by": "local"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        completion_id = f"chatcmpl-fake-{app.state.requests}"
+        created = int(time.time())
+
+        # 失敗の注入（ハングは呼び出し側のタイムアウトを試すためのもの）
+        failure = behaviour.sample_failure()
+        if failure == "hang":
+            await asyncio.sleep(behaviour.hang_sec)
+            return _error_response(504)
+        # 応答時間（ストリーミングでは最初のトークンまで）
+        latency = behaviour.sample_latency()
+        if latency:
+            await asyncio.sleep(latency)
+        if failure is not None:
+            return _error_response(failure)
+
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream_completion(body, completion_id, created, behaviour),
+                media_type="text/event-stream"
+            )
+        return _completion_response(body, completion_id, created)
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI 互換のローカル代役サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    logger.info(f"🧪 fake OpenAI サーバーを起動: http://{args.host}:{args.port}/v1 （分布={FAKE_LLM_LATENCY_DIST}, 中央値={FAKE_LLM_LATENCY_MEDIAN_SEC}秒, エラー率={FAKE_LLM_ERROR_RATE}）")
+    uvicorn.run(app, host=args.host, port=args.port)
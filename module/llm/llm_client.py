@@ -1,46 +1,60 @@
-from openai import OpenAI
-import re
+from openai import OpenAI, AsyncOpenAI
 import json
 import os
+import copy
 import threading
+import contextvars
 from datetime import datetime
 
-from module.utils.utils import load_system_prompt_cached, load_dialogue_prompt, logger
+from module.utils.utils import logger
+from module.utils.metrics import span
+from module.utils.single_flight import SingleFlight
+from module.llm.stream_filter import JsonTailFilter
+from module.utils.json_block import find_json_block, strip_json_block
+from module.llm.structured_output import (
+    STRUCTURED_OUTPUT_MODE,
+    completion_kwargs,
+    parse_structured_message,
+    storable_emotion_record,
+    to_emotion_data,
+)
+from module.llm.response_cache import get_response_cache, response_cache_key
+from module.llm.prompt_builder import build_prompt_messages
+from module.llm.resilient_completion import Deadline, LLM_DEADLINE_SEC, create_completion, create_completion_async
 from module.params import (
     OPENAI_MODEL,
     OPENAI_TEMPERATURE,
     OPENAI_TOP_P,
     OPENAI_MAX_TOKENS
 )
-from module.emotion.basic_personality import get_top_long_emotions
+from module.emotion.basic_personality import get_top_long_emotions, get_top_long_emotions_async
 from module.voice.voice_processing import generate_voicevox_settings_from_composition
 from module.live2d.live2d_processing import generate_live2d_from_composition
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OPENAI_BASE_URL を指定すると OpenAI 互換の別サーバーへ向ける
+# （例: ローカルの代役サーバー module/llm/fake_openai_server.py → http://127.0.0.1:8001/v1）
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# 代役サーバーはキーを見ないので、未設定でもクライアントを作れるようにする
+_api_key = os.getenv("OPENAI_API_KEY") or ("sk-local" if OPENAI_BASE_URL else None)
+if OPENAI_BASE_URL:
+    logger.info(f"🧪 LLM の接続先: {OPENAI_BASE_URL}")
+
+client = OpenAI(api_key=_api_key, base_url=OPENAI_BASE_URL)
+async_client = AsyncOpenAI(api_key=_api_key, base_url=OPENAI_BASE_URL)
+
+# 同じ発言・同じ気分・同じ参照記憶の生成が進行中なら、OpenAI を呼ばずにその結果を待って受け取る
+# （複数タブや再送で同じメッセージが同時に来た場合）。受け取った側は感情データを書き換えるのでコピーを渡す
+_completion_flight = SingleFlight("llm_completion", copy_result=True)
 
-# 応答テキスト末尾からJSONブロックを抽出
+# 応答テキスト末尾からJSONブロックを抽出（走査結果は find_json_block がリクエスト単位でメモする）
 def extract_emotion_json_block(response_text: str) -> dict | None:
     logger.info("JSON抽出プロセス開始")
 
-    # パターン1：```json ... ``` ブロック
-    match = re.search(r"```json\s*({.*?})\s*```", response_text, re.DOTALL)
-    if match:
-        try:
-            parsed = json.loads(match.group(1))
-            logger.info("Markdown形式でのJSON抽出成功")
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.warning(f"Markdown JSON抽出失敗: {e}")
-
-    # パターン2：普通の {...} ブロック
-    matches = re.findall(r'({.*})', response_text, re.DOTALL)
-    for raw in reversed(matches):
-        try:
-            parsed = json.loads(raw)
-            logger.info("フォールバック正規表現でのJSON抽出成功")
-            return parsed
-        except json.JSONDecodeError:
-            continue
+    # ```json フェンス付き・裸の {...} のどちらも1回の走査で探す
+    block = find_json_block(response_text)
+    if block is not None and block.data is not None:
+        logger.info("JSON抽出成功")
+        return block.data
 
     logger.warning("JSON抽出失敗。response_textは構造化されていない可能性あり")
     return None
@@ -50,152 +64,335 @@ def extract_emotion_json_block(response_text: str) -> dict | None:
 def generate_emotion_from_prompt_with_context(
     user_input: str,
     emotion_structure: dict,
-    best_match: dict | None
+    best_match: dict | None,
+    memories: list[dict] | None = None
 ) -> tuple[str, dict]:
     generation_time = datetime.now().strftime("%Y%m%d%H%M%S")
 
-    system_prompt = (
-        load_system_prompt_cached()
-        + "\n\n"
-        + load_dialogue_prompt()
+    # 応答キャッシュ（同じ発言・同じ気分・同じ参照記憶なら LLM を呼ばない）
+    cache_key, cached = lookup_response_cache(user_input, best_match)
+    if cached is not None:
+        return finalize_cached_reply(cached, generation_time)
+
+    return _completion_flight.do(
+        cache_key, _generate_reply, user_input, best_match, memories, generation_time, cache_key
     )
 
-    # 人格傾向
-    top4_personality = get_top_long_emotions()
-    personality_text = "\n【人格傾向】\nこのAIは以下の感情を持つ傾向があります：\n"
-    if top4_personality:
-        for emotion, count in top4_personality:
-            personality_text += f"・{emotion}（{count}回）\n"
-    else:
-        personality_text += "傾向情報がまだ十分にありません。\n"
 
+def _generate_reply(
+    user_input: str,
+    best_match: dict | None,
+    memories: list[dict] | None,
+    generation_time: str,
+    cache_key: str
+) -> tuple[str, dict]:
     # 参照データ
-    reference_text = "\n\n【AI自身の記憶（参考感情データ）】\n"
-    if best_match is None:
-        reference_text += "参照可能な記憶は見つかりませんでした。通常の方針で応答してください。\n"
-    else:
+    history_data = None
+    if best_match is not None:
         from module.response.main_response import collect_all_category_responses
 
-        emotion_name = best_match.get("emotion")
-        date_str = best_match.get("date")
-        history_data = collect_all_category_responses(emotion_name, date_str)
+        history_data = collect_all_category_responses(best_match.get("emotion"), best_match.get("date"))
 
-        reference_emotions = []
-        for category in ["short", "intermediate", "long"]:
-            data = history_data.get(category)
-            if data:
-                reference_emotions.append(data)
+    # プロンプト（人格傾向＋参照データ。入力予算を超える記憶ケースは切り詰め／省略）
+    messages, _ = build_prompt_messages(user_input, get_top_long_emotions(), best_match, history_data, memories)
 
-        reference_text += (
-            "以下は、あなた自身（AI）がこれまでに経験・記録した感情の記憶です。\n"
-            "各ケースは実際のユーザーとの対話に基づいて記録されたものであり、あなたの内的な記憶として保存されています。\n"
-            "これらの記憶を参照しながら、自然で一貫性のある応答を構成してください。\n"
-        )
-        for i, item in enumerate(reference_emotions, 1):
-            reference_text += f"\n● 記憶ケース{i}\n"
-            reference_text += f"主感情: {item.get('主感情')}\n"
-            reference_text += f"構成比: {item.get('構成比')}\n"
-            reference_text += f"状況: {item.get('状況')}\n"
-            reference_text += f"心理反応: {item.get('心理反応')}\n"
-            reference_text += f"キーワード: {', '.join(item.get('keywords', []))}\n"
-
-    # プロンプト
-    prompt = (
-        f"{personality_text}\n"
-        f"ユーザー発言: {user_input}\n"
-        f"{reference_text}\n\n"
-        f"【指示】上記の（あれば）感情参照データと人格傾向を参考に、emotion_promptのルールに従って応答を生成してください。\n"
-        f"自然な応答 + 構成比 + JSON形式の感情構造の順で出力してください。"
+    try:
+        # LLM呼び出し（締め切り・再試行・ヘッジ・フォールバックモデル付き）
+        with span("llm.openai_completion"):
+            response = create_completion(
+                client,
+                OPENAI_MODEL,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=OPENAI_TEMPERATURE,
+                top_p=OPENAI_TOP_P,
+                **completion_kwargs()
+            )
+
+        result = finalize_completion_message(response.choices[0].message, generation_time)
+        store_response_cache(cache_key, result)
+        return result
+
+    except Exception as e:
+        logger.error(f"[ERROR] 応答生成失敗: {e}")
+        return "応答生成でエラーが発生しました。", {}
+
+
+# 非同期版：Mongo は async クライアント、LLM は AsyncOpenAI で呼ぶ（イベントループをブロックしない）
+async def generate_emotion_from_prompt_with_context_async(
+    user_input: str,
+    emotion_structure: dict,
+    best_match: dict | None,
+    memories: list[dict] | None = None
+) -> tuple[str, dict]:
+    generation_time = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # 応答キャッシュ（同じ発言・同じ気分・同じ参照記憶なら LLM を呼ばない）
+    cache_key, cached = await lookup_response_cache_async(user_input, best_match)
+    if cached is not None:
+        return finalize_cached_reply(cached, generation_time)
+
+    return await _completion_flight.do_async(
+        cache_key, _generate_reply_async, user_input, best_match, memories, generation_time, cache_key
     )
 
-    try:
-        # LLM呼び出し
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=OPENAI_MAX_TOKENS,
-            temperature=OPENAI_TEMPERATURE,
-            top_p=OPENAI_TOP_P
-        )
 
-        # LLMからの生テキスト応答
-        full_response = response.choices[0].message.content.strip()
-
-        # JSON抽出
-        emotion_data = extract_emotion_json_block(full_response)
-
-        if emotion_data:
-            emotion_data["date"] = generation_time
-
-            # 構成比が文字列ならパース
-            if "構成比" in emotion_data:
-                while isinstance(emotion_data["構成比"], str):
-                    try:
-                        emotion_data["構成比"] = json.loads(emotion_data["構成比"])
-                    except json.JSONDecodeError:
-                        break
-
-            logger.debug(f"[DEBUG] 構成比 type: {type(emotion_data.get('構成比'))}")
-            logger.debug(f"[DEBUG] 構成比 内容: {emotion_data.get('構成比')}")
-
-            if isinstance(emotion_data.get("構成比"), dict):
-                # VoiceVox設定
-                vv_settings = generate_voicevox_settings_from_composition(
-                    composition=emotion_data["構成比"],
-                    speaker_id=3,     # ずんだもん固定
-                    topn=5,
-                    prev_settings=None,
-                    smooth_alpha=0.7
-                )
-                emotion_data["voicevox_settings"] = vv_settings
-
-                # Live2D設定
-                live2d_settings = generate_live2d_from_composition(
-                    composition=emotion_data["構成比"],
-                    topn=None,
-                    prev_params=None,
-                    smooth_alpha=0.6,
-                    min_ratio=None
-                )
-                emotion_data["live2d"] = live2d_settings
-
-                # 感情更新を別スレッドで実行
-                threading.Thread(
-                    target=run_emotion_update_pipeline,
-                    args=(emotion_data["構成比"],)
-                ).start()
-
-            # 応答テキストからJSON部分を除去
-            clean_response = re.sub(r"```json\s*\{.*?\}\s*```", "", full_response, flags=re.DOTALL).strip()
-            return clean_response, emotion_data
-
-        return full_response, {}
+async def _generate_reply_async(
+    user_input: str,
+    best_match: dict | None,
+    memories: list[dict] | None,
+    generation_time: str,
+    cache_key: str
+) -> tuple[str, dict]:
+    messages = await build_messages_async(user_input, best_match, memories)
+
+    try:
+        # LLM呼び出し（締め切り・再試行・ヘッジ・フォールバックモデル付き）
+        with span("llm.openai_completion"):
+            response = await create_completion_async(
+                async_client,
+                OPENAI_MODEL,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=OPENAI_TEMPERATURE,
+                top_p=OPENAI_TOP_P,
+                **completion_kwargs()
+            )
+
+        result = finalize_completion_message(response.choices[0].message, generation_time)
+        await store_response_cache_async(cache_key, result)
+        return result
 
     except Exception as e:
         logger.error(f"[ERROR] 応答生成失敗: {e}")
         return "応答生成でエラーが発生しました。", {}
 
 
+# ストリーミング版：("token", 表示テキスト) を届いた順に返し、最後に ("final", (応答, 感情データ)) を返す。
+# 末尾の感情JSONは表示テキストに含めない（JsonTailFilter で保留し、完了後にパースする）。
+# Streaming variant: yields visible tokens as they arrive, then the parsed result.
+async def stream_emotion_from_prompt_with_context_async(
+    user_input: str,
+    emotion_structure: dict,
+    best_match: dict | None,
+    memories: list[dict] | None = None
+):
+    # 構造化出力では応答文が JSON の1フィールドになるので、完成を待って1回で流す
+    if STRUCTURED_OUTPUT_MODE != "off":
+        final_response, emotion_data = await generate_emotion_from_prompt_with_context_async(
+            user_input, emotion_structure, best_match, memories
+        )
+        yield "token", final_response
+        yield "final", (final_response, emotion_data)
+        return
+
+    generation_time = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    cache_key, cached = await lookup_response_cache_async(user_input, best_match)
+    if cached is not None:
+        final_response, emotion_data = finalize_cached_reply(cached, generation_time)
+        yield "token", strip_json_block(final_response)
+        yield "final", (final_response, emotion_data)
+        return
+
+    messages = await build_messages_async(user_input, best_match, memories)
+    tail_filter = JsonTailFilter()
+
+    try:
+        with span("llm.openai_stream"):
+            # ストリームはヘッジしない（開始までの失敗だけ再試行）。締め切りは受信中も見る
+            deadline = Deadline(LLM_DEADLINE_SEC)
+            stream = await create_completion_async(
+                async_client,
+                OPENAI_MODEL,
+                hedge=False,
+                deadline=deadline,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                temperature=OPENAI_TEMPERATURE,
+                top_p=OPENAI_TOP_P,
+                stream=True
+            )
+            first_token = True
+            async for chunk in stream:
+                if deadline.remaining() <= 0:
+                    await stream.close()
+                    raise TimeoutError("ストリーミング応答が締め切りまでに終わりませんでした")
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                visible = tail_filter.feed(delta)
+                if visible:
+                    if first_token:
+                        logger.debug("⚡ 最初のトークンを送信")
+                        first_token = False
+                    yield "token", visible
+
+        rest = tail_filter.finish()
+        if rest:
+            yield "token", rest
+        result = finalize_llm_response(tail_filter.text.strip(), generation_time, tail_filter.block)
+        await store_response_cache_async(cache_key, result)
+        yield "final", result
+
+    except Exception as e:
+        logger.error(f"[ERROR] ストリーミング応答生成失敗: {e}")
+        yield "final", ("応答生成でエラーが発生しました。", {})
+
+
+# =========================
+# 応答キャッシュ
+# =========================
+
+# 戻り値は（キー, エントリ or None）。キーはキャッシュ無効時も single-flight のキーとして使う
+def lookup_response_cache(user_input: str, best_match: dict | None) -> tuple[str, dict | None]:
+    from module.emotion.emotion_stats import load_current_emotion
+
+    key = response_cache_key(user_input, load_current_emotion(), best_match)
+    cache = get_response_cache()
+    return key, (cache.get(key) if cache is not None else None)
+
+
+async def lookup_response_cache_async(user_input: str, best_match: dict | None) -> tuple[str, dict | None]:
+    from module.emotion.emotion_stats import load_current_emotion_async
+
+    key = response_cache_key(user_input, await load_current_emotion_async(), best_match)
+    cache = get_response_cache()
+    return key, (await cache.get_async(key) if cache is not None else None)
+
+
+# 感情データが取れた応答だけを保存する（エラー応答や構造の無い応答は保存しない）
+def store_response_cache(cache_key: str, result: tuple[str, dict]):
+    final_response, emotion_data = result
+    cache = get_response_cache()
+    if cache is not None and emotion_data:
+        cache.put(cache_key, final_response, storable_emotion_record(emotion_data))
+
+
+async def store_response_cache_async(cache_key: str, result: tuple[str, dict]):
+    final_response, emotion_data = result
+    cache = get_response_cache()
+    if cache is not None and emotion_data:
+        await cache.put_async(cache_key, final_response, storable_emotion_record(emotion_data))
+
+
+# キャッシュの応答を、生成したときと同じ形（日付・VoiceVox／Live2D設定・感情更新）にして返す
+def finalize_cached_reply(entry: dict, generation_time: str) -> tuple[str, dict]:
+    logger.info(f"♻ 応答キャッシュにヒット（{entry.get('hits', 0)}回目）。LLM呼び出しを省略")
+    emotion_data = copy.deepcopy(entry["emotion"])
+    emotion_data["date"] = generation_time
+    attach_emotion_settings(emotion_data)
+    return entry["response"], emotion_data
+
+
+# システムプロンプト＋人格傾向＋参照データから messages を組み立てる（非同期版）
+async def build_messages_async(user_input: str, best_match: dict | None, memories: list[dict] | None) -> list[dict]:
+    # 参照データ
+    history_data = None
+    if best_match is not None:
+        from module.response.main_response import collect_all_category_responses_async
+
+        history_data = await collect_all_category_responses_async(best_match.get("emotion"), best_match.get("date"))
+
+    messages, _ = build_prompt_messages(
+        user_input, await get_top_long_emotions_async(), best_match, history_data, memories
+    )
+    return messages
+
+
+# LLMのレスポンス（message）を応答文と感情データにする。構造化出力が取り出せなければ従来の末尾JSON抽出に戻す
+def finalize_completion_message(message, generation_time: str) -> tuple[str, dict]:
+    if STRUCTURED_OUTPUT_MODE != "off":
+        reply = parse_structured_message(message)
+        if reply is not None:
+            return finalize_structured_reply(reply, generation_time)
+        logger.warning("⚠ 構造化出力を取り出せませんでした。応答テキストからの抽出に切り替えます")
+    return finalize_llm_response((message.content or "").strip(), generation_time)
+
+
+# 構造化出力（{"response", "emotion"}）から応答文と感情データを作る（テキストの走査は行わない）
+def finalize_structured_reply(reply: dict, generation_time: str) -> tuple[str, dict]:
+    emotion_data = to_emotion_data(reply["emotion"])
+    emotion_data["date"] = generation_time
+    attach_emotion_settings(emotion_data)
+    return reply.get("response", "").strip(), emotion_data
+
+
+# LLMの生テキストから感情JSONを取り出し、VoiceVox／Live2D設定を付けて返す
+# ストリーミング時は走査済みの block を渡せば再走査しない
+# 表示テキストも同じ block の範囲で切り出す（パースした JSON と表示から除く部分を一致させる）
+def finalize_llm_response(full_response: str, generation_time: str, block=None) -> tuple[str, dict]:
+    # JSON抽出
+    if block is None:
+        block = find_json_block(full_response)
+    emotion_data = block.data if block is not None else None
+
+    if emotion_data:
+        emotion_data["date"] = generation_time
+
+        # 構成比が文字列ならパース
+        if "構成比" in emotion_data:
+            while isinstance(emotion_data["構成比"], str):
+                try:
+                    emotion_data["構成比"] = json.loads(emotion_data["構成比"])
+                except json.JSONDecodeError:
+                    break
+
+        logger.debug(f"[DEBUG] 構成比 type: {type(emotion_data.get('構成比'))}")
+        logger.debug(f"[DEBUG] 構成比 内容: {emotion_data.get('構成比')}")
+
+        attach_emotion_settings(emotion_data)
+
+        # 応答テキストからJSON部分（フェンス込み）を除去
+        return block.display_text, emotion_data
+
+    logger.warning("JSON抽出失敗。response_textは構造化されていない可能性あり")
+    return full_response, {}
+
+
+# 構成比から VoiceVox／Live2D 設定を付け、感情更新を別スレッドで走らせる
+def attach_emotion_settings(emotion_data: dict):
+    if isinstance(emotion_data.get("構成比"), dict):
+        # VoiceVox設定
+        vv_settings = generate_voicevox_settings_from_composition(
+            composition=emotion_data["構成比"],
+            speaker_id=3,     # ずんだもん固定
+            topn=5,
+            prev_settings=None,
+            smooth_alpha=0.7
+        )
+        emotion_data["voicevox_settings"] = vv_settings
+
+        # Live2D設定
+        live2d_settings = generate_live2d_from_composition(
+            composition=emotion_data["構成比"],
+            topn=None,
+            prev_params=None,
+            smooth_alpha=0.6,
+            min_ratio=None
+        )
+        emotion_data["live2d"] = live2d_settings
+
+        # 感情更新を別スレッドで実行
+        # リクエスト単位のメモ（現在感情）を共有するためコンテキストを引き継ぐ
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(run_emotion_update_pipeline, emotion_data["構成比"])
+        ).start()
+
+
 # 感情ベクトルのマージ＆保存＆要約
 def run_emotion_update_pipeline(new_vector: dict) -> tuple[str, dict]:
     try:
         from module.emotion.emotion_stats import (
-            load_current_emotion,
-            merge_emotion_vectors,
-            save_current_emotion,
+            update_current_emotion,
             summarize_feeling
         )
 
-        current = load_current_emotion()
-        logger.debug(f"[DEBUG] current type: {type(current)}")
         logger.debug(f"[DEBUG] new_vector type: {type(new_vector)}")
         logger.debug(f"[DEBUG] new_vector content: {new_vector}")
 
-        merged = merge_emotion_vectors(current, new_vector)
-        save_current_emotion(merged)
+        merged = update_current_emotion(new_vector)
         summary = summarize_feeling(merged)
         return "感情を更新しました。", summary
 
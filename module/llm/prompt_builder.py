@@ -0,0 +1,294 @@
+# module/llm/prompt_builder.py
+import os
+import math
+import functools
+
+from module.utils.utils import load_system_prompt_cached, load_dialogue_prompt, logger
+from module.utils.metrics import counter, histogram
+from module.llm.structured_output import STRUCTURED_OUTPUT_MODE, STRUCTURED_OUTPUT_INSTRUCTION
+
+# LLMに渡す messages の組み立て。
+# - 静的プレフィックス（system_prompt + dialogue_prompt）はファイルが変わらない限り同じ文字列を返す
+#   （プロバイダ側のプロンプトキャッシュが効くよう、可変部分は必ずその後ろに置く）
+# - セクションごとにトークン数を数え、入力予算を超える分は記憶ケースを切り詰め／省略する
+# Token-budgeted prompt builder with a byte-stable static prefix.
+
+# 入力トークンの上限（system + user 全体）
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("PROMPT_INPUT_TOKEN_BUDGET", "6000"))
+# 予算に収まらない記憶ケースを切り詰めるときの各項目（状況・心理反応）の最大文字数
+PROMPT_CASE_FIELD_CHARS = int(os.getenv("PROMPT_CASE_FIELD_CHARS", "80"))
+# プロンプトに載せる検索ヒット（記憶）の最大件数とスコア下限
+PROMPT_MEMORY_LIMIT = int(os.getenv("PROMPT_MEMORY_LIMIT", "3"))
+PROMPT_MEMORY_MIN_SCORE = float(os.getenv("PROMPT_MEMORY_MIN_SCORE", "0"))
+# messages 1件あたりのオーバーヘッド（role など）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+PROMPT_TOKENS = histogram(
+    "yumia_prompt_tokens", "Prompt tokens per section", ("section",),
+    buckets=(16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+)
+PROMPT_MEMORY_CASES = counter(
+    "yumia_prompt_memory_cases_total", "Memory cases kept / trimmed / dropped by the prompt budget", ("result",)
+)
+
+REFERENCE_HEADER = "\n\n【AI自身の記憶（参考感情データ）】\n"
+REFERENCE_INTRO = (
+    "以下は、あなた自身（AI）がこれまでに経験・記録した感情の記憶です。\n"
+    "各ケースは実際のユーザーとの対話に基づいて記録されたものであり、あなたの内的な記憶として保存されています。\n"
+    "これらの記憶を参照しながら、自然で一貫性のある応答を構成してください。\n"
+)
+NO_REFERENCE = "参照可能な記憶は見つかりませんでした。通常の方針で応答してください。\n"
+SIMILAR_HEADER = "\n【似た感情の記憶（類似度順）】\n"
+
+
+# =========================
+# トークン数
+# =========================
+
+_encoder = None
+_encoder_loaded = False
+
+
+def _get_encoder():
+    """tiktoken があればモデルのエンコーディングを使う（無ければ None → 文字数からの概算）"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            from module.params import OPENAI_MODEL
+
+            try:
+                _encoder = tiktoken.encoding_for_model(OPENAI_MODEL)
+            except KeyError:
+                _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.info(f"ℹ tiktoken を使わずトークン数を概算します: {e}")
+            _encoder = None
+    return _encoder
+
+
+@functools.lru_cache(maxsize=512)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    # 概算：非ASCII（日本語など）は1文字≒1トークン、ASCIIは4文字≒1トークン
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+# =========================
+# 静的プレフィックス
+# =========================
+
+_static_prefix = (None, None, None)  # (system, dialogue, 結合結果)
+
+
+def build_system_prompt() -> str:
+    """ファイルが変わらない限り同じ文字列オブジェクトを返す"""
+    global _static_prefix
+    system_text = load_system_prompt_cached()
+    dialogue_text = load_dialogue_prompt()
+    cached_system, cached_dialogue, prefix = _static_prefix
+    if system_text is not cached_system or dialogue_text is not cached_dialogue:
+        prefix = system_text + "\n\n" + dialogue_text
+        _static_prefix = (system_text, dialogue_text, prefix)
+    return prefix
+
+
+# =========================
+# 可変セクション
+# =========================
+
+def build_personality_text(top4_personality: list) -> str:
+    lines = ["\n【人格傾向】\nこのAIは以下の感情を持つ傾向があります：\n"]
+    if top4_personality:
+        lines.extend(f"・{emotion}（{count}回）\n" for emotion, count in top4_personality)
+    else:
+        lines.append("傾向情報がまだ十分にありません。\n")
+    return "".join(lines)
+
+
+# 検索ヒット（search_index_top_k の結果）からプロンプトに載せる分を選ぶ（スコア順・上限件数）
+def select_memories(
+    memories: list[dict] | None,
+    limit: int = PROMPT_MEMORY_LIMIT,
+    min_score: float = PROMPT_MEMORY_MIN_SCORE
+) -> list[dict]:
+    if not memories:
+        return []
+    selected = [m for m in memories if m.get("score", 0) >= min_score]
+    selected.sort(key=lambda m: m.get("score", 0), reverse=True)
+    return selected[:max(limit, 0)]
+
+
+def _clip(value, max_chars: int | None) -> str:
+    text = str(value)
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "…"
+
+
+def build_case_block(index: int, item: dict, field_chars: int | None = None) -> str:
+    return (
+        f"\n● 記憶ケース{index}\n"
+        f"主感情: {item.get('主感情')}\n"
+        f"構成比: {item.get('構成比')}\n"
+        f"状況: {_clip(item.get('状況'), field_chars)}\n"
+        f"心理反応: {_clip(item.get('心理反応'), field_chars)}\n"
+        f"キーワード: {', '.join(item.get('keywords', []))}\n"
+    )
+
+
+def build_similar_line(hit: dict) -> str:
+    doc = hit.get("document", {})
+    return (
+        f"・[{hit.get('category')}] 主感情: {doc.get('主感情')} / 類似度: {hit.get('score', 0):.1f}"
+        f" / 一致キーワード数: {hit.get('keyword_overlap', 0)} / キーワード: {', '.join(doc.get('キーワード', []))}\n"
+    )
+
+
+def _reference_cases(history_data: dict | None) -> list[dict]:
+    return [data for data in ((history_data or {}).get(c) for c in ("short", "intermediate", "long")) if data]
+
+
+def build_reference_section(
+    best_match: dict | None,
+    history_data: dict | None,
+    memories: list[dict] | None = None,
+    budget: int | None = None
+) -> tuple[str, dict]:
+    """
+    参照データのセクションを組み立てる。budget（トークン）を超える記憶ケースは、
+    項目を切り詰めて収まればそれを、収まらなければ省略する。戻り値は（テキスト, {kept, trimmed, dropped}）。
+    """
+    counts = {"kept": 0, "trimmed": 0, "dropped": 0}
+    if best_match is None:
+        return REFERENCE_HEADER + NO_REFERENCE, counts
+
+    parts = [REFERENCE_HEADER, REFERENCE_INTRO]
+    remaining = None if budget is None else budget - count_tokens(REFERENCE_HEADER + REFERENCE_INTRO)
+
+    def fits(text: str) -> bool:
+        return remaining is None or count_tokens(text) <= remaining
+
+    def take(text: str, result: str):
+        nonlocal remaining
+        parts.append(text)
+        counts[result] += 1
+        if remaining is not None:
+            remaining -= count_tokens(text)
+
+    index = 1
+    for item in _reference_cases(history_data):
+        block = build_case_block(index, item)
+        if fits(block):
+            take(block, "kept")
+        else:
+            trimmed = build_case_block(index, item, PROMPT_CASE_FIELD_CHARS)
+            if fits(trimmed):
+                take(trimmed, "trimmed")
+            else:
+                counts["dropped"] += 1
+                continue
+        index += 1
+
+    # 類似度の高い順に、検索でヒットした他の記憶も添える（見出しは1件目が入るときだけ）
+    header_added = False
+    for hit in memories or []:
+        line = build_similar_line(hit)
+        text = line if header_added else SIMILAR_HEADER + line
+        if fits(text):
+            take(text, "kept")
+            header_added = True
+        else:
+            counts["dropped"] += 1
+
+    return "".join(parts), counts
+
+
+def build_reference_text(best_match: dict | None, history_data: dict | None, memories: list[dict] | None = None) -> str:
+    return build_reference_section(best_match, history_data, memories)[0]
+
+
+def build_instruction_text() -> str:
+    return (
+        "【指示】上記の（あれば）感情参照データと人格傾向を参考に、emotion_promptのルールに従って応答を生成してください。\n"
+        + (
+            "自然な応答 + 構成比 を response に、感情構造を emotion に出力してください。"
+            if STRUCTURED_OUTPUT_MODE != "off"
+            else "自然な応答 + 構成比 + JSON形式の感情構造の順で出力してください。"
+        )
+    )
+
+
+def build_user_prompt(personality_text: str, user_input: str, reference_text: str) -> str:
+    return f"{personality_text}\nユーザー発言: {user_input}\n{reference_text}\n\n{build_instruction_text()}"
+
+
+def build_messages(system_prompt: str, prompt: str) -> list[dict]:
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    # 構造化出力モードでは、末尾JSONの代わりに emotion フィールドへ出すよう指示を足す
+    if STRUCTURED_OUTPUT_MODE != "off":
+        messages.insert(1, {"role": "system", "content": STRUCTURED_OUTPUT_INSTRUCTION})
+    return messages
+
+
+# =========================
+# 予算つきの組み立て
+# =========================
+
+def build_prompt_messages(
+    user_input: str,
+    top_personality: list,
+    best_match: dict | None,
+    history_data: dict | None,
+    memories: list[dict] | None,
+    budget: int = PROMPT_INPUT_TOKEN_BUDGET
+) -> tuple[list[dict], dict]:
+    """
+    messages と、セクション別トークン数のレポートを返す。
+    固定部分（静的プレフィックス・人格傾向・ユーザー発言・指示）を先に数え、残りを参照データに割り当てる。
+    """
+    system_prompt = build_system_prompt()
+    personality_text = build_personality_text(top_personality)
+    instruction_text = build_instruction_text()
+
+    sections = {
+        "static_prefix": count_tokens(system_prompt),
+        "structured_instruction": count_tokens(STRUCTURED_OUTPUT_INSTRUCTION) if STRUCTURED_OUTPUT_MODE != "off" else 0,
+        "personality": count_tokens(personality_text),
+        "user_input": count_tokens(user_input),
+        "instruction": count_tokens(instruction_text),
+    }
+    message_count = 3 if STRUCTURED_OUTPUT_MODE != "off" else 2
+    fixed = sum(sections.values()) + MESSAGE_OVERHEAD_TOKENS * message_count
+    reference_budget = max(budget - fixed, 0)
+
+    reference_text, cases = build_reference_section(
+        best_match, history_data, select_memories(memories), reference_budget
+    )
+    sections["reference"] = count_tokens(reference_text)
+
+    prompt = build_user_prompt(personality_text, user_input, reference_text)
+    messages = build_messages(system_prompt, prompt)
+
+    total = fixed + sections["reference"]
+    report = {"sections": sections, "total": total, "budget": budget, "memory_cases": cases}
+
+    for section, tokens in sections.items():
+        if tokens:
+            PROMPT_TOKENS.observe(tokens, section=section)
+    for result, n in cases.items():
+        if n:
+            PROMPT_MEMORY_CASES.inc(n, result=result)
+    if total > budget:
+        logger.warning(f"⚠ プロンプトが入力予算を超えています: {total} / {budget} tokens（固定部分 {fixed}）")
+    logger.info(f"🧮 プロンプトのトークン内訳: {sections} 合計={total}/{budget} 記憶ケース={cases}")
+    return messages, report
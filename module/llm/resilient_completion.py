@@ -0,0 +1,278 @@
+# module/llm/resilient_completion.py
+import os
+import math
+import time
+import atexit
+import random
+import asyncio
+import threading
+import contextvars
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from module.utils.utils import logger
+from module.utils.metrics import counter, histogram
+
+# chat.completions.create を締め切り付きで呼ぶラッパー。
+# - 呼び出し全体の締め切り（LLM_DEADLINE_SEC）と1回あたりのタイムアウト
+# - 一時的なエラー（接続・タイムアウト・429・5xx）はジッター付きの指数バックオフで再試行
+# - ヘッジ：最近の応答時間の p95 を過ぎても返ってこなければ同じ要求をもう1本送り、先に返った方を使う
+# - 残り時間が少なくなったら安いフォールバックモデル（LLM_FALLBACK_MODEL）に切り替える
+# SDK 側の自動再試行は止め（max_retries=0）、再試行はここで数える。
+# Deadline-aware chat completion with jittered retries, p95 hedging and a fallback model.
+
+LLM_DEADLINE_SEC = float(os.getenv("LLM_DEADLINE_SEC", "30"))
+LLM_ATTEMPT_TIMEOUT_SEC = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SEC", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SEC = float(os.getenv("LLM_RETRY_BASE_SEC", "0.5"))
+LLM_RETRY_MAX_SEC = float(os.getenv("LLM_RETRY_MAX_SEC", "4"))
+
+# ヘッジ（既定は無効。トークン課金が最大2倍になるため）
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY_SEC = float(os.getenv("LLM_HEDGE_MIN_DELAY_SEC", "1.0"))
+# p95 を信用するのに必要な直近の成功数（それまではヘッジしない）
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# ヘッジ時の試行を走らせる専用スレッド数（記憶検索のファンアウト用プールとは分ける）
+LLM_ATTEMPT_MAX_WORKERS = int(os.getenv("LLM_ATTEMPT_MAX_WORKERS", "4"))
+
+# 残り時間がこれを下回ったらフォールバックモデルを使う（モデル名が空なら使わない）
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_FALLBACK_WHEN_REMAINING_SEC = float(os.getenv("LLM_FALLBACK_WHEN_REMAINING_SEC", "8"))
+
+LLM_ATTEMPTS = counter(
+    "yumia_llm_attempts_total", "LLM completion attempts by model, kind and outcome", ("model", "kind", "outcome")
+)
+LLM_ATTEMPT_SECONDS = histogram(
+    "yumia_llm_attempt_seconds", "LLM completion attempt latency", ("model", "kind", "outcome"),
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
+
+_RETRYABLE_ERRORS = (TimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+_RETRYABLE_STATUS = (408, 409, 429)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_llm_executor() -> ThreadPoolExecutor:
+    # LLM の試行は数秒〜数十秒スレッドを占有するので、短い検索と同じプールに入れない
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LLM_ATTEMPT_MAX_WORKERS, thread_name_prefix="llm-attempt")
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+class Deadline:
+    def __init__(self, seconds: float, clock=time.monotonic):
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - self._clock(), 0.0)
+
+
+class LatencyTracker:
+    """モデルごとに直近の成功時の応答時間を持ち、分位点を返す"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def quantile(self, model: str, q: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(max(math.ceil(q * len(samples)) - 1, 0), len(samples) - 1)]
+
+
+_latencies = LatencyTracker()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    return _latencies
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, _RETRYABLE_ERRORS):
+        return True
+    status = getattr(error, "status_code", None)
+    return status in _RETRYABLE_STATUS or (status is not None and status >= 500)
+
+
+# フルジッター：0 〜 min(上限, base * 2^attempt) の一様乱数
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_SEC, cap: float = LLM_RETRY_MAX_SEC) -> float:
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def hedge_delay(model: str) -> float | None:
+    if not LLM_HEDGE_ENABLED:
+        return None
+    p = _latencies.quantile(model, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES)
+    return None if p is None else max(p, LLM_HEDGE_MIN_DELAY_SEC)
+
+
+def choose_model(model: str, deadline: Deadline) -> str:
+    if LLM_FALLBACK_MODEL and deadline.remaining() < LLM_FALLBACK_WHEN_REMAINING_SEC:
+        return LLM_FALLBACK_MODEL
+    return model
+
+
+def _attempt_timeout(deadline: Deadline) -> float:
+    timeout = min(LLM_ATTEMPT_TIMEOUT_SEC, deadline.remaining())
+    if timeout <= 0:
+        raise TimeoutError("LLM 呼び出しの締め切りを過ぎました")
+    return timeout
+
+
+def _record(model: str, kind: str, outcome: str, started: float, track: bool = False):
+    elapsed = time.perf_counter() - started
+    LLM_ATTEMPTS.inc(model=model, kind=kind, outcome=outcome)
+    LLM_ATTEMPT_SECONDS.observe(elapsed, model=model, kind=kind, outcome=outcome)
+    if track and outcome == "ok":
+        _latencies.record(model, elapsed)
+
+
+def _outcome(error: BaseException) -> str:
+    return "timeout" if isinstance(error, (TimeoutError, openai.APITimeoutError)) else "error"
+
+
+# =========================
+# 同期版
+# =========================
+
+def _attempt(client, model: str, kind: str, timeout: float, request: dict):
+    started = time.perf_counter()
+    try:
+        response = client.with_options(max_retries=0, timeout=timeout).chat.completions.create(model=model, **request)
+    except Exception as e:
+        _record(model, kind, _outcome(e), started)
+        raise
+    _record(model, kind, "ok", started, track=not request.get("stream"))
+    return response
+
+
+def _hedged_attempt(client, model: str, kind: str, deadline: Deadline, hedge: bool, request: dict):
+    timeout = _attempt_timeout(deadline)
+    delay = hedge_delay(model) if hedge else None
+    if delay is None or delay >= timeout:
+        return _attempt(client, model, kind, timeout, request)
+
+    # 同期クライアントは途中で止められないので、負けた方は結果を捨てるだけ（SDK のタイムアウトで必ず終わる）
+    executor = get_llm_executor()
+    futures = {executor.submit(contextvars.copy_context().run, _attempt, client, model, kind, timeout, request)}
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        logger.info(f"🪁 {delay:.2f}秒応答が無いためヘッジ要求を送信（{model}）")
+        futures.add(executor.submit(
+            contextvars.copy_context().run, _attempt, client, model, "hedge", timeout - delay, request
+        ))
+    error = None
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def create_completion(client, model: str, hedge: bool = True, deadline: Deadline | None = None, **request):
+    """
+    client.chat.completions.create(model=..., **request) を締め切り・再試行・ヘッジ付きで呼ぶ。
+    締め切りまでに成功しなければ最後の例外を送出する。
+    """
+    deadline = deadline or Deadline(LLM_DEADLINE_SEC)
+    attempt = 0
+    while True:
+        current = choose_model(model, deadline)
+        kind = "primary" if attempt == 0 else "retry"
+        if current != model:
+            kind = "fallback"
+        try:
+            return _hedged_attempt(client, current, kind, deadline, hedge, request)
+        except Exception as e:
+            delay = backoff_delay(attempt)
+            if not is_retryable(e) or attempt >= LLM_MAX_RETRIES or deadline.remaining() <= delay:
+                raise
+            attempt += 1
+            logger.warning(f"🔁 LLM呼び出し失敗（{current}）→ {delay:.2f}秒後に再試行 {attempt}/{LLM_MAX_RETRIES}: {e}")
+            time.sleep(delay)
+
+
+# =========================
+# 非同期版
+# =========================
+
+async def _attempt_async(client, model: str, kind: str, timeout: float, request: dict):
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            client.with_options(max_retries=0, timeout=timeout).chat.completions.create(model=model, **request),
+            timeout
+        )
+    except asyncio.CancelledError:
+        _record(model, kind, "cancelled", started)
+        raise
+    except Exception as e:
+        _record(model, kind, _outcome(e), started)
+        raise
+    _record(model, kind, "ok", started, track=not request.get("stream"))
+    return response
+
+
+async def _hedged_attempt_async(client, model: str, kind: str, deadline: Deadline, hedge: bool, request: dict):
+    timeout = _attempt_timeout(deadline)
+    delay = hedge_delay(model) if hedge else None
+    if delay is None or delay >= timeout:
+        return await _attempt_async(client, model, kind, timeout, request)
+
+    tasks = {asyncio.ensure_future(_attempt_async(client, model, kind, timeout, request))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            logger.info(f"🪁 {delay:.2f}秒応答が無いためヘッジ要求を送信（{model}）")
+            tasks.add(asyncio.ensure_future(_attempt_async(client, model, "hedge", timeout - delay, request)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # 負けた方（と呼び出し元がキャンセルされた場合は全部）を取り消す
+        for task in tasks:
+            task.cancel()
+
+
+async def create_completion_async(client, model: str, hedge: bool = True, deadline: Deadline | None = None, **request):
+    """create_completion の非同期版（AsyncOpenAI 用）。負けたヘッジ要求はキャンセルする"""
+    deadline = deadline or Deadline(LLM_DEADLINE_SEC)
+    attempt = 0
+    while True:
+        current = choose_model(model, deadline)
+        kind = "primary" if attempt == 0 else "retry"
+        if current != model:
+            kind = "fallback"
+        try:
+            return await _hedged_attempt_async(client, current, kind, deadline, hedge, request)
+        except Exception as e:
+            delay = backoff_delay(attempt)
+            if not is_retryable(e) or attempt >= LLM_MAX_RETRIES or deadline.remaining() <= delay:
+                raise
+            attempt += 1
+            logger.warning(f"🔁 LLM呼び出し失敗（{current}）→ {delay:.2f}秒後に再試行 {attempt}/{LLM_MAX_RETRIES}: {e}")
+            await asyncio.sleep(delay)
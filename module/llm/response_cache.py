@@ -0,0 +1,223 @@
+# module/llm/response_cache.py
+import os
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+from module.utils.utils import logger
+from module.utils.metrics import counter
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+
+# 最終応答（LLM）のキャッシュ。挨拶や同じ言い回しの繰り返しで毎回 OpenAI を呼ばないようにする。
+# キー = 正規化したユーザー発言 + 量子化した現在感情（上位の感情と強さの段階）+ best_match の id。
+# 同じ発言でも気分や参照する記憶が違えば別のキーになる。
+# プロセス内（LRU + TTL）を先に見て、RESPONSE_CACHE_MONGO=1 なら MongoDB（TTLインデックス付き）も共有の2段目に使う。
+# Response cache keyed by normalized input + quantized current emotion + best-match id.
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_SEC = float(os.getenv("RESPONSE_CACHE_TTL_SEC", "600"))
+# 2段目（MongoDB の response_cache コレクション）を使うか
+RESPONSE_CACHE_MONGO = os.getenv("RESPONSE_CACHE_MONGO", "0") == "1"
+# 現在感情の量子化：上位何件を、何段階の強さで区別するか
+# 現在感情は合計100に正規化された 0..100 の値（小数2桁）。毎ターンの小さな揺れでキーが変わらないよう粗く区切る
+RESPONSE_CACHE_EMOTION_TOP = int(os.getenv("RESPONSE_CACHE_EMOTION_TOP", "3"))
+RESPONSE_CACHE_EMOTION_STEP = float(os.getenv("RESPONSE_CACHE_EMOTION_STEP", "20"))
+
+RESPONSE_CACHE_COLLECTION = "response_cache"
+
+RESPONSE_CACHE_EVENTS = counter(
+    "yumia_response_cache_events_total", "LLM response cache hits / misses / stores / evictions", ("event",)
+)
+
+# 末尾の句読点・記号・長音などは同じ発言として扱う
+_TRAILING_MARKS = re.compile(r"[\s。、．，.,!！?？~〜ー…・♪☆★wｗ]+$")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_input(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower().strip()
+    text = _TRAILING_MARKS.sub("", text)
+    return _SPACES.sub(" ", text)
+
+
+def quantize_emotion(vector: dict | None, top: int = RESPONSE_CACHE_EMOTION_TOP, step: float = RESPONSE_CACHE_EMOTION_STEP) -> tuple:
+    """上位 top 件の感情を (名前, 段階) にする（段階 = 強さ // step）。段階 0 のものは除く"""
+    if not vector:
+        return ()
+    ranked = sorted(((float(v), k) for k, v in vector.items() if v), reverse=True)[:top]
+    levels = ((name, int(value // step)) for value, name in ranked)
+    return tuple(sorted((name, level) for name, level in levels if level > 0))
+
+
+def best_match_id(best_match: dict | None) -> str:
+    if not best_match:
+        return "-"
+    if best_match.get("_id") is not None:
+        return str(best_match["_id"])
+    return f"{best_match.get('emotion')}:{best_match.get('date')}"
+
+
+def response_cache_key(user_input: str, current_emotion: dict | None, best_match: dict | None) -> str:
+    emotion_part = ",".join(f"{name}={level}" for name, level in quantize_emotion(current_emotion))
+    raw = "\x1f".join((normalize_input(user_input), emotion_part, best_match_id(best_match)))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    値は {"response": 応答文, "emotion": 保存用の感情構造, "hits": 参照回数}。
+    get はエントリのコピーを返す（hits は参照後の回数）。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL_SEC,
+        use_mongo: bool = RESPONSE_CACHE_MONGO,
+        clock=time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.use_mongo = use_mongo
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> [expires_at, entry]
+
+    # ---- プロセス内 ----
+
+    def _get_local(self, key: str) -> dict | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= self._clock():
+                del self._entries[key]
+                RESPONSE_CACHE_EVENTS.inc(event="expire")
+                return None
+            self._entries.move_to_end(key)
+            item[1]["hits"] += 1
+            return dict(item[1])
+
+    def _put_local(self, key: str, entry: dict, ttl: float | None = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = [self._clock() + (self.ttl if ttl is None else ttl), dict(entry)]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                RESPONSE_CACHE_EVENTS.inc(event="evict")
+
+    # ---- MongoDB（2段目）----
+
+    def _mongo_document(self, key: str, entry: dict) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "_id": key,
+            "response": entry["response"],
+            "emotion": entry["emotion"],
+            "hits": 0,
+            "created_at": now,
+            # TTL インデックス（expireAfterSeconds=0）で期限切れ後に自動削除
+            "expires_at": now + timedelta(seconds=self.ttl)
+        }
+
+    def _from_mongo_doc(self, key: str, doc: dict | None) -> dict | None:
+        if doc is None:
+            return None
+        expires_at = doc.get("expires_at")
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        remaining = (expires_at - datetime.now(timezone.utc)).total_seconds() if expires_at else self.ttl
+        if remaining <= 0:
+            return None
+        entry = {"response": doc.get("response", ""), "emotion": doc.get("emotion", {}), "hits": doc.get("hits", 1)}
+        # 2段目で当たったものは残り時間だけプロセス内にも置く
+        self._put_local(key, entry, ttl=remaining)
+        return entry
+
+    # ---- 公開API ----
+
+    def get(self, key: str) -> dict | None:
+        entry = self._get_local(key)
+        if entry is not None:
+            RESPONSE_CACHE_EVENTS.inc(event="hit_memory")
+            return entry
+        if self.use_mongo:
+            try:
+                collection = get_collection(RESPONSE_CACHE_COLLECTION)
+                if collection is not None:
+                    doc = collection.find_one_and_update({"_id": key}, {"$inc": {"hits": 1}}, return_document=ReturnDocument.AFTER)
+                    entry = self._from_mongo_doc(key, doc)
+                    if entry is not None:
+                        RESPONSE_CACHE_EVENTS.inc(event="hit_mongo")
+                        return entry
+            except Exception as e:
+                logger.warning(f"⚠ 応答キャッシュ（MongoDB）の参照に失敗: {e}")
+        RESPONSE_CACHE_EVENTS.inc(event="miss")
+        return None
+
+    async def get_async(self, key: str) -> dict | None:
+        entry = self._get_local(key)
+        if entry is not None:
+            RESPONSE_CACHE_EVENTS.inc(event="hit_memory")
+            return entry
+        if self.use_mongo:
+            try:
+                collection = get_async_collection(RESPONSE_CACHE_COLLECTION)
+                if collection is not None:
+                    doc = await collection.find_one_and_update({"_id": key}, {"$inc": {"hits": 1}}, return_document=ReturnDocument.AFTER)
+                    entry = self._from_mongo_doc(key, doc)
+                    if entry is not None:
+                        RESPONSE_CACHE_EVENTS.inc(event="hit_mongo")
+                        return entry
+            except Exception as e:
+                logger.warning(f"⚠ 応答キャッシュ（MongoDB）の参照に失敗: {e}")
+        RESPONSE_CACHE_EVENTS.inc(event="miss")
+        return None
+
+    def put(self, key: str, response: str, emotion: dict):
+        entry = {"response": response, "emotion": emotion, "hits": 0}
+        self._put_local(key, entry)
+        RESPONSE_CACHE_EVENTS.inc(event="store")
+        if self.use_mongo:
+            try:
+                collection = get_collection(RESPONSE_CACHE_COLLECTION)
+                if collection is not None:
+                    doc = self._mongo_document(key, entry)
+                    collection.replace_one({"_id": key}, doc, upsert=True)
+            except Exception as e:
+                logger.warning(f"⚠ 応答キャッシュ（MongoDB）の保存に失敗: {e}")
+
+    async def put_async(self, key: str, response: str, emotion: dict):
+        entry = {"response": response, "emotion": emotion, "hits": 0}
+        self._put_local(key, entry)
+        RESPONSE_CACHE_EVENTS.inc(event="store")
+        if self.use_mongo:
+            try:
+                collection = get_async_collection(RESPONSE_CACHE_COLLECTION)
+                if collection is not None:
+                    doc = self._mongo_document(key, entry)
+                    await collection.replace_one({"_id": key}, doc, upsert=True)
+            except Exception as e:
+                logger.warning(f"⚠ 応答キャッシュ（MongoDB）の保存に失敗: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+_response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+
+def get_response_cache() -> ResponseCache | None:
+    """無効化されている場合は None"""
+    return _response_cache
@@ -0,0 +1,52 @@
+# module/llm/stream_filter.py
+from module.utils.json_block import JsonBlockScanner
+
+# ストリーミング中の応答テキストから、末尾の感情JSONブロックを画面に出さないためのフィルタ。
+# 応答は「応答文 + 構成比 + JSON」の順に来るので、最初の "{" か "`" 以降はいったん保留し、
+# 生成完了後に JSON を取り除いた本文と突き合わせて、JSON でなかった分だけを後から流す。
+# JSON の位置はチャンクごとに JsonBlockScanner で追うので、完了後に全文を走査し直さない。
+# Withholds the trailing JSON emotion block from a token stream.
+
+_HOLD_MARKERS = ("{", "`")
+
+
+class JsonTailFilter:
+    def __init__(self):
+        self._scanner = JsonBlockScanner()
+        self._emitted = 0
+        self._holding = False
+        self.block = None
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取った全文（JSON込み）"""
+        return self._scanner.text
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを受け取り、今表示してよい部分を返す"""
+        if not chunk:
+            return ""
+        self._scanner.feed(chunk)
+        if self._holding:
+            return ""
+        text = self._scanner.text
+        positions = [p for p in (text.find(m, self._emitted) for m in _HOLD_MARKERS) if p != -1]
+        end = min(positions) if positions else len(text)
+        self._holding = bool(positions)
+        visible = text[self._emitted:end]
+        self._emitted = end
+        return visible
+
+    def finish(self) -> str:
+        """生成完了後、保留していた部分のうち JSON ではなかった本文を返す（パース結果は self.block）"""
+        text = self._scanner.text
+        self.block = self._scanner.result()
+        visible = self.block.display_text if self.block is not None else text.strip()
+        emitted = text[:self._emitted]
+        sent = emitted.strip()
+        rest = visible[len(sent):] if visible.startswith(sent) else ""
+        if emitted != emitted.rstrip():
+            # 末尾の空白・改行は送信済み
+            rest = rest.lstrip()
+        self._emitted = len(text)
+        return rest
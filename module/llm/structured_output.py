@@ -0,0 +1,141 @@
+# module/llm/structured_output.py
+import os
+import json
+
+from module.params import emotion_map_reverse
+
+# 感情構造を応答文の末尾JSONとしてではなく、JSONスキーマで拘束した出力（またはツール呼び出し）で受け取るモード。
+# 応答文（response）と感情構造（emotion）が別フィールドで返るので、正規表現やテキスト走査で取り出す必要がない。
+#   off         : 従来通り（応答文の末尾にJSON）
+#   json_schema : response_format={"type": "json_schema", ...}
+#   tool        : record_emotion_reply ツールの強制呼び出し（json_schema 非対応の互換サーバー向け）
+# Structured-output mode: the reply text and the emotion structure come back as separate, schema-checked fields.
+
+STRUCTURED_OUTPUT_MODES = ("off", "json_schema", "tool")
+STRUCTURED_OUTPUT_MODE = os.getenv("LLM_STRUCTURED_OUTPUT", "off")
+if STRUCTURED_OUTPUT_MODE not in STRUCTURED_OUTPUT_MODES:
+    STRUCTURED_OUTPUT_MODE = "off"
+
+TOOL_NAME = "record_emotion_reply"
+
+# 応答文に付けていた JSON の代わりに、emotion フィールドへ出すよう指示する（emotion_prompt の出力形式を上書き）
+STRUCTURED_OUTPUT_INSTRUCTION = (
+    "【出力形式の変更】感情構造JSONは応答文に書かず、emotion フィールドに出力してください。"
+    "response には自然な応答文と感情構成比の一文（例：「（感情　喜び:40%、期待:30%、信頼:30%）」）だけを書いてください。"
+    "構成比は {感情, 割合} の配列で、最大4種類・整数・合計100にしてください。"
+)
+
+# 表示や音声用にあとから付け足すフィールド（保存する感情構造には含めない）
+DERIVED_FIELDS = ("voicevox_settings", "live2d")
+
+
+# strict モードでは任意キーのオブジェクトが使えないので、構成比は {感情, 割合} の配列で受け取る
+def emotion_schema() -> dict:
+    emotion_names = list(emotion_map_reverse.keys())
+    return {
+        "type": "object",
+        "properties": {
+            "主感情": {"type": "string", "enum": emotion_names},
+            "構成比": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "感情": {"type": "string", "enum": emotion_names},
+                        "割合": {"type": "integer"}
+                    },
+                    "required": ["感情", "割合"],
+                    "additionalProperties": False
+                }
+            },
+            "重み": {"type": "integer"},
+            "状況": {"type": "string"},
+            "心理反応": {"type": "string"},
+            "関係性変化": {"type": "string"},
+            "関連": {"type": "array", "items": {"type": "string"}},
+            "keywords": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["主感情", "構成比", "重み", "状況", "心理反応", "関係性変化", "関連", "keywords"],
+        "additionalProperties": False
+    }
+
+
+def reply_schema() -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "response": {"type": "string"},
+            "emotion": emotion_schema()
+        },
+        "required": ["response", "emotion"],
+        "additionalProperties": False
+    }
+
+
+# chat.completions.create に足す引数
+def completion_kwargs(mode: str = STRUCTURED_OUTPUT_MODE) -> dict:
+    if mode == "json_schema":
+        return {
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "emotion_reply", "strict": True, "schema": reply_schema()}
+            }
+        }
+    if mode == "tool":
+        return {
+            "tools": [{
+                "type": "function",
+                "function": {
+                    "name": TOOL_NAME,
+                    "description": "応答文と、その応答に伴うAI自身の感情構造を記録する",
+                    "parameters": reply_schema(),
+                    "strict": True
+                }
+            }],
+            "tool_choice": {"type": "function", "function": {"name": TOOL_NAME}}
+        }
+    return {}
+
+
+# レスポンスの message から {"response", "emotion"} を取り出す。取り出せなければ None（呼び出し側で従来の抽出に戻す）
+def parse_structured_message(message, mode: str = STRUCTURED_OUTPUT_MODE) -> dict | None:
+    if mode == "tool":
+        tool_calls = getattr(message, "tool_calls", None) or []
+        raw = next((c.function.arguments for c in tool_calls if c.function.name == TOOL_NAME), None)
+    else:
+        raw = getattr(message, "content", None)
+    if not raw:
+        return None
+    try:
+        reply = json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(reply, dict) or not isinstance(reply.get("emotion"), dict):
+        return None
+    return reply
+
+
+# スキーマの emotion を従来の感情構造JSONと同じ形にする（構成比は {感情: 割合}）
+def to_emotion_data(emotion: dict) -> dict:
+    composition = {}
+    for item in emotion.get("構成比", []):
+        name = item.get("感情")
+        if name:
+            composition[name] = composition.get(name, 0) + int(item.get("割合", 0))
+    return {
+        "date": "",
+        "データ種別": "emotion",
+        "重み": emotion.get("重み", 0),
+        "主感情": emotion.get("主感情", ""),
+        "構成比": composition,
+        "状況": emotion.get("状況", ""),
+        "心理反応": emotion.get("心理反応", ""),
+        "関係性変化": emotion.get("関係性変化", ""),
+        "関連": emotion.get("関連", []),
+        "keywords": emotion.get("keywords", [])
+    }
+
+
+# 保存用：表示・音声向けに付け足したフィールドを除く
+def storable_emotion_record(emotion_data: dict) -> dict:
+    return {k: v for k, v in emotion_data.items() if k not in DERIVED_FIELDS}
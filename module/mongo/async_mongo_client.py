@@ -0,0 +1,74 @@
+# module/mongo/async_mongo_client.py
+import os
+import logging
+import certifi
+from pymongo import AsyncMongoClient
+
+from module.utils.metrics import MongoCommandMetricsListener
+from module.mongo.mongo_client import (
+    get_connection_manager,
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+)
+
+# イベントループ上で使う非同期クライアント（/chat などの async ハンドラ用）。
+# 接続設定とブレーカー状態は同期側の MongoConnectionManager と共有する（コマンドの失敗もブレーカーに数える）。
+
+_log = logging.getLogger(__name__)
+
+_async_client = None
+_async_collections = {}
+
+
+def get_async_mongo_client() -> AsyncMongoClient | None:
+    global _async_client
+
+    # 同期側のブレーカーが開いている間は待たずに諦める
+    manager = get_connection_manager()
+    if manager.state == "open":
+        return None
+
+    if _async_client is None:
+        mongo_uri = os.getenv("MONGODB_URI")
+        if not mongo_uri:
+            _log.error("Environment variable 'MONGODB_URI' is not set")
+            return None
+        # AsyncMongoClient は最初の操作時に接続するため、ここでは ping しない
+        _async_client = AsyncMongoClient(
+            mongo_uri,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[MongoCommandMetricsListener(
+                on_success=manager._on_command_succeeded,
+                on_failure=manager._on_command_failed
+            )]
+        )
+    return _async_client
+
+
+# キャッシュ済みの非同期コレクションハンドル
+def get_async_collection(name: str):
+    client = get_async_mongo_client()
+    if client is None:
+        return None
+    collection = _async_collections.get(name)
+    if collection is None:
+        collection = client[MONGO_DB_NAME][name]
+        _async_collections[name] = collection
+    return collection
+
+
+async def close_async_mongo_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client = None
+    _async_collections.clear()
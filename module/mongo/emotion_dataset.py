@@ -1,13 +1,9 @@
 # module/mongo/emotion_dataset.py
 
-from pymongo import MongoClient
 from datetime import datetime
-import os
 from module.utils.utils import logger
+from module.mongo.mongo_client import get_collection
 
-# MongoDB接続設定（RenderのEnvironment Variablesから取得）
-MONGO_URI = os.getenv("MONGODB_URI")
-DB_NAME = "emotion_db"
 COLLECTION_NAME = "dialogue_history"
 
 def get_recent_dialogue_history(n: int = 3) -> list[dict]:
@@ -22,8 +18,9 @@ def get_recent_dialogue_history(n: int = 3) -> list[dict]:
     ]
     """
     try:
-        client = MongoClient(MONGO_URI)
-        collection = client[DB_NAME][COLLECTION_NAME]
+        collection = get_collection(COLLECTION_NAME)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
 
         # timestamp降順で取得し、昇順に並べ直す
         cursor = collection.find(
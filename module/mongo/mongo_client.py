@@ -1,31 +1,241 @@
 import os
+import time
+import logging
+import threading
 import certifi
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import ConnectionFailure, PyMongoError
 
-_mongo_client = None
+from module.utils.metrics import MongoCommandMetricsListener
 
-def get_mongo_client():
-    global _mongo_client
+# 接続設定（環境変数で上書き可）
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "emotion_db")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+
+# ヘルスチェック（バックグラウンド）とサーキットブレーカー
+MONGO_HEARTBEAT_INTERVAL_SEC = float(os.getenv("MONGO_HEARTBEAT_INTERVAL_SEC", "10"))
+MONGO_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MONGO_BREAKER_FAILURE_THRESHOLD", "3"))
+MONGO_BREAKER_RESET_SEC = float(os.getenv("MONGO_BREAKER_RESET_SEC", "30"))
+
+# コマンド失敗のうち、ブレーカーの失敗として数えるもの（接続・ネットワーク系。サーバーのエラー応答は数えない）
+NETWORK_ERROR_TYPES = frozenset({
+    "AutoReconnect", "ConnectionFailure", "NetworkTimeout", "ServerSelectionTimeoutError", "WaitQueueTimeoutError"
+})
+
+# utils.logger は MongoDB へ書くので、接続まわりは標準の logging を使う
+_log = logging.getLogger(__name__)
+
+
+class MongoConnectionManager:
+    """
+    プロセスで1つの MongoClient を所有する。
+    - 呼び出しごとの ping はしない（ヘルスチェックはバックグラウンドのハートビートで実施）
+    - 連続失敗（ハートビート・通常のコマンドの接続エラー）でブレーカーを開き、開いている間は get_client() が即 None を返す
+    - コレクションハンドルをキャッシュして再解決を省く
+    """
+
+    def __init__(
+        self,
+        uri: str | None = None,
+        db_name: str = MONGO_DB_NAME,
+        heartbeat_interval: float = MONGO_HEARTBEAT_INTERVAL_SEC,
+        failure_threshold: int = MONGO_BREAKER_FAILURE_THRESHOLD,
+        reset_after: float = MONGO_BREAKER_RESET_SEC
+    ):
+        self.uri = uri
+        self.db_name = db_name
+        self.heartbeat_interval = heartbeat_interval
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_after = reset_after
+
+        self._client = None
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+        # ブレーカー状態: closed / open / half_open
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+
+    # =========================
+    # ブレーカー
+    # =========================
 
-    if _mongo_client is not None:
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                _log.info("MongoDB接続回復 → ブレーカーを閉じます")
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    _log.warning(f"MongoDB接続失敗が続いたためブレーカーを開きます（{self._failures} 回）")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    # CommandListener から：通常のコマンドの成否もブレーカーに反映する
+    def _on_command_succeeded(self, event):
+        with self._lock:
+            if self.state == "closed":
+                self._failures = 0
+
+    def _on_command_failed(self, event):
+        if (getattr(event, "failure", None) or {}).get("errtype") in NETWORK_ERROR_TYPES:
+            self.record_failure()
+
+    def _allow_request(self) -> bool:
+        with self._lock:
+            if self.state != "open":
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            # 一定時間経過 → 試験的に1回だけ通す
+            self.state = "half_open"
+        return self._probe()
+
+    def _probe(self) -> bool:
+        client = self._client
+        if client is None:
+            return False
         try:
-            _mongo_client.admin.command("ping")
-            # MongoClient is connected
-            return _mongo_client
-        except ConnectionFailure:
-            # Existing MongoClient failed, retrying
-            pass
-
-    try:
-        mongo_uri = os.getenv("MONGODB_URI")
+            client.admin.command("ping")
+            self.record_success()
+            return True
+        except Exception:
+            self.record_failure()
+            return False
+
+    # =========================
+    # クライアント／コレクション
+    # =========================
+
+    def _create_client(self) -> MongoClient:
+        mongo_uri = self.uri or os.getenv("MONGODB_URI")
         if not mongo_uri:
             raise ValueError("Environment variable 'MONGODB_URI' is not set")
 
-        _mongo_client = MongoClient(mongo_uri, tlsCAFile=certifi.where())
-        _mongo_client.admin.command("ping")
-        # New MongoDB connection successful
-        return _mongo_client
-    except Exception:
-        # Connection failed
-        return None
+        return MongoClient(
+            mongo_uri,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[MongoCommandMetricsListener(
+                on_success=self._on_command_succeeded,
+                on_failure=self._on_command_failed
+            )]
+        )
+
+    def get_client(self) -> MongoClient | None:
+        if self._client is None:
+            return self._connect()
+        if not self._allow_request():
+            return None
+        return self._client
+
+    def _connect(self) -> MongoClient | None:
+        with self._connect_lock:
+            if self._client is not None:
+                return self._client
+            with self._lock:
+                if self.state == "open" and time.monotonic() - self._opened_at < self.reset_after:
+                    return None
+            try:
+                client = self._create_client()
+                # 初回のみ接続確認（以降はハートビートに任せる）
+                client.admin.command("ping")
+            except Exception as e:
+                _log.error(f"MongoDB接続失敗: {e}")
+                self.record_failure()
+                return None
+
+            self._client = client
+            self.record_success()
+            self._start_heartbeat()
+            return client
+
+    def get_database(self):
+        client = self.get_client()
+        if client is None:
+            return None
+        return client[self.db_name]
+
+    def get_collection(self, name: str):
+        if self.get_client() is None:
+            return None
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._client[self.db_name][name]
+            self._collections[name] = collection
+        return collection
+
+    # =========================
+    # ハートビート
+    # =========================
+
+    def _start_heartbeat(self):
+        if self.heartbeat_interval <= 0:
+            return
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="mongo-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            # close() と並行しても手元のクライアントで ping する（閉じられていれば終了）
+            client = self._client
+            if client is None:
+                return
+            try:
+                client.admin.command("ping")
+                self.record_success()
+            except (ConnectionFailure, PyMongoError) as e:
+                if self._stop.is_set():
+                    return
+                _log.warning(f"MongoDBハートビート失敗: {e}")
+                self.record_failure()
+
+    def close(self):
+        self._stop.set()
+        heartbeat = self._heartbeat
+        if heartbeat is not None and heartbeat is not threading.current_thread():
+            heartbeat.join(timeout=max(1.0, MONGO_SOCKET_TIMEOUT_MS / 1000))
+        self._heartbeat = None
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+            self._collections = {}
+
+
+_manager = MongoConnectionManager()
+
+
+def get_connection_manager() -> MongoConnectionManager:
+    return _manager
+
+
+def get_mongo_client():
+    return _manager.get_client()
+
+
+# キャッシュ済みのコレクションハンドル（接続不可・ブレーカー開放中は None）
+def get_collection(name: str):
+    return _manager.get_collection(name)
+
+
+def close_mongo_client():
+    _manager.close()
@@ -0,0 +1,251 @@
+# module/mongo/mongo_indexes.py
+import os
+import sys
+import argparse
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from module.utils.utils import logger
+from module.mongo.mongo_client import get_connection_manager
+
+# emotion_db の各コレクションに必要なインデックス定義と、その作成・点検処理。
+# 何度実行しても同じ結果になる（既存のものはスキップ）。起動時と CLI の両方から呼ぶ。
+#
+#   python -m module.mongo.mongo_indexes            # 不足分を作成
+#   python -m module.mongo.mongo_indexes --dry-run  # 作成せずに不足分だけ表示
+#   python -m module.mongo.mongo_indexes --report   # 未作成／未使用インデックスを表示（$indexStats）
+#   python -m module.mongo.mongo_indexes --explain  # 主要クエリの実行計画（IXSCAN / COLLSCAN）を表示
+
+# 起動時にインデックスを作成するか（本番で手動管理したい場合は 0）
+MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "1") == "1"
+
+# {コレクション名: [{"name": インデックス名, "keys": [(フィールド, 向き), ...], "options": {...}（任意）}, ...]}
+INDEX_SPECS = {
+    # load_history / get_recent_dialogue_history: timestamp 降順で直近 n 件
+    "dialogue_history": [
+        {"name": "timestamp_desc", "keys": [("timestamp", DESCENDING)]},
+    ],
+    # load_current_emotion: 最新の1件
+    "current_emotion": [
+        {"name": "timestamp_desc", "keys": [("timestamp", DESCENDING)]},
+    ],
+    # response_* / oblivion_*: category（＋emotion）で絞り込み、忘却時は data.履歴.date で検索
+    "emotion_data": [
+        {"name": "category_emotion", "keys": [("category", ASCENDING), ("emotion", ASCENDING)]},
+        {"name": "data_history_date", "keys": [("data.履歴.date", ASCENDING)]},
+    ],
+    # 検索：category＋キーワード（マルチキー）、忘却時は 履歴.date
+    "emotion_index": [
+        {"name": "category_keywords", "keys": [("category", ASCENDING), ("キーワード", ASCENDING)]},
+        {"name": "history_date", "keys": [("履歴.date", ASCENDING)]},
+    ],
+    # oblivion_index / oblivion_purge: category で絞り込み、date で期限判定
+    "emotion_oblivion": [
+        {"name": "category_date", "keys": [("category", ASCENDING), ("date", ASCENDING)]},
+    ],
+    # 応答キャッシュ（2段目）：expires_at を過ぎたら自動削除
+    "response_cache": [
+        {"name": "expires_at_ttl", "keys": [("expires_at", ASCENDING)], "options": {"expireAfterSeconds": 0}},
+    ],
+}
+
+# explain() で確認する主要クエリ: (コレクション, フィルタ, ソート)
+HOT_QUERIES = [
+    ("dialogue_history", {}, [("timestamp", DESCENDING)]),
+    ("current_emotion", {}, [("timestamp", DESCENDING)]),
+    ("emotion_data", {"category": "short"}, None),
+    ("emotion_data", {"category": "long", "emotion": "Joy"}, None),
+    ("emotion_data", {"data.履歴.date": "20250101000000"}, None),
+    ("emotion_index", {"category": "short"}, None),
+    ("emotion_index", {"category": "short", "キーワード": {"$in": ["仕事"]}}, None),
+    ("emotion_index", {"履歴.date": "20250101000000"}, None),
+    ("emotion_oblivion", {"category": {"$in": ["short", "intermediate"]}}, None),
+    ("emotion_oblivion", {"category": "short", "date": {"$lt": "20250101000000"}}, None),
+]
+
+
+def _get_database():
+    return get_connection_manager().get_database()
+
+
+def _key_tuple(keys) -> tuple:
+    # サーバーからは 1.0 のような float で返ることがある（"text" 等はそのまま）
+    return tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in keys
+    )
+
+
+def _existing_indexes(collection) -> dict:
+    """{キー定義: インデックス名} を返す（コレクションが未作成なら空）"""
+    return {
+        _key_tuple(info["key"]): name
+        for name, info in collection.index_information().items()
+    }
+
+
+def ensure_indexes(db=None, dry_run: bool = False) -> dict:
+    """
+    INDEX_SPECS に定義されたインデックスのうち、無いものだけを作成する。
+    同じキー定義のインデックスが別名で存在する場合は作成済みとして扱う。
+    戻り値: {"created": [...], "existing": [...], "failed": [...]}（要素は "collection.index" 形式）
+    """
+    result = {"created": [], "existing": [], "failed": []}
+    db = db if db is not None else _get_database()
+    if db is None:
+        logger.error("❌ MongoDBに接続できないためインデックス作成をスキップ")
+        return result
+
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        try:
+            existing = _existing_indexes(collection)
+        except Exception as e:
+            logger.error(f"❌ {collection_name} のインデックス一覧取得に失敗: {e}")
+            result["failed"].extend(f"{collection_name}.{spec['name']}" for spec in specs)
+            continue
+
+        for spec in specs:
+            label = f"{collection_name}.{spec['name']}"
+            if _key_tuple(spec["keys"]) in existing:
+                result["existing"].append(label)
+                continue
+            if dry_run:
+                result["created"].append(label)
+                continue
+            try:
+                collection.create_index(spec["keys"], name=spec["name"], **spec.get("options", {}))
+                result["created"].append(label)
+                logger.info(f"🗂️ インデックス作成: {label}")
+            except OperationFailure as e:
+                # 同名で別のキー定義が残っている等
+                logger.error(f"❌ インデックス作成失敗: {label} | {e}")
+                result["failed"].append(label)
+
+    logger.info(
+        f"✅ インデックス確認完了（作成: {len(result['created'])} / 既存: {len(result['existing'])} / 失敗: {len(result['failed'])}）"
+    )
+    return result
+
+
+def report_indexes(db=None) -> dict:
+    """
+    定義と実体の差分、および $indexStats による利用状況を返す。
+    戻り値: {コレクション名: {"missing": [...], "unused": [...], "undeclared": [...], "ops": {名前: 回数}}}
+    ※ $indexStats の回数はサーバー再起動でリセットされる
+    """
+    report = {}
+    db = db if db is not None else _get_database()
+    if db is None:
+        logger.error("❌ MongoDBに接続できないためインデックス点検をスキップ")
+        return report
+
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = db[collection_name]
+        declared = {_key_tuple(spec["keys"]) for spec in specs}
+        try:
+            existing = _existing_indexes(collection)
+            stats = list(collection.aggregate([{"$indexStats": {}}]))
+        except Exception as e:
+            logger.error(f"❌ {collection_name} のインデックス点検に失敗: {e}")
+            continue
+
+        ops = {s["name"]: int(s.get("accesses", {}).get("ops", 0)) for s in stats}
+        report[collection_name] = {
+            "missing": [spec["name"] for spec in specs if _key_tuple(spec["keys"]) not in existing],
+            "unused": sorted(name for name, count in ops.items() if count == 0 and name != "_id_"),
+            "undeclared": sorted(
+                name for key, name in existing.items() if key not in declared and name != "_id_"
+            ),
+            "ops": ops,
+        }
+    return report
+
+
+def _plan_stages(plan: dict) -> list[str]:
+    """winningPlan を辿ってステージ名を上から順に並べる"""
+    stages = []
+    while plan:
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            for child in plan["inputStages"]:
+                stages.extend(_plan_stages(child))
+            break
+        else:
+            break
+    return stages
+
+
+def explain_hot_queries(db=None) -> list[dict]:
+    """
+    HOT_QUERIES を explain() し、勝ちプランが index scan になっているかを返す。
+    戻り値: [{"collection", "filter", "sort", "stages", "index_scan"}, ...]
+    """
+    results = []
+    db = db if db is not None else _get_database()
+    if db is None:
+        logger.error("❌ MongoDBに接続できないため実行計画の確認をスキップ")
+        return results
+
+    for collection_name, query, sort in HOT_QUERIES:
+        try:
+            cursor = db[collection_name].find(query)
+            if sort:
+                cursor = cursor.sort(sort).limit(1)
+            winning = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+            # 8.0 以降（SBE）は queryPlan の下にプランが入る
+            stages = _plan_stages(winning.get("queryPlan", winning))
+        except Exception as e:
+            logger.error(f"❌ explain 失敗: {collection_name} {query} | {e}")
+            stages = []
+
+        results.append({
+            "collection": collection_name,
+            "filter": query,
+            "sort": sort,
+            "stages": stages,
+            "index_scan": "IXSCAN" in stages and "COLLSCAN" not in stages,
+        })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="emotion_db のインデックスを作成・点検する")
+    parser.add_argument("--dry-run", action="store_true", help="作成せずに不足分だけ表示")
+    parser.add_argument("--report", action="store_true", help="未作成／未使用インデックスを表示")
+    parser.add_argument("--explain", action="store_true", help="主要クエリの実行計画を表示")
+    args = parser.parse_args(argv)
+
+    result = ensure_indexes(dry_run=args.dry_run)
+    verb = "作成予定" if args.dry_run else "作成"
+    for label in result["created"]:
+        print(f"[{verb}] {label}")
+    for label in result["failed"]:
+        print(f"[失敗] {label}")
+
+    if args.report:
+        for collection_name, entry in report_indexes().items():
+            print(f"\n== {collection_name} ==")
+            print(f"  未作成: {', '.join(entry['missing']) or '-'}")
+            print(f"  未使用: {', '.join(entry['unused']) or '-'}")
+            print(f"  定義外: {', '.join(entry['undeclared']) or '-'}")
+            for name, count in sorted(entry["ops"].items()):
+                print(f"  {name}: {count} ops")
+
+    scans_ok = True
+    if args.explain:
+        print()
+        for item in explain_hot_queries():
+            mark = "IXSCAN" if item["index_scan"] else "NG"
+            scans_ok = scans_ok and item["index_scan"]
+            print(f"[{mark}] {item['collection']} {item['filter']} sort={item['sort']} → {' > '.join(item['stages']) or '?'}")
+
+    return 1 if result["failed"] or not scans_ok else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
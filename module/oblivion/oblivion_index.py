@@ -1,7 +1,9 @@
 from bson import ObjectId
 
 from module.utils.utils import logger
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
+from module.response.response_index import get_index_cache
+from module.response.memory_record_cache import get_memory_record_cache
 
 def remove_index_entries_by_date():
     """
@@ -9,10 +11,8 @@ def remove_index_entries_by_date():
     emotion_index コレクションから削除する（_id単位ではなく履歴要素単位）。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        index_collection = db["emotion_index"]
-        oblivion_collection = db["emotion_oblivion"]
+        index_collection = get_collection("emotion_index")
+        oblivion_collection = get_collection("emotion_oblivion")
 
         # short / intermediate 限定
         target_entries = list(oblivion_collection.find({
@@ -44,6 +44,11 @@ def remove_index_entries_by_date():
 
                 if result.modified_count:
                     total_modified += 1
+                    # プロセス内キャッシュにも同じ更新を反映
+                    get_index_cache().update_fields(doc["_id"], {"履歴": new_history})
+                    # 記憶レコードキャッシュの同じ日付の履歴も捨てる
+                    if get_memory_record_cache() is not None:
+                        get_memory_record_cache().invalidate_date(target_date)
                     logger.info(f"🧹 emotion_index: _id={doc['_id']} から履歴 date={target_date} を削除")
 
         logger.info(f"✅ emotion_index の履歴削除完了（更新件数: {total_modified}）")
@@ -59,10 +64,8 @@ def remove_history_entries_by_date():
     emotion_data 内の履歴配列から該当する履歴オブジェクトを削除する。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        oblivion_collection = db["emotion_oblivion"]
-        data_collection = db["emotion_data"]
+        oblivion_collection = get_collection("emotion_oblivion")
+        data_collection = get_collection("emotion_data")
 
         # short / intermediate のみ対象
         target_entries = list(oblivion_collection.find({
@@ -97,6 +100,8 @@ def remove_history_entries_by_date():
 
             if result.modified_count:
                 modified_total += 1
+                if get_memory_record_cache() is not None:
+                    get_memory_record_cache().invalidate(target_doc.get("emotion"), target_doc.get("category"), date)
                 logger.info(f"🧹 履歴削除: _id={target_doc['_id']} | date={date}")
 
         logger.info(f"✅ emotion_data の履歴削除完了（更新件数: {modified_total}）")
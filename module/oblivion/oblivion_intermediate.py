@@ -1,7 +1,7 @@
 # module/oblivion/oblivion_intermediate.py
 from datetime import datetime, timedelta
 
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
 from module.utils.utils import logger
 
 
@@ -11,9 +11,7 @@ def get_expired_intermediate_emotions():
     各履歴内の日付が3か月以上前のものがあるドキュメントのみ抽出する。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        collection = db["emotion_data"]
+        collection = get_collection("emotion_data")
 
         intermediate_docs = list(collection.find({"category": "intermediate"}))
         expired_docs = []
@@ -45,10 +43,8 @@ def save_oblivion_intermediate_entries():
     必要な情報のみを emotion_oblivion コレクションに保存する。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        source_collection = db["emotion_data"]
-        target_collection = db["emotion_oblivion"]
+        source_collection = get_collection("emotion_data")
+        target_collection = get_collection("emotion_oblivion")
 
         threshold = datetime.now() - timedelta(days=90)
         intermediate_docs = list(source_collection.find({"category": "intermediate"}))
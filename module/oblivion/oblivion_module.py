@@ -4,6 +4,7 @@ from module.oblivion.oblivion_intermediate import get_expired_intermediate_emoti
 from module.oblivion.oblivion_short import get_expired_short_term_emotions, save_oblivion_short_entries
 from module.oblivion.oblivion_purge import delete_expired_oblivion_entries, delete_expired_short_oblivion_entries
 from module.oblivion.oblivion_index import remove_index_entries_by_date, remove_history_entries_by_date
+from module.emotion.emotion_state_store import EMOTION_STATE_STORE_ENABLED, compact_snapshots
 
 
 from module.utils.utils import logger
@@ -44,6 +45,10 @@ def run_oblivion_cleanup_all():
     delete_expired_short_oblivion_entries()
     logger.info("✅ [DONE] emotion_oblivion の古いデータを削除しました")
 
+    # 古い現在感情スナップショットを間引く
+    if EMOTION_STATE_STORE_ENABLED:
+        compact_snapshots()
+
 
 if __name__ == "__main__":
     run_oblivion_cleanup_all()
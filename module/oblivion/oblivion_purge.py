@@ -1,16 +1,14 @@
 #module/oblivion/oblivion_purge.py
 from datetime import datetime, timedelta
 
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
 from module.utils.utils import logger
 
 
 #emotion_oblivion に保存されたデータのうち、"date" が6か月以上前のものを完全削除する。
 def delete_expired_oblivion_entries():
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        collection = db["emotion_oblivion"]
+        collection = get_collection("emotion_oblivion")
 
         threshold = datetime.now() - timedelta(days=180)
         expired_ids = []
@@ -40,9 +38,7 @@ def delete_expired_oblivion_entries():
 #emotion_oblivion に保存された shortカテゴリのデータのうち、"date" が14日以上前のものを完全削除する。
 def delete_expired_short_oblivion_entries():
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        collection = db["emotion_oblivion"]
+        collection = get_collection("emotion_oblivion")
 
         threshold = datetime.now() - timedelta(days=14)
         expired_ids = []
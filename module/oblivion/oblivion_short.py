@@ -2,7 +2,7 @@
 from datetime import datetime, timedelta
 
 from module.emotion.emotion_stats import load_current_emotion
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
 from module.utils.utils import logger
 
 
@@ -12,9 +12,7 @@ def get_expired_short_term_emotions():
     各履歴内の日付が7日以上前のものがあるドキュメントのみ抽出する。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        collection = db["emotion_data"]
+        collection = get_collection("emotion_data")
 
         short_docs = list(collection.find({"category": "short"}))
         expired_docs = []
@@ -46,10 +44,8 @@ def save_oblivion_short_entries():
     必要な情報のみを emotion_oblivion コレクションに保存する。
     """
     try:
-        client = get_mongo_client()
-        db = client["emotion_db"]
-        source_collection = db["emotion_data"]
-        target_collection = db["emotion_oblivion"]
+        source_collection = get_collection("emotion_data")
+        target_collection = get_collection("emotion_oblivion")
 
         threshold = datetime.now() - timedelta(days=7)
         short_docs = list(source_collection.find({"category": "short"}))
@@ -0,0 +1,333 @@
+# module/response/composition_matrix.py
+import heapq
+import threading
+from itertools import repeat
+from numbers import Real
+
+import numpy as np
+
+from module.params import emotion_map
+
+# 構成比（32感情）を emotion_map 順の float32 行列として保持し、
+# find_best_match_by_composition と同じ判定（適格性・スコア）を全候補まとめて計算する。
+#
+#   python -m module.response.composition_matrix --n 100000   # ベンチマーク
+
+COLUMNS = list(emotion_map.values())
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMNS)}
+
+# 適格性判定のしきい値（元の実装と同じ）
+SIGNIFICANT_VALUE = 5
+MAX_DIFF = 30
+
+
+# =========================
+# スカラー版（元の実装そのもの。行列に載らない候補と基準構成比の確認に使う）
+# =========================
+
+def composition_score(base: dict, target: dict) -> float:
+    shared_keys = set(base.keys()) & set(target.keys())
+    score = 0.0
+    for key in shared_keys:
+        diff = abs(base.get(key, 0) - target.get(key, 0))
+        score += (100 - diff)
+    return score / len(shared_keys) if shared_keys else 0.0
+
+
+def is_valid_composition(candidate_comp, base_comp) -> bool:
+    try:
+        base_filtered = {k: v for k, v in base_comp.items() if v > SIGNIFICANT_VALUE}
+        cand_filtered = {k: v for k, v in candidate_comp.items() if v > SIGNIFICANT_VALUE}
+    except AttributeError:
+        return False
+
+    base_keys = list(base_filtered.keys())
+    shared_keys = set(base_filtered.keys()) & set(cand_filtered.keys())
+    required_match = max(len(base_keys) - 1, 1)
+    matched = 0
+
+    for key in shared_keys:
+        diff = abs(base_filtered.get(key, 0) - cand_filtered.get(key, 0))
+        if diff <= MAX_DIFF:
+            matched += 1
+
+    return matched >= required_match
+
+
+def is_regular_composition(composition) -> bool:
+    """行列で表現できるか（dict で、キーが emotion_map 内、値が数値）"""
+    if not isinstance(composition, dict):
+        return False
+    for key, value in composition.items():
+        if key not in COLUMN_INDEX or not isinstance(value, Real):
+            return False
+    return True
+
+
+def encode_composition(composition: dict) -> tuple[np.ndarray, np.ndarray]:
+    """(値, キーの有無) の行ベクトル。キーが無い感情は 0／False"""
+    values = np.zeros(len(COLUMNS), dtype=np.float32)
+    present = np.zeros(len(COLUMNS), dtype=bool)
+    for key, value in composition.items():
+        i = COLUMN_INDEX[key]
+        values[i] = value
+        present[i] = True
+    return values, present
+
+
+# =========================
+# 行列
+# =========================
+
+class CompositionMatrix:
+    """
+    ドキュメントキー → 行 の対応を持つ構成比行列。
+    - 追加は末尾に行を足す（容量は倍々で確保）。更新・削除は旧行を捨てて対応を張り替える
+    - 判定は「渡された候補の並び」で行うので、行の並びは結果に影響しない
+    """
+
+    def __init__(self, capacity: int = 1024):
+        capacity = max(1, capacity)
+        self._values = np.zeros((capacity, len(COLUMNS)), dtype=np.float32)
+        self._present = np.zeros((capacity, len(COLUMNS)), dtype=bool)
+        self._size = 0
+        self._row_of = {}  # key -> 行
+        self._dead = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_docs(cls, keyed_docs) -> "CompositionMatrix":
+        # 1件ずつ add するより速いよう、行をまとめて作ってから一度に配列化する
+        keys, rows, masks = [], [], []
+        for key, doc in keyed_docs:
+            composition = doc.get("構成比")
+            if not is_regular_composition(composition):
+                continue
+            keys.append(key)
+            rows.append([composition.get(name, 0) for name in COLUMNS])
+            masks.append([name in composition for name in COLUMNS])
+
+        matrix = cls(capacity=max(1024, len(keys)))
+        if keys:
+            matrix._values[:len(keys)] = np.asarray(rows, dtype=np.float32)
+            matrix._present[:len(keys)] = np.asarray(masks, dtype=bool)
+        matrix._row_of = {key: i for i, key in enumerate(keys)}
+        matrix._size = len(keys)
+        return matrix
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def add(self, key: str, doc: dict):
+        composition = doc.get("構成比")
+        with self._lock:
+            self._drop(key)
+            # 行列に載らない候補はスカラー版で判定する（行を持たない）
+            if not is_regular_composition(composition):
+                return
+            if self._size == len(self._values):
+                self._grow()
+            self._values[self._size], self._present[self._size] = encode_composition(composition)
+            self._row_of[key] = self._size
+            self._size += 1
+
+    def remove(self, key: str):
+        with self._lock:
+            self._drop(key)
+
+    def _drop(self, key: str):
+        if self._row_of.pop(key, None) is not None:
+            self._dead += 1
+            # 捨てた行が半分を超えたら詰め直す
+            if self._dead > len(self._row_of):
+                self._compact()
+
+    def _grow(self):
+        capacity = len(self._values) * 2
+        values = np.zeros((capacity, len(COLUMNS)), dtype=np.float32)
+        present = np.zeros((capacity, len(COLUMNS)), dtype=bool)
+        values[:self._size] = self._values[:self._size]
+        present[:self._size] = self._present[:self._size]
+        self._values, self._present = values, present
+
+    def _compact(self):
+        keys = list(self._row_of)
+        rows = np.fromiter((self._row_of[k] for k in keys), dtype=np.int64, count=len(keys))
+        capacity = max(1024, len(keys) * 2)
+        values = np.zeros((capacity, len(COLUMNS)), dtype=np.float32)
+        present = np.zeros((capacity, len(COLUMNS)), dtype=bool)
+        values[:len(keys)] = self._values[rows]
+        present[:len(keys)] = self._present[rows]
+        self._values, self._present = values, present
+        self._row_of = {k: i for i, k in enumerate(keys)}
+        self._size = len(keys)
+        self._dead = 0
+
+    def gather(self, keys, cols: list[int] | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        候補キーの行（cols 指定時はその列だけ）をコピーして返す: (値, キーの有無, 行があるか)。
+        行を持たないキーの値は 0 で、呼び出し側がスカラー版で判定する。
+        """
+        cols = list(range(len(COLUMNS))) if cols is None else cols
+        with self._lock:
+            rows = np.array(list(map(self._row_of.get, keys, repeat(-1))), dtype=np.int64)
+            found = rows >= 0
+            index = np.ix_(np.where(found, rows, 0), cols)
+            values = self._values[index]
+            present = self._present[index]
+        values[~found] = 0
+        present[~found] = False
+        return values, present, found
+
+
+def base_columns(base: dict) -> list[int]:
+    """base の感情のうち行列にある列（この順で gather / score_matrix に渡す）"""
+    return [COLUMN_INDEX[k] for k in base if k in COLUMN_INDEX]
+
+
+def score_matrix(base: dict, values: np.ndarray, present: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    基準構成比 base に対する (適格か, スコア) を全行まとめて計算する。
+    values / present は base_columns(base) の列だけを持つ。
+    行列に無い感情（emotion_map 外のキー）は候補側に存在しない扱いになる。
+    """
+    n = len(values)
+    names = [COLUMNS[c] for c in base_columns(base)]
+    if not names:
+        # 共有できる感情が無い → 適格候補なし・スコア 0
+        return np.zeros(n, dtype=bool), np.zeros(n, dtype=np.float64)
+
+    base_values = np.array([base[name] for name in names], dtype=np.float64)
+    cand = values.astype(np.float64)
+    diff = np.abs(base_values - cand)
+
+    # 適格性：base で 5 を超える感情のうち、候補も 5 を超え、差が 30 以内のものが (件数 - 1) 以上
+    required = max(sum(1 for v in base.values() if v > SIGNIFICANT_VALUE) - 1, 1)
+    significant = base_values > SIGNIFICANT_VALUE
+    matched = ((cand > SIGNIFICANT_VALUE) & (diff <= MAX_DIFF) & significant).sum(axis=1)
+    valid = matched >= required
+
+    # スコア：base と候補の両方にある感情について (100 - 差) の平均
+    total = np.where(present, 100 - diff, 0.0).sum(axis=1)
+    count = present.sum(axis=1)
+    scores = np.divide(total, count, out=np.zeros(n, dtype=np.float64), where=count > 0)
+
+    return valid, scores
+
+
+def evaluate_candidates(base: dict, candidates: list, matrix: CompositionMatrix | None = None, keys=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    候補ごとの (適格か, スコア) を返す。
+    matrix と keys（候補ごとのドキュメントキー）を渡すと、構築済みの行を使う。
+    """
+    if not candidates or not isinstance(base, dict):
+        return np.zeros(len(candidates), dtype=bool), np.zeros(len(candidates), dtype=np.float64)
+
+    cols = base_columns(base)
+    if matrix is not None and keys is not None:
+        values, present, found = matrix.gather(keys, cols)
+    else:
+        found = np.array([is_regular_composition(c.get("構成比")) for c in candidates], dtype=bool)
+        values = np.zeros((len(candidates), len(cols)), dtype=np.float32)
+        present = np.zeros((len(candidates), len(cols)), dtype=bool)
+        for i in np.flatnonzero(found):
+            row_values, row_present = encode_composition(candidates[i]["構成比"])
+            values[i], present[i] = row_values[cols], row_present[cols]
+
+    valid, scores = score_matrix(base, values, present)
+
+    # 行列に載らない候補（emotion_map 外のキー・数値以外の値など）はスカラー版で判定
+    for i in np.flatnonzero(~found):
+        comp = candidates[i]["構成比"]
+        valid[i] = is_valid_composition(comp, base)
+        scores[i] = composition_score(base, comp) if valid[i] else 0.0
+
+    return valid, scores
+
+
+def best_match_index(base: dict, candidates: list, matrix: CompositionMatrix | None = None, keys=None) -> tuple[int | None, int]:
+    """find_best_match_by_composition と同じ候補を選ぶ（戻り値は (候補内の位置 or None, 有効候補数)）"""
+    valid, scores = evaluate_candidates(base, candidates, matrix, keys)
+    valid_idx = np.flatnonzero(valid)
+    if len(valid_idx) == 0:
+        return None, 0
+    # max() と同じく、同点なら先頭を選ぶ
+    best = valid_idx[int(np.argmax(scores[valid_idx]))]
+    return int(best), len(valid_idx)
+
+
+def top_k_indices(valid: np.ndarray, scores: np.ndarray, k: int, min_score: float | None = None) -> list[int]:
+    """
+    適格な候補からスコア上位 k 件の位置を返す（全件ソートせず、大きさ k のヒープで選ぶ）。
+    同点は先に並んでいる候補を優先する（k=1 なら best_match_index と同じ）。
+    """
+    if k <= 0:
+        return []
+    valid_idx = np.flatnonzero(valid)
+    if min_score is not None:
+        valid_idx = valid_idx[scores[valid_idx] >= min_score]
+    # heapq.nlargest は同点時に元の順序を保つ
+    return [int(i) for i in heapq.nlargest(k, valid_idx, key=scores.__getitem__)]
+
+
+# =========================
+# ベンチマーク
+# =========================
+
+def _random_docs(n: int, rng) -> list[dict]:
+    docs = []
+    for i in range(n):
+        k = rng.integers(1, 5)
+        cols = rng.choice(len(COLUMNS), size=k, replace=False)
+        weights = rng.dirichlet(np.ones(k)) * 100
+        comp = {name: 0 for name in COLUMNS}
+        for c, w in zip(cols, weights):
+            comp[COLUMNS[c]] = int(round(w))
+        docs.append({"_id": f"doc{i}", "構成比": comp})
+    return docs
+
+
+def _benchmark(sizes, queries: int, seed: int, with_scalar: bool):
+    import time
+
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        docs = _random_docs(n, rng)
+        bases = [
+            {COLUMNS[c]: int(v) for c, v in zip(rng.choice(len(COLUMNS), 3, replace=False), rng.integers(10, 60, 3))}
+            for _ in range(queries)
+        ]
+        keys = [d["_id"] for d in docs]
+
+        start = time.perf_counter()
+        matrix = CompositionMatrix.from_docs(zip(keys, docs))
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vector_results = [best_match_index(base, docs, matrix, keys)[0] for base in bases]
+        vector = (time.perf_counter() - start) / queries
+
+        line = f"n={n:>7}  build={build * 1000:8.1f}ms  vectorized={vector * 1000:8.2f}ms/query"
+        if with_scalar:
+            start = time.perf_counter()
+            scalar_results = []
+            for base in bases:
+                valid = [(i, d) for i, d in enumerate(docs) if is_valid_composition(d["構成比"], base)]
+                best = max(valid, key=lambda t: composition_score(base, t[1]["構成比"]))[0] if valid else None
+                scalar_results.append(best)
+            scalar = (time.perf_counter() - start) / queries
+            same = "OK" if scalar_results == vector_results else "MISMATCH"
+            line += f"  scalar={scalar * 1000:9.2f}ms/query  x{scalar / vector:6.1f}  parity={same}"
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="構成比マッチングのベンチマーク（スカラー版 vs 行列版）")
+    parser.add_argument("--n", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-scalar", action="store_true", help="スカラー版の計測を省く")
+    args = parser.parse_args()
+    _benchmark(args.n, args.queries, args.seed, not args.no_scalar)
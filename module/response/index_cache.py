@@ -0,0 +1,330 @@
+# module/response/index_cache.py
+import os
+import time
+import asyncio
+import threading
+
+from module.utils.utils import logger
+from module.utils.metrics import counter
+from module.utils.single_flight import SingleFlight
+from module.response.keyword_index import KeywordIndex
+from module.response.composition_matrix import CompositionMatrix
+
+# emotion_index のプロセス内キャッシュ（カテゴリ別）。
+# 初回だけ全件を読み込み、以降は save_index_data / 忘却処理からの差分で更新する。
+# 他プロセスからの書き込みはウォーターマーク（最新 _id＋件数）の定期確認と、一定時間ごとの全件再読込で拾う。
+
+INDEX_CACHE_ENABLED = os.getenv("INDEX_CACHE_ENABLED", "1") == "1"
+# ウォーターマーク確認の間隔（秒）
+INDEX_CACHE_CHECK_SEC = float(os.getenv("INDEX_CACHE_CHECK_SEC", "30"))
+# 変化が無くても全件を読み直す間隔（秒）。0 以下で無効
+INDEX_CACHE_MAX_AGE_SEC = float(os.getenv("INDEX_CACHE_MAX_AGE_SEC", "600"))
+
+CATEGORIES = ("long", "intermediate", "short")
+
+INDEX_CACHE_EVENTS = counter(
+    "yumia_index_cache_events_total", "emotion_index cache hits / loads / incremental updates", ("event",)
+)
+
+
+class EmotionIndexCache:
+    """
+    emotion_index をカテゴリ別に保持する。
+    - 読み手には不変のスナップショット（{category: [doc, ...]}）を返す。差分更新は _docs をロック内で
+      直接書き換えて変わったカテゴリだけ印を付け、スナップショットは次に読まれたときにそのカテゴリ分だけ作り直す
+    - version は内容が変わるたびに増える（派生データのキャッシュキーに使う）
+    - キーワードの転置インデックスを同じロック内で差分更新する
+    - 構成比行列はカテゴリごとに全件読込時に作り、以降は差分更新する
+    """
+
+    def __init__(
+        self,
+        loader,
+        async_loader=None,
+        watermark_getter=None,
+        check_interval: float = INDEX_CACHE_CHECK_SEC,
+        max_age: float = INDEX_CACHE_MAX_AGE_SEC
+    ):
+        self._loader = loader
+        self._async_loader = async_loader
+        self._watermark_getter = watermark_getter
+        self.check_interval = check_interval
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._docs = {}  # _id -> doc（挿入順）
+        self._keywords = KeywordIndex()
+        self._matrices = {}  # category -> CompositionMatrix
+        self._snapshot = None
+        self._stale_categories = set()  # 差分更新後、スナップショットの作り直しが必要なカテゴリ
+        self._watermark = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._refreshing = False
+        # 未読込時の全件読込は、同時に来た呼び出しで1回にまとめる
+        self._load_flight = SingleFlight("emotion_index_cache")
+        self.version = 0
+
+    # =========================
+    # 読み込み
+    # =========================
+
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def get_categorized(self) -> dict:
+        if not self.loaded:
+            self._load_flight.do("load", self.reload)
+        else:
+            INDEX_CACHE_EVENTS.inc(event="hit")
+            self._maybe_refresh_in_background()
+        return self._current_snapshot()
+
+    async def get_categorized_async(self) -> dict:
+        if not self.loaded:
+            if self._async_loader is None:
+                self._load_flight.do("load", self.reload)
+            else:
+                await self._load_flight.do_async("load", self._reload_async)
+        else:
+            INDEX_CACHE_EVENTS.inc(event="hit")
+            self._maybe_refresh_in_background()
+        return self._current_snapshot()
+
+    def reload(self):
+        """全件を読み直す（バックグラウンド更新からも呼ばれる）"""
+        watermark = self._read_watermark_safely()
+        self._replace_all(self._loader(), watermark)
+
+    async def _reload_async(self):
+        watermark = await asyncio.to_thread(self._read_watermark_safely)
+        self._replace_all(await self._async_loader(), watermark)
+
+    def _replace_all(self, docs: list, watermark):
+        docs_by_key = {}
+        for doc in docs:
+            docs_by_key[self.doc_key(doc)] = doc
+        keyword_index = KeywordIndex.from_docs(docs_by_key.items())
+        # 構成比行列もロックの外で作っておく（バックグラウンド更新時に検索を待たせない）
+        matrices = {
+            category: CompositionMatrix.from_docs(
+                (key, doc) for key, doc in docs_by_key.items() if doc.get("category", "unknown") == category
+            )
+            for category in CATEGORIES
+        }
+        with self._lock:
+            self._docs = docs_by_key
+            self._keywords = keyword_index
+            self._matrices = matrices
+            self._watermark = watermark
+            self._loaded_at = self._checked_at = time.monotonic()
+            self._snapshot = self._categorize(CATEGORIES)
+            self._stale_categories = set()
+            self.version += 1
+        INDEX_CACHE_EVENTS.inc(event="load")
+        logger.info(f"🗃️ emotion_index キャッシュ読込: {len(docs)} 件 (version={self.version})")
+
+    def _read_watermark_safely(self):
+        if self._watermark_getter is None:
+            return None
+        try:
+            return self._watermark_getter()
+        except Exception as e:
+            logger.warning(f"[WARN] emotion_index のウォーターマーク取得に失敗: {e}")
+            return None
+
+    # =========================
+    # バックグラウンド更新
+    # =========================
+
+    def _maybe_refresh_in_background(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or now - self._checked_at < self.check_interval:
+                return
+            self._refreshing = True
+            self._checked_at = now
+        threading.Thread(target=self._refresh, name="index-cache-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            expired = self.max_age > 0 and time.monotonic() - self._loaded_at >= self.max_age
+            # 前回の読込でウォーターマークが取れていなければ、そのまま読み直す
+            if not expired and self._watermark is not None:
+                watermark = self._read_watermark_safely()
+                if watermark is None or watermark == self._watermark:
+                    return
+                logger.info("🔄 emotion_index の変更を検知 → キャッシュを再読込")
+            self.reload()
+        except Exception as e:
+            logger.warning(f"[WARN] emotion_index キャッシュの更新に失敗: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    # =========================
+    # 差分更新
+    # =========================
+
+    def add(self, doc: dict):
+        """insert_one 済みのドキュメント（_id 付き）を追加"""
+        key = self.doc_key(doc)
+
+        def apply(docs):
+            previous = docs.get(key)
+            if previous is not None:
+                self._keywords.remove(key, previous)
+                self._matrix_remove(key, previous)
+                self._mark_stale(previous)
+            docs[key] = doc
+            self._keywords.add(key, doc)
+            self._matrix_add(key, doc)
+            self._mark_stale(doc)
+            return (key, 1) if previous is None else None
+
+        self._apply(apply)
+
+    def update_fields(self, doc_id, fields: dict):
+        """$set 相当の更新を反映（キャッシュに無い _id は無視）"""
+        key = str(doc_id)
+
+        def apply(docs):
+            doc = docs.get(key)
+            if doc is not None:
+                updated = {**doc, **fields}
+                self._keywords.remove(key, doc)
+                self._matrix_remove(key, doc)
+                docs[key] = updated
+                self._keywords.add(key, updated)
+                self._matrix_add(key, updated)
+                self._mark_stale(doc)
+                self._mark_stale(updated)
+
+        self._apply(apply)
+
+    def remove(self, doc_id):
+        key = str(doc_id)
+
+        def apply(docs):
+            doc = docs.pop(key, None)
+            if doc is None:
+                return None
+            self._keywords.remove(key, doc)
+            self._matrix_remove(key, doc)
+            self._mark_stale(doc)
+            return (None, -1)
+
+        self._apply(apply)
+
+    def _apply(self, mutate):
+        if not self.loaded:
+            # 未読込なら次回の全件読込に任せる
+            return
+        # 全件コピーせずロック内でその場で書き換える（1件あたり O(1)。スナップショットは読まれるときに作る）
+        with self._lock:
+            change = mutate(self._docs)
+            self.version += 1
+            if change is not None:
+                self._advance_watermark(*change)
+        INDEX_CACHE_EVENTS.inc(event="incremental")
+
+    def _advance_watermark(self, added_id: str | None, count_delta: int):
+        # 自プロセスの書き込みで再読込が走らないよう、DB に問い合わせずにウォーターマークを進める
+        if self._watermark is None:
+            return
+        last_id, count = self._watermark
+        if added_id is not None and (last_id is None or added_id > last_id):
+            last_id = added_id
+        self._watermark = (last_id, count + count_delta)
+
+    def invalidate(self):
+        with self._lock:
+            self._docs = {}
+            self._keywords = KeywordIndex()
+            self._matrices = {}
+            self._snapshot = None
+            self._stale_categories = set()
+            self._watermark = None
+            self.version += 1
+
+    # =========================
+    # キーワード検索
+    # =========================
+
+    def match_keywords(self, category: str, keywords) -> list[tuple[dict, int]]:
+        """
+        入力キーワードのいずれかを含むドキュメントを、一致数付きで返す。
+        並びはキャッシュへの追加順（filter_by_keywords の線形走査と同じ）。
+        """
+        if not self.loaded:
+            self.get_categorized()
+        with self._lock:
+            keyword_index = self._keywords
+        counts = keyword_index.overlaps(category, keywords)
+        keys = keyword_index.sort_keys(counts)
+        # _docs は差分更新でその場で書き換わるので、取り出しはロック内で行う
+        with self._lock:
+            return [(self._docs[key], counts[key]) for key in keys if key in self._docs]
+
+    # =========================
+    # 構成比行列
+    # =========================
+
+    def composition_matrix(self, category: str) -> CompositionMatrix:
+        if not self.loaded:
+            self.get_categorized()
+        with self._lock:
+            matrix = self._matrices.get(category)
+            if matrix is None:
+                matrix = CompositionMatrix.from_docs(
+                    (key, doc) for key, doc in self._docs.items() if doc.get("category", "unknown") == category
+                )
+                self._matrices[category] = matrix
+            return matrix
+
+    def _matrix_add(self, key: str, doc: dict):
+        matrix = self._matrices.get(doc.get("category", "unknown"))
+        if matrix is not None:
+            matrix.add(key, doc)
+
+    def _matrix_remove(self, key: str, doc: dict):
+        matrix = self._matrices.get(doc.get("category", "unknown"))
+        if matrix is not None:
+            matrix.remove(key)
+
+    # =========================
+    # 内部
+    # =========================
+
+    @staticmethod
+    def doc_key(doc: dict) -> str:
+        return str(doc.get("_id", id(doc)))
+
+    def _mark_stale(self, doc: dict):
+        self._stale_categories.add(doc.get("category", "unknown"))
+
+    def _categorize(self, categories) -> dict:
+        categorized = {category: [] for category in categories}
+        for doc in self._docs.values():
+            items = categorized.get(doc.get("category", "unknown"))
+            if items is not None:
+                items.append(doc)
+        return categorized
+
+    def _current_snapshot(self) -> dict | None:
+        # 差分更新が続いても作り直しは読み出し1回につき1度、変わったカテゴリだけ（既存のスナップショットは書き換えない）
+        with self._lock:
+            stale = self._stale_categories & set(CATEGORIES)
+            if stale and self._snapshot is not None:
+                self._snapshot = {**self._snapshot, **self._categorize(stale)}
+            self._stale_categories = set()
+            return self._snapshot
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "version": self.version,
+            "size": sum(len(items) for items in (self._current_snapshot() or {}).values()),
+            "age_sec": time.monotonic() - self._loaded_at if self.loaded else None,
+        }
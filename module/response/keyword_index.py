@@ -0,0 +1,75 @@
+# module/response/keyword_index.py
+
+# emotion_index 用の転置インデックス（カテゴリ別 キーワード → ドキュメントキー集合）。
+# EmotionIndexCache のロック内で更新される。posting は frozenset の差し替えで更新するので、
+# 読み手はロック無しで参照できる。
+# 全件の構築（from_docs）は可変の set に集めてから最後に1回だけ frozenset にする
+# （1件ずつ差し替えると、共通のキーワードで O(N²) になる）。
+
+
+class KeywordIndex:
+    def __init__(self):
+        self._postings = {}  # category -> {keyword -> frozenset(key)}
+        self._order = {}     # key -> 追加順（元の線形走査と同じ並びで返すため）
+        self._seq = 0
+
+    @staticmethod
+    def _keywords(doc: dict) -> set:
+        return set(doc.get("キーワード", []) or [])
+
+    @classmethod
+    def from_docs(cls, items) -> "KeywordIndex":
+        """(key, doc) の列から一括で作る。並びは items の順"""
+        index = cls()
+        building = {}  # category -> {keyword -> set(key)}
+        for key, doc in items:
+            if key not in index._order:
+                index._order[key] = index._seq
+                index._seq += 1
+            postings = building.setdefault(doc.get("category", "unknown"), {})
+            for keyword in cls._keywords(doc):
+                postings.setdefault(keyword, set()).add(key)
+        index._postings = {
+            category: {keyword: frozenset(keys) for keyword, keys in postings.items()}
+            for category, postings in building.items()
+        }
+        return index
+
+    def add(self, key: str, doc: dict):
+        if key not in self._order:
+            self._order[key] = self._seq
+            self._seq += 1
+        postings = self._postings.setdefault(doc.get("category", "unknown"), {})
+        for keyword in self._keywords(doc):
+            current = postings.get(keyword, frozenset())
+            if key not in current:
+                postings[keyword] = current | {key}
+
+    def remove(self, key: str, doc: dict):
+        postings = self._postings.get(doc.get("category", "unknown"), {})
+        for keyword in self._keywords(doc):
+            current = postings.get(keyword)
+            if current is None or key not in current:
+                continue
+            remaining = current - {key}
+            if remaining:
+                postings[keyword] = remaining
+            else:
+                postings.pop(keyword, None)
+        self._order.pop(key, None)
+
+    def overlaps(self, category: str, keywords) -> dict:
+        """{key: 一致したキーワード数}（入力キーワードは重複を除いて数える）"""
+        postings = self._postings.get(category, {})
+        counts = {}
+        for keyword in set(keywords or []):
+            for key in postings.get(keyword, ()):
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def sort_keys(self, keys) -> list:
+        order = self._order
+        return sorted(keys, key=lambda k: order.get(k, -1))
+
+    def keyword_count(self, category: str) -> int:
+        return len(self._postings.get(category, {}))
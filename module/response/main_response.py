@@ -1,16 +1,21 @@
 #module/responce/main_responce.py
 import json
 import os
-import re
 from bson import ObjectId
 
 import module.response.response_index as response_index
-import module.response.response_long as long_history
-import module.response.response_intermediate as intermediate_history
-import module.response.response_short as short_history
-from module.mongo.mongo_client import get_mongo_client
+from module.response.memory_lookup import (
+    find_history_records,
+    find_history_records_async,
+    find_history_records_fanout,
+    find_history_records_fanout_async,
+)
+from module.utils.concurrency import MEMORY_FANOUT_ENABLED
+from module.utils.request_context import request_memoized
+from module.mongo.mongo_client import get_mongo_client, get_collection
 from module.llm.llm_client import generate_gpt_response_from_history
 from module.utils.utils import logger
+from module.utils.json_block import find_json_block
 
 
 client = get_mongo_client()
@@ -20,13 +25,11 @@ db = client["emotion_db"]
 
 def get_mongo_collection(category, emotion_label):
     try:
-        client = get_mongo_client()
-        if client is None:
-            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
-
-        db = client["emotion_db"]
         collection_name = f"{category}_{emotion_label}"
-        return db[collection_name]
+        collection = get_collection(collection_name)
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        return collection
     except Exception as e:
         logger.error(f"[ERROR] MongoDBコレクション取得失敗: {e}")
         return None
@@ -37,8 +40,7 @@ import json
 def try_parse_json(text: str | tuple) -> dict | str:
     """
     🔹 文字列またはタプルからJSONを安全にパース。
-    - 完全なJSONならそのままパース
-    - テキスト中にJSONが埋まっている場合は正規表現で抽出してパース
+    - 完全なJSON・テキスト中に埋まったJSONのどちらも、末尾の { ... } を1回の走査で探してパース
     - 失敗時は元の文字列を返す
     """
     # 🔰 tupleだった場合は先頭要素を使用
@@ -46,26 +48,15 @@ def try_parse_json(text: str | tuple) -> dict | str:
         text = text[0]
         logger.warning("[WARN] 入力がtuple形式でした。先頭要素を使用します")
 
-    # 🔹 ステップ1: 完全なJSON文字列として処理を試みる
-    try:
-        parsed = json.loads(text)
-        logger.info(f"[INFO] JSONパース成功（直接）: {parsed}")
-        return parsed
-    except json.JSONDecodeError:
-        logger.warning(f"[WARN] JSONパース失敗。混在形式の可能性あり → 正規表現で抽出を試行")
-
-    # 🔍 正規表現で最も大きな { ... } ブロックを抽出
-    matches = re.findall(r'({.*})', text, re.DOTALL)
-    if matches:
-        for match in reversed(matches):  # 最後の候補から順に試す
-            try:
-                parsed = json.loads(match)
-                logger.info(f"[INFO] JSONパース成功（正規抽出）: {parsed}")
-                return parsed
-            except json.JSONDecodeError as e:
-                logger.warning(f"[WARN] 抽出JSONパース失敗: {e}")
+    # 🔍 文字列リテラルを考慮した括弧対応で { ... } を探す（最後の候補から順に json.loads）
+    block = find_json_block(text)
+    if block is not None and block.data is not None:
+        logger.info(f"[INFO] JSONパース成功: {block.data}")
+        return block.data
+    if block is None:
+        logger.warning("[WARN] JSON候補が見つかりません")
     else:
-        logger.warning("[WARN] 正規表現によるJSON候補抽出に失敗")
+        logger.warning("[WARN] 抽出JSONパース失敗")
 
     logger.info("[INFO] JSONとして解釈できませんでした。元のテキストを返します。")
     return text
@@ -145,55 +136,44 @@ def get_best_match(emotion_structure: dict) -> dict | None:
     return None
 
     #各カテゴリ（short → intermediate → long）から指定された感情名と日付に一致する履歴を取得して返す。
+    #カテゴリ全件は取得せず、(emotion, category, date) の直接検索1回で済ませる。
+    #同じリクエスト内（main.py と llm_client）で同じ (感情, 日付) を引く場合は1回で済ませる。
+@request_memoized("category_responses", key=lambda emotion_name, date_str: (emotion_name, date_str))
 def collect_all_category_responses(emotion_name: str, date_str: str) -> dict:
     logger.info(f"[START] collect_all_category_responses - 感情: {emotion_name}, 日付: {date_str}")
 
-    # short
-    all_short_data = short_history.get_all_short_category_data()
-    logger.debug(f"[INFO] shortカテゴリのデータ件数: {len(all_short_data)}")
-    short_match = short_history.search_short_history(
-        all_data=all_short_data,
-        emotion_name=emotion_name,
-        category_name="short",
-        target_date=date_str
-    )
-    if short_match:
-        logger.debug(f"[MATCH] shortカテゴリで一致データあり")
+    if MEMORY_FANOUT_ENABLED:
+        matched = find_history_records_fanout(emotion_name, date_str)
     else:
-        logger.debug(f"[NO MATCH] shortカテゴリで一致データなし")
-
-    # intermediate
-    all_intermediate_data = intermediate_history.get_all_intermediate_category_data()
-    logger.debug(f"[INFO] intermediateカテゴリのデータ件数: {len(all_intermediate_data)}")
-    intermediate_match = intermediate_history.search_intermediate_history(
-        all_data=all_intermediate_data,
-        emotion_name=emotion_name,
-        category_name="intermediate",
-        target_date=date_str
-    )
-    if intermediate_match:
-        logger.debug(f"[MATCH] intermediateカテゴリで一致データあり")
-    else:
-        logger.debug(f"[NO MATCH] intermediateカテゴリで一致データなし")
-
-    # long
-    all_long_data = long_history.get_all_long_category_data()
-    logger.debug(f"[INFO] longカテゴリのデータ件数: {len(all_long_data)}")
-    long_match = long_history.search_long_history(
-        all_data=all_long_data,
-        emotion_name=emotion_name,
-        category_name="long",
-        target_date=date_str
-    )
-    if long_match:
-        logger.debug(f"[MATCH] longカテゴリで一致データあり")
-    else:
-        logger.debug(f"[NO MATCH] longカテゴリで一致データなし")
+        matched = find_history_records(emotion_name, date_str)
+    for category in ["short", "intermediate", "long"]:
+        if matched.get(category):
+            logger.debug(f"[MATCH] {category}カテゴリで一致データあり")
+        else:
+            logger.debug(f"[NO MATCH] {category}カテゴリで一致データなし")
 
     logger.debug("[END] collect_all_category_responses 完了")
 
     return {
-        "short": short_match,
-        "intermediate": intermediate_match,
-        "long": long_match
+        "short": matched.get("short"),
+        "intermediate": matched.get("intermediate"),
+        "long": matched.get("long")
+    }
+
+    #非同期版
+@request_memoized("category_responses", key=lambda emotion_name, date_str: (emotion_name, date_str))
+async def collect_all_category_responses_async(emotion_name: str, date_str: str) -> dict:
+    logger.info(f"[START] collect_all_category_responses_async - 感情: {emotion_name}, 日付: {date_str}")
+
+    if MEMORY_FANOUT_ENABLED:
+        matched = await find_history_records_fanout_async(emotion_name, date_str)
+    else:
+        matched = await find_history_records_async(emotion_name, date_str)
+
+    logger.debug("[END] collect_all_category_responses_async 完了")
+
+    return {
+        "short": matched.get("short"),
+        "intermediate": matched.get("intermediate"),
+        "long": matched.get("long")
     }
@@ -0,0 +1,144 @@
+#module/response/memory_lookup.py
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.utils.utils import logger
+from module.utils.metrics import timed
+from module.utils.concurrency import gather_with_deadline, run_with_deadline, MEMORY_FANOUT_DEADLINE_SEC
+from module.response.memory_record_cache import get_memory_record_cache
+
+CATEGORIES = ("short", "intermediate", "long")
+
+# (emotion, category, date) で emotion_data の履歴1件を直接引く。
+# カテゴリ全件を取得して Python で探す代わりに、category_emotion / data_history_date インデックスを使うクエリにし、
+# 履歴配列は一致した要素だけを返す（位置指定 "$" 射影。入れ子の配列には $elemMatch 射影が使えないため）。
+# Point lookup of one history record by (emotion, category, date); only the matching array element is returned.
+
+
+def build_history_lookup(emotion_name: str, target_date: str, categories=CATEGORIES) -> tuple[dict, dict]:
+    query = {
+        "emotion": emotion_name,
+        "category": {"$in": list(categories)},
+        "data.履歴.date": target_date
+    }
+    projection = {"_id": 0, "category": 1, "data.履歴.$": 1}
+    return query, projection
+
+
+def _first_record(doc: dict) -> dict | None:
+    history = doc.get("data", {}).get("履歴", [])
+    return history[0] if history else None
+
+
+def _pick_per_category(docs, categories) -> dict:
+    # 同じカテゴリに複数あれば先頭（従来の線形探索と同じ）
+    found = {category: None for category in categories}
+    for doc in docs:
+        category = doc.get("category")
+        if category in found and found[category] is None:
+            found[category] = _first_record(doc)
+    return found
+
+
+# キャッシュ済みのカテゴリを先に埋め、残りのカテゴリを返す（キャッシュのレコードは読み取り専用）
+def _from_cache(emotion_name: str, target_date: str, categories) -> tuple[dict, list]:
+    cache = get_memory_record_cache()
+    found, missing = {}, []
+    for category in categories:
+        hit, record = cache.get(emotion_name, category, target_date) if cache is not None else (False, None)
+        if hit:
+            found[category] = record
+        else:
+            missing.append(category)
+    return found, missing
+
+
+def _to_cache(emotion_name: str, target_date: str, found: dict):
+    cache = get_memory_record_cache()
+    if cache is not None:
+        for category, record in found.items():
+            cache.put(emotion_name, category, target_date, record)
+
+
+# 各カテゴリの一致履歴をまとめて取得（1回のクエリ）。戻り値: {category: 履歴 or None}
+# Fetch the matching record for each category in one query
+@timed("db.find_history_records")
+def find_history_records(emotion_name: str, target_date: str, categories=CATEGORIES) -> dict:
+    if not emotion_name or not target_date:
+        return {category: None for category in categories}
+    found, missing = _from_cache(emotion_name, target_date, categories)
+    if not missing:
+        return {category: found[category] for category in categories}
+    try:
+        collection = get_collection("emotion_data")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        query, projection = build_history_lookup(emotion_name, target_date, missing)
+        fetched = _pick_per_category(collection.find(query, projection), missing)
+        _to_cache(emotion_name, target_date, fetched)
+        found.update(fetched)
+        logger.info(f"✅ 履歴の直接検索: 感情={emotion_name}, 日付={target_date}, 一致={[c for c, r in found.items() if r]}")
+        return {category: found[category] for category in categories}
+    except Exception as e:
+        logger.error(f"[ERROR] 履歴の直接検索に失敗: {e}")
+        return {category: None for category in categories}
+
+
+@timed("db.find_history_records")
+async def find_history_records_async(emotion_name: str, target_date: str, categories=CATEGORIES) -> dict:
+    if not emotion_name or not target_date:
+        return {category: None for category in categories}
+    found, missing = _from_cache(emotion_name, target_date, categories)
+    if not missing:
+        return {category: found[category] for category in categories}
+    try:
+        collection = get_async_collection("emotion_data")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        query, projection = build_history_lookup(emotion_name, target_date, missing)
+        docs = await collection.find(query, projection).to_list(None)
+        fetched = _pick_per_category(docs, missing)
+        _to_cache(emotion_name, target_date, fetched)
+        found.update(fetched)
+        logger.info(f"✅ 履歴の直接検索: 感情={emotion_name}, 日付={target_date}, 一致={[c for c, r in found.items() if r]}")
+        return {category: found[category] for category in categories}
+    except Exception as e:
+        logger.error(f"[ERROR] 履歴の直接検索に失敗: {e}")
+        return {category: None for category in categories}
+
+
+# カテゴリごとのクエリを並列に投げ、共通の締め切りまでに返った分だけを使う（遅いカテゴリは None）
+# Fan-out variant: one query per category in parallel under a shared deadline; late categories are None
+def find_history_records_fanout(
+    emotion_name: str,
+    target_date: str,
+    categories=CATEGORIES,
+    timeout: float = MEMORY_FANOUT_DEADLINE_SEC
+) -> dict:
+    return run_with_deadline(
+        {category: (lambda c=category: find_history_record(emotion_name, c, target_date)) for category in categories},
+        timeout,
+        stage="memory_lookup"
+    )
+
+
+async def find_history_records_fanout_async(
+    emotion_name: str,
+    target_date: str,
+    categories=CATEGORIES,
+    timeout: float = MEMORY_FANOUT_DEADLINE_SEC
+) -> dict:
+    return await gather_with_deadline(
+        {category: find_history_record_async(emotion_name, category, target_date) for category in categories},
+        timeout,
+        stage="memory_lookup"
+    )
+
+
+# 1カテゴリだけ引く
+# Single-category lookup
+def find_history_record(emotion_name: str, category_name: str, target_date: str) -> dict | None:
+    return find_history_records(emotion_name, target_date, (category_name,))[category_name]
+
+
+async def find_history_record_async(emotion_name: str, category_name: str, target_date: str) -> dict | None:
+    return (await find_history_records_async(emotion_name, target_date, (category_name,)))[category_name]
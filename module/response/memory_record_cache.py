@@ -0,0 +1,132 @@
+# module/response/memory_record_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from module.utils.metrics import counter
+
+# emotion_data の履歴レコード（best_match が指す記憶）のプロセス内キャッシュ。
+# キーは (emotion, category, date)。memory_lookup の検索結果と write_structured_emotion_data の書き込みで埋まり、
+# 忘却処理（oblivion_index）が履歴を消したときに該当キーだけを無効化する。
+# 件数上限（LRU）と TTL の両方で古いものを捨てる。見つからなかった結果も短い TTL で覚えておく。
+# Bounded LRU/TTL cache of resolved memory records keyed by (emotion, category, date).
+
+MEMORY_RECORD_CACHE_ENABLED = os.getenv("MEMORY_RECORD_CACHE_ENABLED", "1") == "1"
+MEMORY_RECORD_CACHE_SIZE = int(os.getenv("MEMORY_RECORD_CACHE_SIZE", "1024"))
+MEMORY_RECORD_CACHE_TTL_SEC = float(os.getenv("MEMORY_RECORD_CACHE_TTL_SEC", "600"))
+# 「該当なし」を覚えておく時間（他プロセスの書き込みを拾えるよう短め）。0 以下で覚えない
+MEMORY_RECORD_CACHE_NEGATIVE_TTL_SEC = float(os.getenv("MEMORY_RECORD_CACHE_NEGATIVE_TTL_SEC", "30"))
+
+MEMORY_RECORD_CACHE_EVENTS = counter(
+    "yumia_memory_record_cache_events_total", "Memory record cache hits / misses / evictions / invalidations", ("event",)
+)
+
+_MISSING = object()
+
+
+class MemoryRecordCache:
+    def __init__(
+        self,
+        maxsize: int = MEMORY_RECORD_CACHE_SIZE,
+        ttl: float = MEMORY_RECORD_CACHE_TTL_SEC,
+        negative_ttl: float = MEMORY_RECORD_CACHE_NEGATIVE_TTL_SEC,
+        clock=time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, record)
+        self._by_date = {}  # date -> {key}（忘却処理の日付指定の無効化用）
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _count(self, event: str, n: int = 1):
+        self._stats[event] += n
+        MEMORY_RECORD_CACHE_EVENTS.inc(n, event=event)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_date.get(key[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_date[key[2]]
+
+    def get(self, emotion: str, category: str, date: str):
+        """(見つかったか, レコード or None)。レコードが None でも found=True なら「該当なし」がキャッシュされている"""
+        key = (emotion, category, date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._count("misses")
+                return False, None
+            expires_at, record = entry
+            if expires_at <= self._clock():
+                self._drop(key)
+                self._count("expirations")
+                self._count("misses")
+                return False, None
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return True, record
+
+    def put(self, emotion: str, category: str, date: str, record: dict | None):
+        ttl = self.ttl if record is not None else self.negative_ttl
+        if ttl <= 0 or self.maxsize <= 0 or not date:
+            return
+        key = (emotion, category, date)
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, record)
+            self._entries.move_to_end(key)
+            self._by_date.setdefault(date, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._count("evictions")
+
+    def put_written(self, emotion: str, category: str, date: str, record: dict):
+        """
+        書き込み直後用。既に記録がキャッシュされていれば残す（emotion_data では先に保存された方が返るため）。
+        「該当なし」のエントリは上書きする
+        """
+        key = (emotion, category, date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[0] > self._clock():
+                return
+        self.put(emotion, category, date, record)
+
+    def invalidate(self, emotion: str, category: str, date: str):
+        key = (emotion, category, date)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+                self._count("invalidations")
+
+    def invalidate_date(self, date: str):
+        """emotion / category が分からない削除（emotion_index 側の忘却）用"""
+        with self._lock:
+            keys = list(self._by_date.get(date, ()))
+            for key in keys:
+                self._drop(key)
+            if keys:
+                self._count("invalidations", len(keys))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_date.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+_memory_record_cache = MemoryRecordCache() if MEMORY_RECORD_CACHE_ENABLED else None
+
+
+def get_memory_record_cache() -> MemoryRecordCache | None:
+    """無効化されている場合は None"""
+    return _memory_record_cache
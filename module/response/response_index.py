@@ -2,12 +2,48 @@
 import json
 import os
 import re
+import heapq
+import numpy as np
 from bson import ObjectId
 
 from module.utils.utils import logger
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.utils.metrics import timed
+from module.utils.single_flight import single_flight
+from module.utils.concurrency import (
+    gather_with_deadline,
+    run_with_deadline,
+    MEMORY_FANOUT_ENABLED,
+    MEMORY_FANOUT_DEADLINE_SEC,
+)
+from module.response.index_cache import EmotionIndexCache, INDEX_CACHE_ENABLED
+from module.response.composition_matrix import (
+    best_match_index,
+    evaluate_candidates,
+    top_k_indices,
+    is_valid_composition,
+    composition_score,
+)
 from module.params import emotion_map  # 英語→日本語変換マップ
 
+# 構成比マッチングを NumPy の行列演算で行うか（0 で従来の Python ループ）
+COMPOSITION_MATCH_VECTORIZED = os.getenv("COMPOSITION_MATCH_VECTORIZED", "1") == "1"
+
+# 上位k件検索の既定値（k・カテゴリ別に k 件ずつ返すか・スコア下限）
+INDEX_SEARCH_TOP_K = int(os.getenv("INDEX_SEARCH_TOP_K", "3"))
+INDEX_SEARCH_PER_CATEGORY = os.getenv("INDEX_SEARCH_PER_CATEGORY", "0") == "1"
+INDEX_SEARCH_MIN_SCORE = float(os.getenv("INDEX_SEARCH_MIN_SCORE", "0"))
+
+# 候補の取り方
+#   local  : emotion_index をプロセス内（キャッシュ、無効なら毎回全件取得）で絞り込む
+#   server : カテゴリとキーワードの絞り込みを Mongo の集計パイプラインで行い、一致分だけ取得する
+INDEX_SEARCH_MODE = os.getenv("INDEX_SEARCH_MODE", "local").lower()
+
+# server モードで取得するフィールド
+INDEX_SEARCH_PROJECTION = {"構成比": 1, "キーワード": 1, "emotion": 1, "date": 1, "category": 1}
+INDEX_CATEGORIES = ("long", "intermediate", "short")
+
 # 構成比とキーワードを受け取る検索インターフェース
 # Search interface that receives composition and keywords
 def search_index_response(emotion_structure: dict) -> dict:
@@ -17,21 +53,188 @@ def search_index_response(emotion_structure: dict) -> dict:
     keywords = emotion_structure.get("keywords", [])
 
     # インデックスデータの読み込み
+    if INDEX_SEARCH_MODE == "server":
+        return _search_categorized_index(load_index_candidates(keywords), composition, keywords, local=False)
     categorized_index = load_and_categorize_index()
 
+    return _search_categorized_index(categorized_index, composition, keywords)
+
+
+# 非同期版：インデックス取得のみ await し、マッチングは同じ処理を使う
+# Async variant: only the index load is awaited, matching is shared
+async def search_index_response_async(emotion_structure: dict) -> dict:
+    composition = emotion_structure.get("構成比", {})
+    keywords = emotion_structure.get("keywords", [])
+
+    if INDEX_SEARCH_MODE == "server":
+        return _search_categorized_index(await load_index_candidates_async(keywords), composition, keywords, local=False)
+    categorized_index = await load_and_categorize_index_async()
+
+    return _search_categorized_index(categorized_index, composition, keywords)
+
+
+# local=False のときは categorized_index がサーバー側で絞り込み済み（キャッシュは使わない）
+def _search_categorized_index(categorized_index: dict, composition: dict, keywords: list, local: bool = True) -> dict:
+    use_cache = local and INDEX_CACHE_ENABLED
     # カテゴリごとに検索
     best_matches = {}
     for category, data in categorized_index.items():
-        # キーワードでフィルタリング
-        keyword_filtered = filter_by_keywords(data, keywords)
+        # キーワードでフィルタリング（キャッシュ有効時は転置インデックスを使う）
+        if not local:
+            keyword_filtered = data
+        elif use_cache:
+            keyword_filtered = filter_by_keywords_indexed(category, keywords)
+        else:
+            keyword_filtered = filter_by_keywords(data, keywords)
         # 構成比で最良候補を選択
-        best_match = find_best_match_by_composition(composition, keyword_filtered)
+        if COMPOSITION_MATCH_VECTORIZED and use_cache:
+            best_match = find_best_match_by_composition_vectorized(
+                composition,
+                keyword_filtered,
+                matrix=_index_cache.composition_matrix(category),
+                keys=[_index_cache.doc_key(doc) for doc in keyword_filtered]
+            )
+        elif COMPOSITION_MATCH_VECTORIZED:
+            best_match = find_best_match_by_composition_vectorized(composition, keyword_filtered)
+        else:
+            best_match = find_best_match_by_composition(composition, keyword_filtered)
         if best_match:
             best_matches[category] = best_match
 
     return best_matches
 
 
+# 上位k件検索：スコア・キーワード一致数・カテゴリ付きの候補リストを返す
+# Top-k search: returns ranked hits with score, keyword overlap and category
+#
+#   [{"category": "short", "score": 87.5, "keyword_overlap": 2, "document": {...}}, ...]
+#
+# per_category=True ならカテゴリごとに k 件ずつ（long → intermediate → short の順）、
+# False なら全カテゴリを通したスコア上位 k 件。min_score 未満の候補は返さない。
+def search_index_top_k(
+    emotion_structure: dict,
+    k: int | None = None,
+    per_category: bool | None = None,
+    min_score: float | None = None
+) -> list[dict]:
+    composition = emotion_structure.get("構成比", {})
+    keywords = emotion_structure.get("keywords", [])
+
+    if INDEX_SEARCH_MODE == "server":
+        candidates = _with_overlaps(load_index_candidates(keywords))
+    else:
+        candidates = _local_candidates(load_and_categorize_index(), keywords)
+
+    return _rank_candidates(candidates, composition, k, per_category, min_score)
+
+
+async def search_index_top_k_async(
+    emotion_structure: dict,
+    k: int | None = None,
+    per_category: bool | None = None,
+    min_score: float | None = None
+) -> list[dict]:
+    composition = emotion_structure.get("構成比", {})
+    keywords = emotion_structure.get("keywords", [])
+
+    if INDEX_SEARCH_MODE == "server":
+        candidates = _with_overlaps(await load_index_candidates_async(keywords))
+    else:
+        candidates = _local_candidates(await load_and_categorize_index_async(), keywords)
+
+    return _rank_candidates(candidates, composition, k, per_category, min_score)
+
+
+def _rank_categorized_index(
+    categorized_index: dict,
+    composition: dict,
+    keywords: list,
+    k: int | None,
+    per_category: bool | None,
+    min_score: float | None
+) -> list[dict]:
+    return _rank_candidates(_local_candidates(categorized_index, keywords), composition, k, per_category, min_score)
+
+
+# candidates: {category: (候補リスト, 一致キーワード数リスト, キャッシュの行列を使えるか)}
+def _rank_candidates(
+    candidates_by_category: dict,
+    composition: dict,
+    k: int | None,
+    per_category: bool | None,
+    min_score: float | None
+) -> list[dict]:
+    k = INDEX_SEARCH_TOP_K if k is None else k
+    per_category = INDEX_SEARCH_PER_CATEGORY if per_category is None else per_category
+    min_score = INDEX_SEARCH_MIN_SCORE if min_score is None else min_score
+
+    hits = []
+    for category, (candidates, overlaps, use_cache) in candidates_by_category.items():
+        if not candidates:
+            continue
+        valid, scores = _score_candidates(category, composition, candidates, use_cache)
+        for i in top_k_indices(valid, scores, k, min_score):
+            hits.append({
+                "category": category,
+                "score": float(scores[i]),
+                "keyword_overlap": overlaps[i],
+                "document": candidates[i]
+            })
+
+    if not per_category:
+        # カテゴリ別の上位を統合して全体の上位 k 件に（同点はカテゴリ順を保つ）
+        hits = heapq.nlargest(k, hits, key=lambda hit: hit["score"])
+
+    logger.info(f"🏅 上位候補: {[(h['category'], round(h['score'], 1), h['keyword_overlap']) for h in hits]}")
+    return hits
+
+
+def _local_candidates(categorized_index: dict, keywords: list) -> dict:
+    return {
+        category: (*_keyword_candidates(category, data, keywords), INDEX_CACHE_ENABLED)
+        for category, data in categorized_index.items()
+    }
+
+
+# サーバー側で絞り込んだ結果（keyword_overlap 付き）を候補形式に
+def _with_overlaps(categorized_index: dict) -> dict:
+    return {
+        category: (docs, [doc.pop("keyword_overlap", 0) for doc in docs], False)
+        for category, docs in categorized_index.items()
+    }
+
+
+# キーワードで候補を絞り、候補ごとの一致キーワード数も返す
+def _keyword_candidates(category: str, data: list, keywords: list) -> tuple[list, list]:
+    if INDEX_CACHE_ENABLED:
+        matched = _index_cache.match_keywords(category, keywords)
+        return [doc for doc, _ in matched], [count for _, count in matched]
+
+    input_keywords = set(keywords)
+    candidates = filter_by_keywords(data, keywords)
+    return candidates, [len(set(doc.get("キーワード", [])) & input_keywords) for doc in candidates]
+
+
+# 候補ごとの (適格か, スコア)。判定基準は find_best_match_by_composition と同じ
+def _score_candidates(category: str, composition: dict, candidates: list, use_cache: bool):
+    if COMPOSITION_MATCH_VECTORIZED:
+        if use_cache:
+            return evaluate_candidates(
+                composition,
+                candidates,
+                matrix=_index_cache.composition_matrix(category),
+                keys=[_index_cache.doc_key(doc) for doc in candidates]
+            )
+        return evaluate_candidates(composition, candidates)
+
+    valid = np.array([is_valid_composition(c["構成比"], composition) for c in candidates], dtype=bool)
+    scores = np.array(
+        [composition_score(composition, c["構成比"]) if ok else 0.0 for c, ok in zip(candidates, valid)],
+        dtype=np.float64
+    )
+    return valid, scores
+
+
 # 英語の感情名を日本語に変換
 # Convert emotion name from English to Japanese
 def translate_emotion(emotion): 
@@ -44,17 +247,17 @@ def normalize_composition_vector(partial_composition: dict) -> dict:
     return {jp_emotion: partial_composition.get(jp_emotion, 0) for jp_emotion in emotion_map.values()}
 
 
-# MongoDBからemotion_indexを取得
-# Load emotion_index from MongoDB
+# MongoDBからemotion_indexを取得（同時に呼ばれたら1回の読込を共有する）
+# Load emotion_index from MongoDB (concurrent callers share one load)
+@single_flight("load_index")
+@timed("db.load_index")
 def load_index():
     logger.debug("📥 [STEP] MongoDBからemotion_indexを取得します...")
     try:
-        client = get_mongo_client()
-        if client is None:
+        collection = get_collection("emotion_index")
+        if collection is None:
             raise ConnectionError("MongoDBクライアントの取得に失敗しました")
         # Failed to obtain MongoDB client
-        db = client["emotion_db"]
-        collection = db["emotion_index"]
         data = list(collection.find({}))
         logger.info(f"✅ [SUCCESS] emotion_index データ件数: {len(data)}")
         # Number of emotion_index records
@@ -65,11 +268,144 @@ def load_index():
         return []
 
 
+# MongoDBからemotion_indexを取得（非同期版）
+# Load emotion_index from MongoDB (async)
+@single_flight("load_index")
+@timed("db.load_index")
+async def load_index_async():
+    logger.debug("📥 [STEP] MongoDBからemotion_indexを取得します...")
+    try:
+        collection = get_async_collection("emotion_index")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        data = await collection.find({}).to_list(None)
+        logger.info(f"✅ [SUCCESS] emotion_index データ件数: {len(data)}")
+        return data
+    except Exception as e:
+        logger.warning(f"❌ [ERROR] MongoDBからの取得に失敗: {e}")
+        return []
+
+
+# カテゴリとキーワード（$in）の絞り込みを Mongo 側で行う集計パイプライン。
+# 一致キーワード数も $setIntersection でサーバー側で数える。
+# Pipeline that pushes the category / keyword filter into Mongo and counts keyword overlap there.
+def build_index_candidates_pipeline(keywords: list, categories=INDEX_CATEGORIES) -> list[dict]:
+    keywords = list(dict.fromkeys(keywords))
+    return [
+        {"$match": {"category": {"$in": list(categories)}, "キーワード": {"$in": keywords}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            **INDEX_SEARCH_PROJECTION,
+            "keyword_overlap": {"$size": {"$setIntersection": [{"$ifNull": ["$キーワード", []]}, keywords]}}
+        }}
+    ]
+
+
+def _candidates_flight_key(keywords: list, categories=INDEX_CATEGORIES) -> tuple:
+    return tuple(keywords), tuple(categories)
+
+
+def _categorize_candidates(docs: list, categories=INDEX_CATEGORIES) -> dict:
+    categorized = {category: [] for category in categories}
+    for doc in docs:
+        categorized[doc["category"]].append(doc)
+    return categorized
+
+
+# キーワードに一致する emotion_index だけを取得（カテゴリ別）
+# Load only keyword-matching emotion_index entries, categorized
+# MEMORY_FANOUT_ENABLED ならカテゴリごとのパイプラインを並列に投げ、締め切りに遅れたカテゴリは空で返す
+# 同じキーワードでの同時呼び出しは1回にまとめる（呼び出し側が keyword_overlap を pop するので結果はコピーして渡す）
+@single_flight("load_index_candidates", key=_candidates_flight_key, copy_result=True)
+@timed("db.load_index_candidates")
+def load_index_candidates(keywords: list, categories=INDEX_CATEGORIES) -> dict:
+    if not keywords:
+        return _categorize_candidates([], categories)
+    if MEMORY_FANOUT_ENABLED and len(categories) > 1:
+        return run_with_deadline(
+            {c: (lambda c=c: load_index_candidates(keywords, (c,))[c]) for c in categories},
+            MEMORY_FANOUT_DEADLINE_SEC,
+            default=[],
+            stage="index_candidates"
+        )
+    try:
+        collection = get_collection("emotion_index")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        docs = list(collection.aggregate(build_index_candidates_pipeline(keywords, categories)))
+        logger.info(f"✅ [SUCCESS] emotion_index キーワード一致件数（サーバー側絞り込み）: {len(docs)}")
+        return _categorize_candidates(docs, categories)
+    except Exception as e:
+        logger.warning(f"❌ [ERROR] MongoDBからの取得に失敗: {e}")
+        return _categorize_candidates([], categories)
+
+
+@single_flight("load_index_candidates", key=_candidates_flight_key, copy_result=True)
+@timed("db.load_index_candidates")
+async def load_index_candidates_async(keywords: list, categories=INDEX_CATEGORIES) -> dict:
+    if not keywords:
+        return _categorize_candidates([], categories)
+    if MEMORY_FANOUT_ENABLED and len(categories) > 1:
+        results = await gather_with_deadline(
+            {c: load_index_candidates_async(keywords, (c,)) for c in categories},
+            MEMORY_FANOUT_DEADLINE_SEC,
+            default={},
+            stage="index_candidates"
+        )
+        return {c: results[c].get(c, []) for c in categories}
+    try:
+        collection = get_async_collection("emotion_index")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+        cursor = await collection.aggregate(build_index_candidates_pipeline(keywords, categories))
+        docs = await cursor.to_list(None)
+        logger.info(f"✅ [SUCCESS] emotion_index キーワード一致件数（サーバー側絞り込み）: {len(docs)}")
+        return _categorize_candidates(docs, categories)
+    except Exception as e:
+        logger.warning(f"❌ [ERROR] MongoDBからの取得に失敗: {e}")
+        return _categorize_candidates([], categories)
+
+
+# 変更検知用のウォーターマーク（最新 _id と推定件数）
+# Watermark for change detection (latest _id and estimated count)
+def load_index_watermark():
+    collection = get_collection("emotion_index")
+    if collection is None:
+        return None
+    latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return (str(latest["_id"]) if latest else None, collection.estimated_document_count())
+
+
+_index_cache = EmotionIndexCache(
+    loader=load_index,
+    async_loader=load_index_async,
+    watermark_getter=load_index_watermark
+)
+
+
+# プロセス内の emotion_index キャッシュ（save_index_data / 忘却処理から差分更新される）
+# Process-local emotion_index cache (updated incrementally by writers)
+def get_index_cache() -> EmotionIndexCache:
+    return _index_cache
+
+
 # 取得したemotion_indexをカテゴリごとに分類
 # Categorize loaded emotion_index data by category
 def load_and_categorize_index():
     logger.info("📂 [STEP] インデックスをカテゴリごとに分類します...")
-    all_index = load_index()
+    if INDEX_CACHE_ENABLED:
+        return _index_cache.get_categorized()
+    return categorize_index(load_index())
+
+
+async def load_and_categorize_index_async():
+    logger.info("📂 [STEP] インデックスをカテゴリごとに分類します...")
+    if INDEX_CACHE_ENABLED:
+        return await _index_cache.get_categorized_async()
+    return categorize_index(await load_index_async())
+
+
+def categorize_index(all_index: list) -> dict:
     categorized = {"long": [], "intermediate": [], "short": []}
 
     for item in all_index:
@@ -93,6 +429,15 @@ def filter_by_keywords(index_data, input_keywords):
     return filtered
 
 
+# 転置インデックス版：入力キーワードの posting の和集合を取る（結果は filter_by_keywords と同じ）
+# Inverted-index variant: union of postings for the input keywords (same result as filter_by_keywords)
+def filter_by_keywords_indexed(category, input_keywords):
+    logger.info(f"🔍 キーワードフィルタ適用（転置インデックス）: {input_keywords}")
+    filtered = [doc for doc, _ in _index_cache.match_keywords(category, input_keywords)]
+    logger.info(f"🎯 一致件数: {len(filtered)}")
+    return filtered
+
+
 # 構成比の一致スコアに基づき最も近い候補を選出
 # Find best match based on similarity of emotion composition
 def find_best_match_by_composition(current_composition, candidates):
@@ -155,3 +500,22 @@ def find_best_match_by_composition(current_composition, candidates):
     logger.info(f"🏅 最も構成比が近い候補を選出: {jp_emotion}")
 
     return best
+
+
+# 行列版：構成比を float32 行列にして全候補を一度に判定する（結果は find_best_match_by_composition と同じ）
+# Vectorized variant: evaluates all candidates in one pass over a float32 matrix (same result as above)
+def find_best_match_by_composition_vectorized(current_composition, candidates, matrix=None, keys=None):
+    logger.info(f"🔎 構成比マッチング対象数: {len(candidates)}")
+
+    best_index, valid_count = best_match_index(current_composition, candidates, matrix, keys)
+
+    logger.info(f"✅ 有効な候補数: {valid_count}")
+    if best_index is None:
+        logger.warning("❌ 構成比マッチ候補なし")
+        return None
+
+    best = candidates[best_index]
+    jp_emotion = translate_emotion(best.get("emotion", "Unknown"))
+    logger.info(f"🏅 最も構成比が近い候補を選出: {jp_emotion}")
+
+    return best
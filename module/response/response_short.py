@@ -2,22 +2,22 @@
 import json
 from bson import ObjectId
 
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
 from module.response.response_index import find_best_match_by_composition
 from module.utils.utils import logger
+from module.utils.metrics import timed
 
 # MongoDBのemotion_dataから、categoryが"short"の全データを取得する。
 # Retrieve all data from MongoDB emotion_data where category is "short".
+@timed("db.get_all_short_category_data")
 def get_all_short_category_data():
     try:
-        client = get_mongo_client()
-        if client is None:
+        collection = get_collection("emotion_data")
+        if collection is None:
             raise ConnectionError("MongoDBクライアントの取得に失敗しました")
         # Failed to obtain MongoDB client
 
-        db = client["emotion_db"]
-        collection = db["emotion_data"]
-
         short_data = list(collection.find({"category": "short"}))
         logger.info(f"✅ shortカテゴリのデータ件数: {len(short_data)}")
         # Number of records in short category
@@ -28,6 +28,23 @@ def get_all_short_category_data():
         # Failed to retrieve short category data
         return []
 
+# 非同期版（イベントループをブロックしない）
+# Async variant that does not block the event loop
+@timed("db.get_all_short_category_data")
+async def get_all_short_category_data_async():
+    try:
+        collection = get_async_collection("emotion_data")
+        if collection is None:
+            raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+
+        short_data = await collection.find({"category": "short"}).to_list(None)
+        logger.info(f"✅ shortカテゴリのデータ件数: {len(short_data)}")
+        return short_data
+
+    except Exception as e:
+        logger.error(f"[ERROR] shortカテゴリデータの取得失敗: {e}")
+        return []
+
 # 取得済みshortデータ群から、emotion・category・dateが一致する履歴1件を探して返す。
 # From the fetched short data, find and return one record where emotion, category, and date all match.
 def search_short_history(all_data, emotion_name, category_name, target_date):
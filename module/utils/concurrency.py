@@ -0,0 +1,100 @@
+# module/utils/concurrency.py
+import os
+import asyncio
+import atexit
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from module.utils.metrics import counter
+
+# 独立した複数の問い合わせ（カテゴリ別の検索など）を並列に投げ、共通の締め切りまでに
+# 返ってきた分だけを使うためのヘルパー。遅い・失敗したものは default に置き換える。
+# Fan-out helpers: run independent lookups concurrently under one shared deadline and keep partial results.
+
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "8"))
+
+# 記憶検索（short / intermediate / long）をカテゴリごとに並列で問い合わせるか、とその共通締め切り（秒）
+MEMORY_FANOUT_ENABLED = os.getenv("MEMORY_FANOUT_ENABLED", "0") == "1"
+MEMORY_FANOUT_DEADLINE_SEC = float(os.getenv("MEMORY_FANOUT_DEADLINE_SEC", "2.0"))
+
+FANOUT_INCOMPLETE = counter(
+    "yumia_fanout_incomplete_total", "Fan-out branches that missed the deadline or failed", ("stage", "reason")
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_fanout_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+def _log_incomplete(stage: str, key, reason: str, error: BaseException | None = None):
+    # utils.utils は Mongo 周りを読み込むので遅延 import
+    from module.utils.utils import logger
+
+    FANOUT_INCOMPLETE.inc(stage=stage, reason=reason)
+    if reason == "timeout":
+        logger.warning(f"⏱️ {stage}: {key} が締め切りまでに終わらなかったため部分結果で続行")
+    else:
+        logger.warning(f"⚠ {stage}: {key} が失敗したため部分結果で続行: {error}")
+
+
+async def gather_with_deadline(tasks: dict, timeout: float | None, default=None, stage: str = "fanout") -> dict:
+    """
+    {key: awaitable} を並列に実行し {key: 結果} を返す。
+    timeout 秒（全体で共通）までに終わらなかったもの・例外になったものは default。未完了分はキャンセルする。
+    """
+    if not tasks:
+        return {}
+    futures = {key: asyncio.ensure_future(task) for key, task in tasks.items()}
+    done, pending = await asyncio.wait(futures.values(), timeout=timeout)
+    for future in pending:
+        future.cancel()
+
+    results = {}
+    for key, future in futures.items():
+        if future not in done:
+            _log_incomplete(stage, key, "timeout")
+            results[key] = default
+        elif future.exception() is not None:
+            _log_incomplete(stage, key, "error", future.exception())
+            results[key] = default
+        else:
+            results[key] = future.result()
+    return results
+
+
+def run_with_deadline(calls: dict, timeout: float | None, default=None, stage: str = "fanout") -> dict:
+    """
+    {key: 引数なしの関数} をスレッドプールで並列に実行し {key: 結果} を返す（同期コード用）。
+    締め切りを過ぎたスレッドは止められないので、結果を待たずに default で返す。
+    リクエスト単位の計測（contextvars）は各スレッドに引き継ぐ。
+    """
+    if not calls:
+        return {}
+    executor = get_fanout_executor()
+    futures = {
+        key: executor.submit(contextvars.copy_context().run, call)
+        for key, call in calls.items()
+    }
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    results = {}
+    for key, future in futures.items():
+        if future not in done:
+            future.cancel()
+            _log_incomplete(stage, key, "timeout")
+            results[key] = default
+        elif future.exception() is not None:
+            _log_incomplete(stage, key, "error", future.exception())
+            results[key] = default
+        else:
+            results[key] = future.result()
+    return results
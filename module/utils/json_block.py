@@ -0,0 +1,126 @@
+# module/utils/json_block.py
+import re
+import json
+
+from module.utils.request_context import request_memoized
+
+# LLM応答の末尾にある感情JSON（```json フェンス付き／裸の {...}）を1回の走査で見つける。
+# 文字列リテラル内の括弧を数えない括弧対応スキャナで、トップレベルの {...} の範囲だけを記録し、
+# json.loads はその範囲（最後のものから）に対してだけ行う。チャンク単位で feed できるのでストリームにも使える。
+# Single-pass, string-aware scanner for the trailing JSON object in an LLM response.
+
+# {} と文字列・エスケープに関わる文字だけを拾う（それ以外の文字は読み飛ばす）
+_SPECIAL = re.compile(r'[{}"\\]')
+_FENCE_OPEN = re.compile(r"```(?:json)?\s*$")
+_FENCE_CLOSE = re.compile(r"^\s*```")
+
+
+class JsonBlock:
+    """見つかったJSONブロック。data はパース結果、start / end は元テキスト上の範囲（フェンス込み）"""
+
+    __slots__ = ("data", "start", "end", "display_text")
+
+    def __init__(self, data: dict | None, start: int, end: int, display_text: str):
+        self.data = data
+        self.start = start
+        self.end = end
+        self.display_text = display_text
+
+    def __repr__(self):
+        return f"JsonBlock(start={self.start}, end={self.end}, data={self.data!r})"
+
+
+class JsonBlockScanner:
+    def __init__(self):
+        self._chunks = []
+        self._text = ""
+        self._length = 0
+        self._depth = 0
+        self._in_string = False
+        self._skip_until = 0  # エスケープされた次の1文字
+        self._start = None
+        self.spans = []  # トップレベルの {...}（end は含まない）
+
+    @property
+    def text(self) -> str:
+        if self._chunks:
+            self._text += "".join(self._chunks)
+            self._chunks = []
+        return self._text
+
+    @property
+    def open_start(self) -> int | None:
+        """閉じていないトップレベルの { の位置（無ければ None）"""
+        return self._start
+
+    def feed(self, chunk: str) -> "JsonBlockScanner":
+        if not chunk:
+            return self
+        offset = self._length
+        for match in _SPECIAL.finditer(chunk):
+            pos = offset + match.start()
+            if pos < self._skip_until:
+                continue
+            ch = match.group()
+            if self._in_string:
+                if ch == "\\":
+                    self._skip_until = pos + 2
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = pos
+                self._depth += 1
+            elif self._depth == 0:
+                # トップレベル外の } や " は本文として無視
+                continue
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.spans.append((self._start, pos + 1))
+                    self._start = None
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        return self
+
+    def _with_fence(self, text: str, start: int, end: int) -> tuple[int, int]:
+        before = _FENCE_OPEN.search(text, 0, start)
+        after = _FENCE_CLOSE.match(text[end:])
+        if before and after:
+            return before.start(), end + after.end()
+        return start, end
+
+    def result(self) -> JsonBlock | None:
+        """
+        最後にパースできた {...} を返す。表示用テキストからはその {...}（どれもパースできなければ
+        最後のトップレベルの {...}）とフェンスを除く。{...} が1つも無ければ None。
+        """
+        if not self.spans:
+            return None
+        text = self.text
+        data = None
+        for start, end in reversed(self.spans):
+            try:
+                parsed = json.loads(text[start:end])
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict):
+                data = parsed
+                break
+        else:
+            start, end = self.spans[-1]
+        start, end = self._with_fence(text, start, end)
+        return JsonBlock(data, start, end, (text[:start] + text[end:]).strip())
+
+
+# 同じリクエスト内では同じテキストを1回だけ走査する（感情抽出・記憶保存・表示用の除去はすべてここを通る）
+@request_memoized("json.block")
+def find_json_block(text: str) -> JsonBlock | None:
+    return JsonBlockScanner().feed(text or "").result()
+
+
+def strip_json_block(text: str) -> str:
+    block = find_json_block(text)
+    return block.display_text if block is not None else (text or "").strip()
@@ -0,0 +1,199 @@
+# module/utils/log_sink.py
+import os
+import atexit
+import threading
+import time
+from collections import deque
+
+# ログ書き込みはリクエストスレッドから切り離し、専用ライタースレッドが insert_many でまとめて保存する。
+# Log writes are decoupled from the request thread; a dedicated writer flushes them with insert_many.
+
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", "5000"))          # キュー上限（件）
+LOG_FLUSH_BATCH_SIZE = int(os.getenv("LOG_FLUSH_BATCH_SIZE", "200"))      # 1回の insert_many の最大件数
+LOG_FLUSH_INTERVAL_SEC = float(os.getenv("LOG_FLUSH_INTERVAL_SEC", "2.0"))  # 件数に達しなくても書き出す間隔
+LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "drop_oldest")     # drop_oldest / drop_debug / block
+LOG_BLOCK_TIMEOUT_SEC = float(os.getenv("LOG_BLOCK_TIMEOUT_SEC", "1.0"))  # block 時の最大待ち時間
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_debug", "block")
+
+
+class MongoLogSink:
+    """
+    上限付きメモリキュー＋バックグラウンドライター。
+    - put() はキューに積むだけ（ネットワーク往復なし）
+    - ライターは件数（batch_size）または時間（flush_interval）で insert_many
+    - キューが満杯のときは overflow_policy に従って破棄／待機
+    """
+
+    def __init__(
+        self,
+        maxsize: int = LOG_QUEUE_MAXSIZE,
+        batch_size: int = LOG_FLUSH_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL_SEC,
+        overflow_policy: str = LOG_OVERFLOW_POLICY,
+        block_timeout: float = LOG_BLOCK_TIMEOUT_SEC,
+        collection_getter=None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            print(f"[WARN] 未知のLOG_OVERFLOW_POLICY: {overflow_policy} → drop_oldest を使用")
+            overflow_policy = "drop_oldest"
+
+        self.maxsize = max(1, maxsize)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self._collection_getter = collection_getter or _default_collection_getter
+
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._stopped = False
+        self._inflight = 0
+        self._writer = None
+
+        # 統計
+        self.stats = {"enqueued": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+    # ライタースレッド起動（初回 put 時に遅延起動）
+    def start(self):
+        with self._cond:
+            if self._writer is not None and self._writer.is_alive():
+                return
+            self._stopped = False
+            self._writer = threading.Thread(target=self._run, name="mongo-log-sink", daemon=True)
+            self._writer.start()
+
+    def put(self, entry: dict) -> bool:
+        if self._writer is None:
+            self.start()
+
+        with self._cond:
+            if self._stopped:
+                return False
+
+            if len(self._buffer) >= self.maxsize and not self._make_room(entry):
+                self.stats["dropped"] += 1
+                return False
+
+            self._buffer.append(entry)
+            self.stats["enqueued"] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    # 満杯時の処理。呼び出し元は self._cond を保持していること
+    def _make_room(self, entry: dict) -> bool:
+        if self.overflow_policy == "block":
+            deadline = time.monotonic() + self.block_timeout
+            self._cond.notify_all()
+            while len(self._buffer) >= self.maxsize and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self._stopped
+
+        if self.overflow_policy == "drop_debug":
+            # DEBUG を優先して捨てる。入ってきたのが DEBUG ならそれ自体を捨てる
+            if entry.get("level") == "DEBUG":
+                return False
+            for i, queued in enumerate(self._buffer):
+                if queued.get("level") == "DEBUG":
+                    del self._buffer[i]
+                    self.stats["dropped"] += 1
+                    return True
+
+        # drop_oldest（drop_debug で DEBUG が無い場合もここ）
+        self._buffer.popleft()
+        self.stats["dropped"] += 1
+        return True
+
+    def _take_batch(self) -> list[dict]:
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer and not self._stopped:
+                    self._cond.wait(self.flush_interval)
+                elif len(self._buffer) < self.batch_size and not self._flush_requested and not self._stopped:
+                    self._cond.wait(self.flush_interval)
+                batch = self._take_batch()
+                self._inflight = len(batch)
+                stopping = self._stopped
+                if not self._buffer:
+                    self._flush_requested = False
+                # block ポリシーで待っている put を起こす
+                self._cond.notify_all()
+
+            if batch:
+                self._write(batch)
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+            if stopping:
+                with self._cond:
+                    if not self._buffer:
+                        return
+
+    def _write(self, batch: list[dict]):
+        try:
+            collection = self._collection_getter()
+            if collection is None:
+                self.stats["write_errors"] += 1
+                print(f"[ERROR] MongoDBログ記録失敗: クライアント未取得（{len(batch)} 件破棄）")
+                return
+            collection.insert_many(batch, ordered=False)
+            self.stats["written"] += len(batch)
+        except Exception as e:
+            self.stats["write_errors"] += 1
+            print(f"[ERROR] MongoDBログ記録失敗: {e}（{len(batch)} 件）")
+
+    # 溜まっているログを即時書き出す（ライターに依頼して完了を待つ）
+    def flush(self, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._buffer or self._inflight) and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+
+    # シャットダウン時：残りを書き出してライターを停止
+    def shutdown(self, timeout: float = 5.0):
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify_all()
+        if self._writer is not None:
+            self._writer.join(timeout)
+
+
+def _default_collection_getter():
+    from module.mongo.mongo_client import get_collection  # ← 遅延importで安全
+    return get_collection("app_log")
+
+
+_log_sink = None
+_log_sink_lock = threading.Lock()
+
+
+def get_log_sink() -> MongoLogSink:
+    global _log_sink
+    if _log_sink is None:
+        with _log_sink_lock:
+            if _log_sink is None:
+                _log_sink = MongoLogSink()
+                atexit.register(shutdown_log_sink)
+    return _log_sink
+
+
+# アプリ終了時に呼ぶ（FastAPI shutdown / atexit）
+def shutdown_log_sink(timeout: float = 5.0):
+    if _log_sink is not None:
+        _log_sink.shutdown(timeout)
@@ -0,0 +1,252 @@
+# module/utils/metrics.py
+import os
+import time
+import threading
+import functools
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+# プロセス内のレイテンシ計測（ヒストグラム／カウンタ）と Prometheus テキスト形式の出力。
+# In-process latency histograms / counters, rendered in Prometheus text format for /metrics.
+
+# レスポンスヘッダにステージ別の所要時間を付けるか（リクエストヘッダ X-Debug-Timing: 1 でも有効化）
+CHAT_TIMING_HEADERS = os.getenv("CHAT_TIMING_HEADERS", "0") == "1"
+
+# 秒単位のバケット（LLM呼び出しの数十秒まで）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: dict | None = None) -> str:
+    pairs = [f'{k}="{_escape_label_value(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs += [f'{k}="{_escape_label_value(v)}"' for k, v in extra.items()]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket_counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(float(bound))})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+# =========================
+# レジストリ
+# =========================
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = Counter(name, documentation, labelnames)
+            _registry[name] = metric
+        return metric
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = Histogram(name, documentation, labelnames, buckets)
+            _registry[name] = metric
+        return metric
+
+
+def render_prometheus() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram(
+    "yumia_stage_duration_seconds", "Latency of pipeline stages", ("stage",)
+)
+STAGE_ERRORS = counter(
+    "yumia_stage_errors_total", "Exceptions raised inside pipeline stages", ("stage",)
+)
+MONGO_COMMAND_SECONDS = histogram(
+    "yumia_mongo_command_duration_seconds", "Latency of MongoDB commands", ("command", "status")
+)
+CHAT_REQUESTS = counter(
+    "yumia_chat_requests_total", "Handled /chat requests", ("status",)
+)
+
+
+# =========================
+# リクエスト単位の内訳
+# =========================
+
+# {stage: [合計秒, 回数]}。リクエスト外（バックグラウンド等）では None
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+def start_request_timing():
+    """現在のコンテキストで内訳の記録を開始する。戻り値は end_request_timing に渡す"""
+    return _request_timings.set({})
+
+
+def end_request_timing(token) -> dict:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def _record_request_timing(stage: str, elapsed: float):
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    entry = timings.get(stage)
+    if entry is None:
+        timings[stage] = [elapsed, 1]
+    else:
+        entry[0] += elapsed
+        entry[1] += 1
+
+
+@contextmanager
+def span(stage: str):
+    """with span("stage"): ... で所要時間をヒストグラムとリクエスト内訳に記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        _record_request_timing(stage, elapsed)
+
+
+def timed(stage: str):
+    """関数全体を span で囲むデコレータ（async 関数にも対応）"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Server-Timing ヘッダ形式に整形（ブラウザの DevTools でそのまま表示される）
+def format_server_timing(timings: dict) -> str:
+    parts = []
+    for stage, (elapsed, count) in timings.items():
+        name = stage.replace(" ", "_")
+        parts.append(f'{name};dur={elapsed * 1000:.1f};desc="x{count}"')
+    return ", ".join(parts)
+
+
+# =========================
+# MongoDB コマンド監視
+# =========================
+
+class MongoCommandMetricsListener(monitoring.CommandListener):
+    """
+    pymongo の全コマンドの所要時間を記録する（find / insert / aggregate ...）。
+    on_success / on_failure を渡せば各イベントでも呼ぶ（接続マネージャーのブレーカー用）
+    """
+
+    def __init__(self, on_success=None, on_failure=None):
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        elapsed = event.duration_micros / 1_000_000
+        MONGO_COMMAND_SECONDS.observe(elapsed, command=event.command_name, status="ok")
+        _record_request_timing(f"mongo.{event.command_name}", elapsed)
+        if self.on_success is not None:
+            self.on_success(event)
+
+    def failed(self, event):
+        elapsed = event.duration_micros / 1_000_000
+        MONGO_COMMAND_SECONDS.observe(elapsed, command=event.command_name, status="error")
+        _record_request_timing(f"mongo.{event.command_name}", elapsed)
+        if self.on_failure is not None:
+            self.on_failure(event)
@@ -0,0 +1,146 @@
+# module/utils/request_context.py
+import copy
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from module.utils.metrics import counter
+
+# 1回の /chat の中で同じ読み込み・パースを何度も行わないための、リクエスト単位のメモ。
+# start_request_context() で開始し、@request_memoized を付けた関数の結果をそのリクエストの間だけ保持する。
+# リクエスト外（バックグラウンド処理や CLI）ではメモせず、毎回そのまま呼ぶ。
+# Request-scoped memoization: each decorated read / parse runs at most once per /chat turn.
+
+REQUEST_MEMO = counter(
+    "yumia_request_memo_total", "Request-scoped memo lookups", ("name", "result")
+)
+
+_MISSING = object()
+
+
+class RequestContext:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def lookup(self, name: str, key):
+        with self._lock:
+            value = self._values.get((name, key), _MISSING)
+            counts = self.misses if value is _MISSING else self.hits
+            counts[name] = counts.get(name, 0) + 1
+        REQUEST_MEMO.inc(name=name, result="miss" if value is _MISSING else "hit")
+        return value
+
+    def store(self, name: str, key, value):
+        with self._lock:
+            self._values[(name, key)] = value
+
+    def invalidate(self, name: str, key=_MISSING):
+        """key 省略時は name の全エントリを捨てる"""
+        with self._lock:
+            if key is not _MISSING:
+                self._values.pop((name, key), None)
+            else:
+                for entry in [k for k in self._values if k[0] == name]:
+                    del self._values[entry]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "by_name": {
+                    name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0)}
+                    for name in sorted(set(self.hits) | set(self.misses))
+                }
+            }
+
+
+# リクエスト外では None
+_current: ContextVar[RequestContext | None] = ContextVar("request_context", default=None)
+
+
+def start_request_context():
+    """現在のコンテキストでメモを開始する。戻り値は end_request_context に渡す"""
+    return _current.set(RequestContext())
+
+
+def end_request_context(token) -> dict:
+    context = _current.get()
+    _current.reset(token)
+    return context.stats() if context is not None else {}
+
+
+def current_request_context() -> RequestContext | None:
+    return _current.get()
+
+
+@contextmanager
+def bind_request_context(context: RequestContext | None):
+    """バックグラウンドタスクなど別のコンテキストで、同じリクエストのメモを使う"""
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def remember(name: str, value, key=()):
+    """書き込み側から最新値を入れておく（同じリクエスト内の後続の読み込みがDBに行かないように）"""
+    context = _current.get()
+    if context is not None:
+        context.store(name, key, copy.deepcopy(value))
+
+
+def forget(name: str, key=_MISSING):
+    context = _current.get()
+    if context is not None:
+        context.invalidate(name, key)
+
+
+def _default_key(args, kwargs):
+    return args + tuple(sorted(kwargs.items()))
+
+
+def request_memoized(name: str, key=None):
+    """
+    関数の結果をリクエスト単位でメモするデコレータ（async 関数にも対応）。
+    同期版と非同期版で同じ name を使えば結果を共有する。
+    呼び出し側が戻り値を書き換えてもメモが汚れないよう、保存時と取り出し時に deepcopy する。
+    """
+    make_key = key or (lambda *args, **kwargs: _default_key(args, kwargs))
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                context = _current.get()
+                if context is None:
+                    return await func(*args, **kwargs)
+                memo_key = make_key(*args, **kwargs)
+                value = context.lookup(name, memo_key)
+                if value is _MISSING:
+                    value = await func(*args, **kwargs)
+                    context.store(name, memo_key, copy.deepcopy(value))
+                    return value
+                return copy.deepcopy(value)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            context = _current.get()
+            if context is None:
+                return func(*args, **kwargs)
+            memo_key = make_key(*args, **kwargs)
+            value = context.lookup(name, memo_key)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                context.store(name, memo_key, copy.deepcopy(value))
+                return value
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+# module/utils/single_flight.py
+import os
+import copy
+import asyncio
+import inspect
+import functools
+import threading
+
+from module.utils.metrics import counter
+
+# 同じキーの処理が同時に複数走らないようにする（single-flight）。
+# 最初の呼び出し（leader）だけが実際に処理し、処理中に来た同じキーの呼び出しはその結果を待って受け取る。
+# 複数タブからの同じ発言や再送、キャッシュの同時ミスで OpenAI や emotion_index の全件読込を重ねて呼ばないためのもの。
+# 完了したら結果は保持しない（キャッシュではない）。
+# Single-flight: concurrent callers with the same key share one in-flight computation.
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+
+SINGLE_FLIGHT_CALLS = counter(
+    "yumia_single_flight_total", "Single-flight calls that ran (leader) or joined an in-flight call (shared)", ("name", "role")
+)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    do(key, func, ...)       : スレッド用。処理中の同じキーがあれば完了を待つ
+    do_async(key, func, ...) : async 用（func はコルーチン関数）。イベントループごとに束ねる
+    copy_result=True なら、leader を含む全員に結果の deepcopy を渡す（呼び出し側が結果を書き換える場合）。
+    共有する元の結果はどの呼び出し元にも渡さないので、先に戻った側の書き換えが後の側に漏れない。
+    例外も待っていた全員に同じものが送出される。
+    """
+
+    def __init__(self, name: str, copy_result: bool = False, enabled: bool | None = None):
+        self.name = name
+        self.copy_result = copy_result
+        self.enabled = SINGLE_FLIGHT_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self._tasks = {}  # (id(loop), key) -> [task, 待っている数]
+
+    def _shared(self, result):
+        return copy.deepcopy(result) if self.copy_result else result
+
+    def do(self, key, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(name=self.name, role="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self._shared(call.result)
+
+        SINGLE_FLIGHT_CALLS.inc(name=self.name, role="leader")
+        try:
+            call.result = func(*args, **kwargs)
+            return self._shared(call.result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        if not self.enabled:
+            return await func(*args, **kwargs)
+        flight_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            entry = self._tasks.get(flight_key)
+            leader = entry is None
+            if leader:
+                # タスクにしておけば、最初の呼び出し元がキャンセルされても待っている側の処理は続く
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                entry = self._tasks[flight_key] = [task, 0]
+                task.add_done_callback(lambda _t: self._forget_task(flight_key, task))
+            entry[1] += 1
+            task = entry[0]
+
+        SINGLE_FLIGHT_CALLS.inc(name=self.name, role="leader" if leader else "shared")
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 待っている呼び出しが全員いなくなったら、処理自体も取り消す
+            with self._lock:
+                entry[1] -= 1
+                abandoned = entry[1] == 0
+                if abandoned and self._tasks.get(flight_key) is entry:
+                    del self._tasks[flight_key]
+            if abandoned:
+                task.cancel()
+            raise
+        return self._shared(result)
+
+    def _forget_task(self, flight_key, task):
+        with self._lock:
+            entry = self._tasks.get(flight_key)
+            if entry is not None and entry[0] is task:
+                del self._tasks[flight_key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._tasks)
+
+
+def _default_key(args, kwargs):
+    return args + tuple(sorted(kwargs.items()))
+
+
+def single_flight(name: str, key=None, copy_result: bool = False):
+    """
+    同じ引数での同時呼び出しを1回の実行にまとめるデコレータ（async 関数にも対応）。
+    key には引数からハッシュ可能なキーを作る関数を渡す（省略時は引数そのもの）。
+    同期版と非同期版は別々に束ねる（スレッドとイベントループでは待ち方が違うため）。
+    """
+    make_key = key or (lambda *args, **kwargs: _default_key(args, kwargs))
+    flight = SingleFlight(name, copy_result=copy_result)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await flight.do_async(make_key(*args, **kwargs), func, *args, **kwargs)
+            async_wrapper.flight = flight
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return flight.do(make_key(*args, **kwargs), func, *args, **kwargs)
+        wrapper.flight = flight
+        return wrapper
+    return decorator
@@ -23,27 +23,22 @@ LEVEL_ORDER = {
 import traceback  # ← 必須
 
 # ✅ log_to_mongo を最初に定義
+# Mongoへの書き込みは log_sink のバックグラウンドライターに任せ、ここではキューに積むだけ
 def log_to_mongo(level: str, message: str):
-    print(f"[CALL] log_to_mongo: {level} - {message}")
     try:
-        from module.mongo.mongo_client import get_mongo_client  # ← 遅延importで安全
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            collection = db["app_log"]
-            log_entry = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "level": level,
-                "message": message
-            }
-            collection.insert_one(log_entry)
+        from module.utils.log_sink import get_log_sink  # ← 遅延importで安全
+        log_entry = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "level": level,
+            "message": message
+        }
+        get_log_sink().put(log_entry)
     except Exception as e:
         print(f"[ERROR] MongoDBログ記録失敗: {e}")
 
 # ✅ logger定義（errorだけtraceback対応）
 class MongoLogger:
     def log(self, level: str, message: str):
-        print(f"[LOG WRAPPER] 呼び出しレベル: {level} / 閾値: {LOG_LEVEL_THRESHOLD}")
         if LEVEL_ORDER[level] >= LEVEL_ORDER[LOG_LEVEL_THRESHOLD]:
             log_to_mongo(level, message)
 
@@ -63,34 +58,18 @@ logger = MongoLogger()
 print(f"📌 [CHECK] logger の型: {type(logger)}")
 
 # 🔽 logger初期化後にMongo依存インポート
-from module.mongo.mongo_client import get_mongo_client
+from module.mongo.mongo_client import get_collection
+from module.mongo.async_mongo_client import get_async_collection
+from module.utils.metrics import timed
 
 
-# MongoDBにログを保存
-def log_to_mongo(level: str, message: str):
-    print(f"[CALL] log_to_mongo: {level} - {message}")
-    try:
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            collection = db["app_log"]
-            log_entry = {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "level": level,
-                "message": message
-            }
-            collection.insert_one(log_entry)
-    except Exception as e:
-        print(f"[ERROR] MongoDBログ記録失敗: {e}")
-
 # 履歴を取得
+@timed("db.load_history")
 def load_history(limit: int = 100) -> list[dict]:
-    client = get_mongo_client()
-    if client is None:
+    collection = get_collection("dialogue_history")
+    if collection is None:
         raise ConnectionError("MongoDBクライアントの取得に失敗しました")
 
-    db = client["emotion_db"]
-    collection = db["dialogue_history"]
     cursor = collection.find().sort("timestamp", DESCENDING).limit(limit)
 
     history = []
@@ -102,32 +81,59 @@ def load_history(limit: int = 100) -> list[dict]:
         })
     return history
 
+# 履歴を取得（非同期版：イベントループをブロックしない）
+@timed("db.load_history")
+async def load_history_async(limit: int = 100) -> list[dict]:
+    collection = get_async_collection("dialogue_history")
+    if collection is None:
+        raise ConnectionError("MongoDBクライアントの取得に失敗しました")
+
+    cursor = collection.find().sort("timestamp", DESCENDING).limit(limit)
+
+    history = []
+    async for doc in cursor:
+        history.append({
+            "timestamp": doc.get("timestamp"),
+            "role": doc.get("role"),
+            "message": doc.get("message")
+        })
+    return history
+
 # プロンプトフォルダのパスを定義
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROMPT_DIR = os.path.join(BASE_DIR, "..", "..", "prompt")
 
+# プロンプトファイルのキャッシュ：{ファイル名: ((mtime_ns, size), 内容)}
+# 毎回 stat だけして、更新されていれば読み直す（再起動なしでプロンプトを差し替えられる）
+# 変わっていなければ同じ文字列オブジェクトを返すので、組み立て後のプレフィックスもバイト単位で安定する
+_prompt_file_cache = {}
+
+def load_prompt_file(file_name: str) -> str:
+    prompt_path = os.path.join(PROMPT_DIR, file_name)
+    stat = os.stat(prompt_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _prompt_file_cache.get(file_name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    _prompt_file_cache[file_name] = (version, text)
+    if cached is not None:
+        logger.info(f"🔄 プロンプトを再読み込みしました: {file_name}")
+    return text
+
 # プロンプト読み込み関数
 def load_emotion_prompt():
-    prompt_path = os.path.join(PROMPT_DIR, "emotion_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        return f.read().strip()
+    return load_prompt_file("emotion_prompt.txt")
 
 def load_dialogue_prompt():
-    prompt_path = os.path.join(PROMPT_DIR, "dialogue_prompt.txt")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        return f.read().strip()
-
-_cached_system_prompt = None
+    return load_prompt_file("dialogue_prompt.txt")
 
 def load_system_prompt_cached():
-    global _cached_system_prompt
-    if _cached_system_prompt is None:
-        prompt_path = os.path.join(PROMPT_DIR, "system_prompt.txt")
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            _cached_system_prompt = f.read().strip()
-    return _cached_system_prompt
+    return load_prompt_file("system_prompt.txt")
 
 # 会話履歴保存
+@timed("db.append_history")
 def append_history(role, message):
     try:
         entry = {
@@ -135,15 +141,29 @@ def append_history(role, message):
             "role": role,
             "message": message
         }
-        client = get_mongo_client()
-        if client:
-            db = client["emotion_db"]
-            collection = db["dialogue_history"]
+        collection = get_collection("dialogue_history")
+        if collection is not None:
             collection.insert_one(entry)
             logger.info(f"[INFO] 履歴をMongoDBに保存: {entry}")
     except Exception as e:
         logger.error(f"[ERROR] 履歴保存に失敗: {e}")
 
+# 会話履歴保存（非同期版）
+@timed("db.append_history")
+async def append_history_async(role, message):
+    try:
+        entry = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "role": role,
+            "message": message
+        }
+        collection = get_async_collection("dialogue_history")
+        if collection is not None:
+            await collection.insert_one(entry)
+            logger.info(f"[INFO] 履歴をMongoDBに保存: {entry}")
+    except Exception as e:
+        logger.error(f"[ERROR] 履歴保存に失敗: {e}")
+
 # テスト用出力
 if __name__ == "__main__":
     print("=== Logger Test Start ===", flush=True)
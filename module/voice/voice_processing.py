@@ -1,6 +1,7 @@
 # module/voice/voice_processing.py
 
 import requests
+import httpx
 from module.utils.utils import logger
 from module.params import (
     voicevox_emotion_map,   # 32感情 → VoiceVoxパラメータ（英語キー）
@@ -134,4 +135,53 @@ def synthesize_voice(text: str, settings: dict, base_url: str = "http://localhos
 
     except Exception as e:
         logger.error(f"[VoiceVox] 音声生成失敗: {e}")
-        return b""
\ No newline at end of file
+        return b""
+
+# =========================
+# 非同期版（/chat のイベントループから呼ぶ）
+# =========================
+
+VOICEVOX_QUERY_TIMEOUT_SEC = 10
+VOICEVOX_SYNTH_TIMEOUT_SEC = 20
+
+_async_http_client = None
+
+# 接続プールを使い回すため AsyncClient はプロセスで1つ
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(timeout=VOICEVOX_SYNTH_TIMEOUT_SEC)
+    return _async_http_client
+
+async def close_async_http_client():
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+    _async_http_client = None
+
+async def synthesize_voice_async(text: str, settings: dict, base_url: str = "http://localhost:50021") -> bytes:
+    try:
+        http = get_async_http_client()
+        query_resp = await http.post(
+            f"{base_url}/audio_query",
+            params={"text": text, "speaker": settings["speaker"]},
+            timeout=VOICEVOX_QUERY_TIMEOUT_SEC
+        )
+        query_resp.raise_for_status()
+        audio_query = query_resp.json()
+
+        for key in ["pitchScale", "speedScale", "intonationScale", "volumeScale", "prePhonemeLength", "postPhonemeLength"]:
+            audio_query[key] = settings[key]
+
+        synth_resp = await http.post(
+            f"{base_url}/synthesis",
+            params={"speaker": settings["speaker"]},
+            json=audio_query,
+            timeout=VOICEVOX_SYNTH_TIMEOUT_SEC
+        )
+        synth_resp.raise_for_status()
+        return synth_resp.content
+
+    except Exception as e:
+        logger.error(f"[VoiceVox] 音声生成失敗: {e}")
+        return b""
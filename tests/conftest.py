@@ -0,0 +1,265 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# テスト共通のフェイク（MongoDB のコレクション・データベース、単調時計）。
+# コレクションはテストで使う操作だけを、メモリ上のドキュメントのリストで再現する。
+# AsyncFakeCollection は同じドキュメントを AsyncMongoClient と同じ await の形で見せる。
+
+
+class FakeClock:
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _resolve(value, path: list) -> list:
+    """ドット区切りのパスの値（配列はたどって展開する）"""
+    if not path:
+        return value if isinstance(value, list) else [value]
+    if isinstance(value, list):
+        return [v for item in value for v in _resolve(item, path)]
+    if isinstance(value, dict) and path[0] in value:
+        return _resolve(value[path[0]], path[1:])
+    return []
+
+
+def _matches(doc: dict, query: dict | None) -> bool:
+    for field, condition in (query or {}).items():
+        values = _resolve(doc, field.split("."))
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$in" and not any(v in operand for v in values):
+                    return False
+                if op == "$lt" and not any(v < operand for v in values):
+                    return False
+        elif condition not in values:
+            return False
+    return True
+
+
+def _set_path(doc: dict, field: str, value):
+    *parents, last = field.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _get_path(doc: dict, field: str, default=None):
+    for part in field.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def _apply_update(doc: dict, update: dict):
+    for field, value in update.get("$set", {}).items():
+        _set_path(doc, field, value)
+    for field, delta in update.get("$inc", {}).items():
+        _set_path(doc, field, _get_path(doc, field, 0) + delta)
+
+
+class FakeCollection:
+    def __init__(self, docs: list | None = None, rows: list | None = None):
+        self.docs = list(docs or [])
+        self.rows = rows        # aggregate の結果（None なら docs に先頭の $match だけ適用したもの）
+        self.batches = []       # insert_many ごとの件数確認用
+        self.calls = []         # find の (query, projection)
+        self.finds = 0          # find_one の呼び出し回数
+        self.aggregations = 0
+        self.pipelines = []     # aggregate に渡されたパイプライン
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.lock = threading.Lock()
+
+    def get(self, _id):
+        return next((doc for doc in self.docs if doc.get("_id") == _id), None)
+
+    # 書き込み
+
+    def insert_one(self, document: dict):
+        with self.lock:
+            document.setdefault("_id", len(self.docs) + 1)
+            self.docs.append(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=True):
+        with self.lock:
+            self.batches.append(list(documents))
+            self.docs.extend(self.batches[-1])
+
+    def _upsert(self, query: dict) -> dict:
+        if self.get(query.get("_id")) is not None:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        self.docs.append(doc)
+        return doc
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(query)
+        _apply_update(doc, update)
+        return dict(doc)
+
+    def update_one(self, query, update, upsert=False):
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        matched = doc is not None
+        if doc is None and upsert:
+            doc = self._upsert(query)
+        if doc is not None:
+            _apply_update(doc, update)
+        return SimpleNamespace(matched_count=int(matched))
+
+    def replace_one(self, query, document, upsert=False):
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is not None:
+            self.docs.remove(doc)
+        if doc is not None or upsert:
+            self.docs.append({**document, "_id": query.get("_id")})
+
+    def delete_many(self, query):
+        kept = [d for d in self.docs if not _matches(d, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    # 読み出し
+
+    def find_one(self, query=None, sort=None):
+        self.finds += 1
+        docs = [d for d in self.docs if _matches(d, query)]
+        for field, direction in reversed(sort or []):
+            docs.sort(key=lambda d: _get_path(d, field), reverse=direction < 0)
+        return docs[0] if docs else None
+
+    def find(self, query=None, projection=None):
+        self.calls.append((query, projection))
+        for doc in self.docs:
+            if _matches(doc, query):
+                yield _project(doc, query or {}, projection)
+
+    def aggregate(self, pipeline):
+        self.aggregations += 1
+        self.pipelines.append(pipeline)
+        if self.rows is not None:
+            return iter(self.rows)
+        query = pipeline[0].get("$match") if pipeline else None
+        return iter([doc for doc in self.docs if _matches(doc, query)])
+
+    # インデックス
+
+    def index_information(self):
+        return dict(self.indexes)
+
+    def create_index(self, keys, name, **options):
+        if name in self.indexes:
+            raise OperationFailure("index with same name already exists")
+        self.indexes[name] = {"key": list(keys), **options}
+        return name
+
+
+def _project(doc: dict, query: dict, projection: dict | None) -> dict:
+    """包含指定と位置指定（"a.b.$"：クエリに一致した最初の要素だけ）の射影"""
+    if not projection:
+        return doc
+    result = {} if projection.get("_id", 1) == 0 else {"_id": doc.get("_id")}
+    for field, include in projection.items():
+        if field == "_id" or not include:
+            continue
+        if field.endswith(".$"):
+            array_field = field[:-2]
+            condition = {k[len(array_field) + 1:]: v for k, v in query.items() if k.startswith(array_field + ".")}
+            matched = [item for item in _get_path(doc, array_field, []) if _matches(item, condition)]
+            _set_path(result, array_field, matched[:1])
+        elif _get_path(doc, field) is not None:
+            _set_path(result, field, _get_path(doc, field))
+    return result
+
+
+class FakeCursor:
+    """AsyncCursor / AsyncCommandCursor 相当（sort / limit / to_list / async for）"""
+
+    def __init__(self, docs):
+        self.docs = list(docs)
+
+    def sort(self, field, direction=1):
+        self.docs.sort(key=lambda d: _get_path(d, field), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs if length is None else self.docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class AsyncFakeCollection:
+    """FakeCollection を包んだ非同期版。sync に同期側のフェイクがあるので、書き込み結果はそちらで確認する"""
+
+    def __init__(self, docs: list | None = None, rows: list | None = None, sync: FakeCollection | None = None):
+        self.sync = sync or FakeCollection(docs, rows)
+
+    @property
+    def docs(self):
+        return self.sync.docs
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self.sync.find(query, projection))
+
+    async def aggregate(self, pipeline):
+        return FakeCursor(self.sync.aggregate(pipeline))
+
+    def __getattr__(self, name):
+        # 書き込み・find_one などはそのまま await できる形にする（記録用の属性は同期側のものを返す）
+        attribute = getattr(self.sync, name)
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return attribute(*args, **kwargs)
+        return call
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fake_collection():
+    """FakeCollection を作るファクトリ"""
+    return FakeCollection
+
+
+@pytest.fixture
+def async_fake_collection():
+    """AsyncFakeCollection を作るファクトリ"""
+    return AsyncFakeCollection
+
+
+@pytest.fixture
+def fake_database():
+    return FakeDatabase()
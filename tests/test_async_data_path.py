@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+
+import module.emotion.emotion_state_store as store_module
+import module.emotion.emotion_stats as stats
+import module.emotion.index_emotion as index_emotion
+import module.emotion.main_emotion as main_emotion
+import module.emotion.personality_profile as profile
+import module.response.memory_lookup as memory_lookup
+import module.response.response_short as response_short
+import module.utils.utils as utils
+from module.emotion.emotion_state_store import EmotionStateStore
+from module.params import emotion_map
+from module.response.memory_record_cache import MemoryRecordCache
+from module.utils.request_context import end_request_context, start_request_context
+
+# /chat の非同期データ経路（AsyncMongoClient 側の *_async 関数）を、同期版と同じ結果になるか確かめる
+
+
+class RecordingIndexCache:
+    def __init__(self):
+        self.added = []
+
+    def add(self, doc):
+        self.added.append(doc)
+
+
+@pytest.fixture
+def async_db(monkeypatch, async_fake_collection):
+    collections = {}
+
+    def get_async_collection(name):
+        return collections.setdefault(name, async_fake_collection())
+
+    for module in (utils, stats, store_module, main_emotion, index_emotion, profile, memory_lookup, response_short):
+        monkeypatch.setattr(module, "get_async_collection", get_async_collection)
+    cache = MemoryRecordCache(maxsize=16, ttl=60, negative_ttl=60)
+    monkeypatch.setattr(memory_lookup, "get_memory_record_cache", lambda: cache)
+    monkeypatch.setattr(main_emotion, "get_memory_record_cache", lambda: cache)
+    return get_async_collection
+
+
+def test_history_append_and_load_newest_first(async_db):
+    asyncio.run(utils.append_history_async("user", "こんにちは"))
+    history = async_db("dialogue_history")
+    assert [d["message"] for d in history.docs] == ["こんにちは"]
+
+    history.docs[:] = [
+        {"timestamp": f"2026-01-01 00:00:0{i}", "role": "user", "message": f"m{i}"} for i in range(3)
+    ]
+    loaded = asyncio.run(utils.load_history_async(limit=2))
+    assert [h["message"] for h in loaded] == ["m2", "m1"]
+    assert set(loaded[0]) == {"timestamp", "role", "message"}
+
+
+def test_load_history_without_client_raises(monkeypatch):
+    monkeypatch.setattr(utils, "get_async_collection", lambda name: None)
+    with pytest.raises(ConnectionError):
+        asyncio.run(utils.load_history_async())
+
+
+def test_current_emotion_round_trip_through_state_store(async_db, monkeypatch, clock):
+    monkeypatch.setattr(stats, "EMOTION_STATE_STORE_ENABLED", True)
+    store = EmotionStateStore(clock=clock)
+    monkeypatch.setattr(stats, "get_emotion_state_store", lambda: store)
+
+    async def turn():
+        token = start_request_context()
+        try:
+            await stats.save_current_emotion_async({"喜び": 40.0})
+            return await stats.load_current_emotion_async()
+        finally:
+            end_request_context(token)
+
+    assert asyncio.run(turn()) == {"喜び": 40.0}
+    assert async_db("current_emotion_state").sync.get("current")["version"] == 1
+
+    # 別プロセス相当（メモリ上の状態なし）でもドキュメントから読める
+    monkeypatch.setattr(stats, "get_emotion_state_store", lambda: EmotionStateStore(clock=clock))
+    assert asyncio.run(stats.load_current_emotion_async()) == {"喜び": 40.0}
+
+
+def test_current_emotion_legacy_collection_reads_latest(async_db, monkeypatch):
+    monkeypatch.setattr(stats, "EMOTION_STATE_STORE_ENABLED", False)
+    async_db("current_emotion").docs.extend([
+        {"timestamp": "2026-01-01T00:00:00", "emotion_vector": {"喜び": 10.0}},
+        {"timestamp": "2026-01-02T00:00:00", "emotion_vector": {"悲しみ": 20.0}},
+    ])
+    assert asyncio.run(stats.load_current_emotion_async()) == {"悲しみ": 20.0}
+
+    asyncio.run(stats.save_current_emotion_async({"信頼": 30.0}))
+    assert async_db("current_emotion").docs[-1]["emotion_vector"] == {"信頼": 30.0}
+
+
+def test_write_structured_data_stores_document_index_and_profile(async_db, monkeypatch):
+    index_cache = RecordingIndexCache()
+    monkeypatch.setattr(index_emotion, "get_index_cache", lambda: index_cache)
+    monkeypatch.setattr(profile, "PERSONALITY_PROFILE_ENABLED", True)
+    monkeypatch.setattr(profile, "invalidate_personality_profile", lambda: None)
+    monkeypatch.setattr(profile, "_apply_local", lambda emotion_en, delta: None)
+    async_db("personality_profile").docs.append({"_id": profile.PROFILE_ID, "counts": {}})
+
+    emotion_en, emotion_ja = next(iter(emotion_map.items()))
+    data = {"date": "20260101000000", "主感情": emotion_ja, "重み": 97, "構成比": {emotion_ja: 100}, "keywords": ["仕事"]}
+    asyncio.run(main_emotion.write_structured_emotion_data_async(data))
+
+    stored = async_db("emotion_data").docs
+    assert [(d["emotion"], d["category"]) for d in stored] == [(emotion_en, "long")]
+    assert stored[0]["data"] == data
+
+    index_docs = async_db("emotion_index").docs
+    assert index_docs[0]["キーワード"] == ["仕事"] and index_docs[0]["構成比"][emotion_ja] == 100
+    assert index_cache.added == index_docs
+
+    # long は人格プロファイルにも加算される
+    assert async_db("personality_profile").sync.get(profile.PROFILE_ID)["counts"] == {emotion_en: 1}
+
+
+def test_write_structured_data_skips_unknown_emotion(async_db):
+    asyncio.run(main_emotion.write_structured_emotion_data_async({"date": "20260101000000", "主感情": "不明"}))
+    assert async_db("emotion_data").docs == []
+
+
+def _doc(category, emotion, dates):
+    return {
+        "category": category,
+        "emotion": emotion,
+        "data": {"履歴": [{"date": d, "状況": f"{category}-{d}"} for d in dates]}
+    }
+
+
+def test_find_history_records_async_matches_sync(async_db, monkeypatch):
+    docs = [
+        _doc("short", "Joy", ["20250101000000", "20250102000000"]),
+        _doc("long", "Joy", ["20250102000000"]),
+        _doc("long", "Anger", ["20250102000000"]),
+    ]
+    collection = async_db("emotion_data")
+    collection.docs.extend(docs)
+    monkeypatch.setattr(memory_lookup, "get_collection", lambda name: collection.sync)
+
+    found = asyncio.run(memory_lookup.find_history_records_async("Joy", "20250102000000"))
+    assert found["short"]["状況"] == "short-20250102000000"
+    assert found["intermediate"] is None
+    assert found["long"]["状況"] == "long-20250102000000"
+    assert len(collection.calls) == 1
+
+    memory_lookup.get_memory_record_cache().clear()
+    assert memory_lookup.find_history_records("Joy", "20250102000000") == found
+
+
+def test_category_data_async_filters_by_category(async_db):
+    async_db("emotion_data").docs.extend([_doc("short", "Joy", ["1"]), _doc("long", "Joy", ["2"])])
+    short = asyncio.run(response_short.get_all_short_category_data_async())
+    assert [d["category"] for d in short] == ["short"]
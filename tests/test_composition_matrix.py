@@ -0,0 +1,124 @@
+import random
+
+from module.params import emotion_map
+from module.response.composition_matrix import CompositionMatrix, best_match_index
+from module.response.response_index import (
+    find_best_match_by_composition,
+    find_best_match_by_composition_vectorized,
+)
+
+NAMES = list(emotion_map.values())
+
+
+def _random_composition(rng, full=True):
+    picked = rng.sample(NAMES, rng.randint(1, 4))
+    comp = {name: 0 for name in NAMES} if full else {}
+    for name in picked:
+        comp[name] = rng.choice([rng.randint(0, 100), rng.randint(0, 100) + 0.5])
+    return comp
+
+
+def _random_docs(rng, n):
+    return [
+        {"_id": f"d{i}", "emotion": "Joy", "構成比": _random_composition(rng, full=rng.random() < 0.7)}
+        for i in range(n)
+    ]
+
+
+def test_parity_with_scalar_implementation():
+    rng = random.Random(42)
+    for _ in range(50):
+        docs = _random_docs(rng, rng.randint(0, 200))
+        base = _random_composition(rng, full=False)
+        expected = find_best_match_by_composition(base, docs)
+        assert find_best_match_by_composition_vectorized(base, docs) is expected
+
+        keys = [d["_id"] for d in docs]
+        matrix = CompositionMatrix.from_docs(zip(keys, docs))
+        assert find_best_match_by_composition_vectorized(base, docs, matrix, keys) is expected
+
+
+def test_ties_pick_first_candidate():
+    comp = {NAMES[0]: 50, NAMES[1]: 30}
+    docs = [{"_id": "a", "構成比": dict(comp)}, {"_id": "b", "構成比": dict(comp)}]
+    assert best_match_index(comp, docs)[0] == 0
+
+
+def test_irregular_candidates_use_scalar_rules():
+    base = {NAMES[0]: 40, "未知の感情": 20}
+    docs = [
+        {"_id": "a", "構成比": {NAMES[0]: 45}},
+        {"_id": "b", "構成比": {NAMES[0]: 40, "未知の感情": 20}},
+        {"_id": "c", "構成比": "壊れたデータ"},
+    ]
+    expected = find_best_match_by_composition(base, docs)
+    assert expected is docs[1]
+    assert find_best_match_by_composition_vectorized(base, docs) is expected
+
+
+def test_matrix_incremental_updates():
+    rng = random.Random(7)
+    docs = _random_docs(rng, 50)
+    keys = [d["_id"] for d in docs]
+    matrix = CompositionMatrix.from_docs(zip(keys[:10], docs[:10]))
+    for key, doc in zip(keys[10:], docs[10:]):
+        matrix.add(key, doc)
+    for key in keys[:30]:
+        matrix.remove(key)
+    for key, doc in zip(keys[:30], docs[:30]):
+        matrix.add(key, doc)
+    assert len(matrix) == 50
+
+    base = _random_composition(rng, full=False)
+    expected = find_best_match_by_composition(base, docs)
+    assert find_best_match_by_composition_vectorized(base, docs, matrix, keys) is expected
+
+
+def _categorized(rng):
+    categorized = {}
+    for category in ("long", "intermediate", "short"):
+        docs = _random_docs(rng, 80)
+        for doc in docs:
+            doc["category"] = category
+            doc["キーワード"] = rng.sample(["仕事", "家族", "旅行", "疲れ"], rng.randint(1, 2))
+        categorized[category] = docs
+    return categorized
+
+
+def test_top_k_per_category_matches_best_match(monkeypatch):
+    from module.response import response_index
+
+    monkeypatch.setattr(response_index, "INDEX_CACHE_ENABLED", False)
+    rng = random.Random(3)
+    for _ in range(10):
+        categorized = _categorized(rng)
+        base = _random_composition(rng, full=False)
+        hits = response_index._rank_categorized_index(categorized, base, ["仕事"], 1, True, 0)
+        for category, docs in categorized.items():
+            filtered = [d for d in docs if "仕事" in d["キーワード"]]
+            expected = find_best_match_by_composition(base, filtered)
+            got = [h["document"] for h in hits if h["category"] == category]
+            assert got == ([expected] if expected else [])
+
+
+def test_top_k_global_is_sorted_and_thresholded(monkeypatch):
+    from module.response import response_index
+
+    monkeypatch.setattr(response_index, "INDEX_CACHE_ENABLED", False)
+    rng = random.Random(5)
+    categorized = _categorized(rng)
+    base = {NAMES[0]: 40, NAMES[1]: 30}
+    for doc in categorized["short"][:5]:
+        doc["構成比"] = {NAMES[0]: 42, NAMES[1]: 28}
+        doc["キーワード"] = ["仕事"]
+
+    hits = response_index._rank_categorized_index(categorized, base, ["仕事", "疲れ"], 4, False, 0)
+    scores = [h["score"] for h in hits]
+    assert len(hits) <= 4
+    assert scores == sorted(scores, reverse=True)
+    for hit in hits:
+        assert 1 <= hit["keyword_overlap"] <= 2
+
+    threshold = scores[0]
+    high = response_index._rank_categorized_index(categorized, base, ["仕事", "疲れ"], 10, False, threshold)
+    assert all(h["score"] >= threshold for h in high)
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+from module.utils.concurrency import gather_with_deadline, run_with_deadline
+
+
+def test_run_with_deadline_returns_partial_results():
+    def fast():
+        return "ok"
+
+    def slow():
+        time.sleep(1.0)
+        return "late"
+
+    def broken():
+        raise RuntimeError("boom")
+
+    started = time.perf_counter()
+    results = run_with_deadline({"short": fast, "long": slow, "intermediate": broken}, timeout=0.2, default=None)
+    elapsed = time.perf_counter() - started
+
+    assert results == {"short": "ok", "long": None, "intermediate": None}
+    assert elapsed < 0.8
+
+
+def test_run_with_deadline_runs_branches_in_parallel():
+    def wait(value):
+        time.sleep(0.2)
+        return value
+
+    started = time.perf_counter()
+    results = run_with_deadline({c: (lambda c=c: wait(c)) for c in ("short", "intermediate", "long")}, timeout=2.0)
+    elapsed = time.perf_counter() - started
+
+    assert results == {"short": "short", "intermediate": "intermediate", "long": "long"}
+    assert elapsed < 0.5
+
+
+def test_gather_with_deadline_cancels_slow_tasks():
+    cancelled = []
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return 1
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        return await gather_with_deadline({"a": fast(), "b": slow()}, timeout=0.1, default=[])
+
+    results = asyncio.run(run())
+    assert results == {"a": 1, "b": []}
+    assert cancelled == [True]
@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+import pytest
+
+from module.emotion.emotion_dynamics import EmotionDynamics
+from module.emotion.emotion_stats import merge_emotion_dicts
+
+NAMES = [
+    "喜び", "期待", "怒り", "嫌悪", "悲しみ", "驚き", "恐れ", "信頼",
+    "楽観", "誇り", "病的状態", "積極性", "冷笑", "悲観", "軽蔑", "羨望",
+    "憤慨", "自責", "不信", "恥", "失望", "絶望", "感傷", "畏敬",
+    "好奇心", "歓喜", "服従", "罪悪感", "不安", "愛", "希望", "優位",
+]
+
+
+def random_vector(rng: random.Random, keys: int, high: float = 60.0) -> dict:
+    return {name: round(rng.uniform(0, high), 2) for name in rng.sample(NAMES, keys)}
+
+
+def assert_same(expected: dict, actual: dict, tol: float):
+    assert set(expected) == set(actual)
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key], abs=tol), key
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_parity_with_dict_version(seed):
+    rng = random.Random(seed)
+    engine = EmotionDynamics(NAMES)
+    assert engine.supported
+    current = random_vector(rng, rng.randint(0, 12))
+    new = random_vector(rng, rng.randint(1, 6), high=100.0)
+    if seed % 3 == 0:
+        new["怒り"] = 80.0  # 大スパイク＋相互抑制
+    dt = rng.choice([0.0, 5.0, 45.0, 600.0])
+    weight = None if seed % 4 else 0.3
+
+    assert_same(
+        merge_emotion_dicts(current, new, dt, weight_new=weight, normalize=False),
+        engine.merge(current, new, dt, weight_new=weight, normalize=False),
+        tol=1e-9,
+    )
+    # 丸めの境目で合計の足し順の差が出ることがあるので 0.01 まで許す
+    assert_same(
+        merge_emotion_dicts(current, new, dt, weight_new=weight),
+        engine.merge(current, new, dt, weight_new=weight),
+        tol=0.0100001,
+    )
+
+
+def test_cross_inhibition_adds_target_keys_and_unknown_keys_fall_back():
+    engine = EmotionDynamics(NAMES)
+    merged = engine.merge({}, {"怒り": 50.0}, 0.0, normalize=False)
+    assert set(merged) == {"怒り", "信頼", "愛", "恐れ", "悲しみ"}
+    assert engine.merge({"未知": 1.0}, {"怒り": 50.0}, 0.0) is None
+
+
+def test_merge_many_matches_single_merges():
+    rng = random.Random(7)
+    engine = EmotionDynamics(NAMES)
+    currents = [random_vector(rng, 8) for _ in range(20)]
+    news = [random_vector(rng, 3, high=100.0) for _ in range(20)]
+    dts = np.array([rng.uniform(0, 300) for _ in range(20)])
+    batch = engine.merge_many(currents, news, dts)
+    for current, new, dt, merged in zip(currents, news, dts, batch):
+        assert merged == engine.merge(current, new, float(dt))
@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import module.emotion.emotion_stats as stats
+import module.emotion.emotion_state_store as store_module
+from module.emotion.emotion_state_store import EmotionStateStore, downsample_snapshots
+
+
+@pytest.fixture
+def collections(monkeypatch, fake_collection):
+    state, snapshots, legacy = fake_collection(), fake_collection(), fake_collection()
+    monkeypatch.setattr(store_module, "get_collection", {
+        "current_emotion_state": state,
+        "current_emotion_snapshots": snapshots,
+        "current_emotion": legacy
+    }.get)
+    return state, snapshots
+
+
+def test_save_bumps_version_and_serves_reads_from_memory(collections, clock):
+    state, _ = collections
+    store = EmotionStateStore(refresh_interval=30, snapshot_interval=300, clock=clock)
+    assert store.load()["version"] == 0
+
+    first = store.save({"喜び": 60.0}, "2026-01-01T00:00:00")
+    second = store.save({"喜び": 40.0, "信頼": 20.0}, "2026-01-01T00:01:00")
+    assert (first["version"], second["version"]) == (1, 2)
+
+    finds = state.finds
+    loaded = store.load()
+    assert loaded["emotion_vector"] == {"喜び": 40.0, "信頼": 20.0}
+    assert state.finds == finds
+
+
+def test_expected_version_conflict_returns_none(collections, clock):
+    state, _ = collections
+    store = EmotionStateStore(refresh_interval=30, clock=clock)
+    store.save({"喜び": 10.0}, "t1")
+    # 他のプロセスが先に書き込んだ
+    state.get("current")["version"] = 5
+
+    assert store.save({"喜び": 20.0}, "t2", expected_version=1) is None
+    assert store.load()["version"] == 5
+    assert store.save({"喜び": 20.0}, "t3", expected_version=5)["version"] == 6
+
+
+def test_snapshots_follow_interval(collections, clock):
+    _, snapshots = collections
+    store = EmotionStateStore(snapshot_interval=300, clock=clock)
+    store.save({"喜び": 10.0}, "t1")
+    clock.now += 100
+    store.save({"喜び": 20.0}, "t2")
+    clock.now += 250
+    store.save({"喜び": 30.0}, "t3")
+    assert [s["emotion_vector"]["喜び"] for s in snapshots.docs] == [10.0, 30.0]
+
+
+def test_downsample_averages_each_bucket():
+    def snapshot(i, minute, value):
+        ts = datetime(2026, 1, 1, minute // 60, minute % 60, tzinfo=timezone.utc)
+        return {"_id": i, "ts": ts, "emotion_vector": {"喜び": value}, "version": i}
+
+    rows = [snapshot(1, 0, 10.0), snapshot(2, 30, 20.0), snapshot(3, 65, 50.0)]
+    result = downsample_snapshots(rows, bucket_sec=3600)
+    assert [(summary["emotion_vector"], ids) for summary, ids in result] == [
+        ({"喜び": 15.0}, [1, 2]),
+        ({"喜び": 50.0}, [3])
+    ]
+    assert result[0][0]["ts"] == datetime(2026, 1, 1, 0, 0, tzinfo=timezone.utc)
+    assert result[0][0]["meta"]["resolution"] == "downsampled"
+
+
+def test_update_rereads_and_remerges_on_conflict(collections, monkeypatch, clock):
+    state, _ = collections
+    store = EmotionStateStore(refresh_interval=30, clock=clock)
+    monkeypatch.setattr(stats, "EMOTION_STATE_STORE_ENABLED", True)
+    monkeypatch.setattr(stats, "get_emotion_state_store", lambda: store)
+    store.save({"喜び": 100.0}, "t1")
+    # 別のワーカーが書き込んだ（このプロセスのコピーは version=1 のまま）
+    state.get("current").update({"emotion_vector": {"悲しみ": 100.0}, "version": 2})
+
+    merged = stats.update_current_emotion({"喜び": 100.0}, weight_new=0.3)
+    assert "悲しみ" in merged
+    assert state.get("current")["version"] == 3
+    assert state.get("current")["emotion_vector"] == merged
+
+
+def test_first_update_creates_state_document(collections, monkeypatch, clock):
+    state, _ = collections
+    store = EmotionStateStore(clock=clock)
+    monkeypatch.setattr(stats, "EMOTION_STATE_STORE_ENABLED", True)
+    monkeypatch.setattr(stats, "get_emotion_state_store", lambda: store)
+    stats.update_current_emotion({"喜び": 100.0})
+    assert state.get("current")["version"] == 1
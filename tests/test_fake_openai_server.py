@@ -0,0 +1,54 @@
+import json
+
+import openai
+import pytest
+from fastapi.testclient import TestClient
+from openai import OpenAI
+
+from module.llm.fake_openai_server import FakeLLMBehaviour, create_app
+from module.utils.json_block import find_json_block
+
+
+def make_client(**behaviour):
+    app = create_app(FakeLLMBehaviour(latency_median=0, tokens_per_sec=0, seed=1, **behaviour))
+    http = TestClient(app)
+    return OpenAI(api_key="sk-local", base_url="http://testserver/v1", http_client=http, max_retries=0)
+
+
+def ask(text):
+    return [{"role": "system", "content": "…"}, {"role": "user", "content": f"人格\nユーザー発言: {text}\n参照"}]
+
+
+def test_completion_has_trailing_emotion_json():
+    client = make_client()
+    response = client.chat.completions.create(model="fake", messages=ask("おはよう"))
+    content = response.choices[0].message.content
+    block = find_json_block(content)
+    assert block is not None
+    assert sum(block.data["構成比"].values()) == 100
+    assert "（感情　" in block.display_text
+    # 同じ入力なら同じ応答
+    assert client.chat.completions.create(model="fake", messages=ask("おはよう")).choices[0].message.content == content
+
+
+def test_stream_reassembles_to_same_text():
+    client = make_client()
+    full = client.chat.completions.create(model="fake", messages=ask("雨の日")).choices[0].message.content
+    chunks = client.chat.completions.create(model="fake", messages=ask("雨の日"), stream=True)
+    assert "".join(c.choices[0].delta.content or "" for c in chunks if c.choices) == full
+
+
+def test_structured_and_error_injection():
+    client = make_client()
+    response = client.chat.completions.create(
+        model="fake", messages=ask("こんにちは"),
+        response_format={"type": "json_schema", "json_schema": {"name": "x", "schema": {}}}
+    )
+    reply = json.loads(response.choices[0].message.content)
+    assert set(reply) == {"response", "emotion"}
+    assert sum(item["割合"] for item in reply["emotion"]["構成比"]) == 100
+
+    failing = make_client(error_rate=1.0, error_statuses=(503,))
+    with pytest.raises(openai.APIStatusError) as error:
+        failing.chat.completions.create(model="fake", messages=ask("こんにちは"))
+    assert error.value.status_code == 503
@@ -0,0 +1,138 @@
+from module.response.index_cache import EmotionIndexCache
+from module.response.keyword_index import KeywordIndex
+
+
+def _docs():
+    return [
+        {"_id": "a1", "category": "short", "キーワード": ["仕事"]},
+        {"_id": "a2", "category": "long", "キーワード": ["家族"]},
+    ]
+
+
+def _make_cache(docs, watermark=("a2", 2)):
+    calls = {"load": 0}
+    state = {"watermark": watermark}
+
+    def loader():
+        calls["load"] += 1
+        return list(docs)
+
+    cache = EmotionIndexCache(
+        loader=loader,
+        watermark_getter=lambda: state["watermark"],
+        check_interval=3600,
+        max_age=0
+    )
+    return cache, calls, state
+
+
+def test_loads_once_and_categorizes():
+    cache, calls, _ = _make_cache(_docs())
+    first = cache.get_categorized()
+    second = cache.get_categorized()
+    assert calls["load"] == 1
+    assert first is second
+    assert [d["_id"] for d in first["short"]] == ["a1"]
+    assert [d["_id"] for d in first["long"]] == ["a2"]
+    assert first["intermediate"] == []
+
+
+def test_incremental_add_update_remove():
+    cache, calls, _ = _make_cache(_docs())
+    before = cache.get_categorized()
+    version = cache.version
+
+    cache.add({"_id": "a3", "category": "short", "キーワード": ["旅行"]})
+    after = cache.get_categorized()
+    assert [d["_id"] for d in after["short"]] == ["a1", "a3"]
+    # 既存スナップショットは変更されない
+    assert [d["_id"] for d in before["short"]] == ["a1"]
+    assert cache.version > version
+
+    cache.update_fields("a1", {"履歴": []})
+    assert cache.get_categorized()["short"][0]["履歴"] == []
+
+    cache.remove("a2")
+    assert cache.get_categorized()["long"] == []
+    assert calls["load"] == 1
+
+
+def test_own_writes_advance_watermark():
+    cache, calls, state = _make_cache(_docs())
+    cache.get_categorized()
+    cache.add({"_id": "a3", "category": "short"})
+    # 他プロセスの書き込みが無ければ DB 側と一致する
+    state["watermark"] = ("a3", 3)
+    cache._refresh()
+    assert calls["load"] == 1
+
+    # 他プロセスが書き込んだ → 再読込
+    state["watermark"] = ("a4", 4)
+    cache._refresh()
+    assert calls["load"] == 2
+
+
+def test_match_keywords_matches_linear_filter():
+    docs = [
+        {"_id": "b1", "category": "short", "キーワード": ["仕事", "疲れ"]},
+        {"_id": "b2", "category": "short", "キーワード": ["家族"]},
+        {"_id": "b3", "category": "short", "キーワード": ["疲れ"]},
+        {"_id": "b4", "category": "long", "キーワード": ["仕事"]},
+    ]
+    cache, _, _ = _make_cache(docs)
+    matched = cache.match_keywords("short", ["疲れ", "仕事", "仕事"])
+    assert [(d["_id"], n) for d, n in matched] == [("b1", 2), ("b3", 1)]
+
+    linear = [d for d in docs if d["category"] == "short" and set(d["キーワード"]) & {"疲れ", "仕事"}]
+    assert [d for d, _ in matched] == linear
+
+
+def test_match_keywords_follows_incremental_updates():
+    cache, _, _ = _make_cache(_docs())
+    cache.get_categorized()
+    cache.add({"_id": "a3", "category": "short", "キーワード": ["仕事"]})
+    assert [d["_id"] for d, _ in cache.match_keywords("short", ["仕事"])] == ["a1", "a3"]
+
+    cache.update_fields("a1", {"キーワード": ["休日"]})
+    assert [d["_id"] for d, _ in cache.match_keywords("short", ["仕事"])] == ["a3"]
+    assert [d["_id"] for d, _ in cache.match_keywords("short", ["休日"])] == ["a1"]
+
+    cache.remove("a3")
+    assert cache.match_keywords("short", ["仕事"]) == []
+
+
+def test_bulk_build_matches_incremental_adds():
+    docs = [
+        {"_id": f"c{i}", "category": "short", "キーワード": ["共通", f"k{i % 3}"]}
+        for i in range(6)
+    ]
+    bulk = KeywordIndex.from_docs((d["_id"], d) for d in docs)
+    incremental = KeywordIndex()
+    for d in docs:
+        incremental.add(d["_id"], d)
+    for keywords in (["共通"], ["k1"], ["共通", "k2"]):
+        assert bulk.overlaps("short", keywords) == incremental.overlaps("short", keywords)
+    assert bulk.sort_keys(["c5", "c0", "c3"]) == ["c0", "c3", "c5"]
+
+    # 一括構築した posting も差し替えで更新できる
+    bulk.remove("c0", docs[0])
+    assert "c0" not in bulk.overlaps("short", ["共通"])
+
+
+def test_incremental_writes_rebuild_only_touched_categories_on_read(monkeypatch):
+    cache, _, _ = _make_cache(_docs())
+    before = cache.get_categorized()
+
+    rebuilt = []
+    categorize = cache._categorize
+    monkeypatch.setattr(cache, "_categorize", lambda categories: rebuilt.append(set(categories)) or categorize(categories))
+    for i in range(3, 13):
+        cache.add({"_id": f"a{i}", "category": "short"})
+    assert rebuilt == []
+
+    after = cache.get_categorized()
+    assert rebuilt == [{"short"}]
+    assert len(after["short"]) == 11
+    assert after["long"] is before["long"]
+    assert [d["_id"] for d in before["short"]] == ["a1"]
+    assert cache.get_categorized() is after
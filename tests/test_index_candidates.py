@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from module.params import emotion_map
+from module.response import response_index
+
+# server モード：カテゴリとキーワードの絞り込みを集計パイプラインに任せ、一致数はサーバー側の keyword_overlap を使う
+
+NAMES = list(emotion_map.values())
+
+
+def _doc(_id, category, keywords, composition, overlap):
+    # keyword_overlap は本来 $project で付く値（フェイクは $match だけを適用する）
+    return {"_id": _id, "category": category, "キーワード": keywords, "構成比": composition, "keyword_overlap": overlap}
+
+
+@pytest.fixture
+def index_collection(monkeypatch, fake_collection, async_fake_collection):
+    collection = fake_collection([
+        _doc("a1", "short", ["仕事", "疲れ"], {NAMES[0]: 40, NAMES[1]: 30}, 2),
+        _doc("a2", "short", ["家族"], {NAMES[0]: 40, NAMES[1]: 30}, 0),
+        _doc("a3", "long", ["仕事"], {NAMES[0]: 90}, 1),
+        _doc("a4", "intermediate", ["疲れ"], {NAMES[0]: 41, NAMES[1]: 29}, 1),
+    ])
+    monkeypatch.setattr(response_index, "get_collection", lambda name: collection)
+    monkeypatch.setattr(response_index, "get_async_collection", lambda name: async_fake_collection(sync=collection))
+    monkeypatch.setattr(response_index, "MEMORY_FANOUT_ENABLED", False)
+    return collection
+
+
+def _ids(categorized):
+    return {category: [d["_id"] for d in docs] for category, docs in categorized.items()}
+
+
+def test_pipeline_filters_categories_and_counts_overlap_on_server():
+    pipeline = response_index.build_index_candidates_pipeline(["仕事", "疲れ", "仕事"], ("short",))
+    assert pipeline[0] == {"$match": {"category": {"$in": ["short"]}, "キーワード": {"$in": ["仕事", "疲れ"]}}}
+    project = pipeline[-1]["$project"]
+    assert project["keyword_overlap"] == {
+        "$size": {"$setIntersection": [{"$ifNull": ["$キーワード", []]}, ["仕事", "疲れ"]]}
+    }
+    assert all(project[field] == 1 for field in response_index.INDEX_SEARCH_PROJECTION)
+
+
+def test_load_candidates_runs_one_aggregation_and_categorizes(index_collection):
+    categorized = response_index.load_index_candidates(["仕事", "疲れ"])
+    assert _ids(categorized) == {"long": ["a3"], "intermediate": ["a4"], "short": ["a1"]}
+    assert index_collection.aggregations == 1
+    assert index_collection.calls == []  # find での全件取得はしない
+
+
+def test_load_candidates_without_keywords_skips_query(index_collection):
+    assert response_index.load_index_candidates([]) == {"long": [], "intermediate": [], "short": []}
+    assert index_collection.aggregations == 0
+
+
+def test_load_candidates_fanout_queries_each_category(index_collection, monkeypatch):
+    monkeypatch.setattr(response_index, "MEMORY_FANOUT_ENABLED", True)
+    categorized = response_index.load_index_candidates(["仕事", "疲れ"])
+    assert _ids(categorized) == {"long": ["a3"], "intermediate": ["a4"], "short": ["a1"]}
+    assert sorted(p[0]["$match"]["category"]["$in"][0] for p in index_collection.pipelines) == [
+        "intermediate", "long", "short"
+    ]
+
+
+def test_load_candidates_async_matches_sync(index_collection):
+    expected = response_index.load_index_candidates(["仕事"])
+    assert asyncio.run(response_index.load_index_candidates_async(["仕事"])) == expected
+
+
+def test_load_candidates_failure_returns_empty_categories(monkeypatch):
+    monkeypatch.setattr(response_index, "get_collection", lambda name: None)
+    assert response_index.load_index_candidates(["仕事"]) == {"long": [], "intermediate": [], "short": []}
+
+
+def test_with_overlaps_moves_server_counts_out_of_documents():
+    categorized = {"short": [{"_id": "a", "keyword_overlap": 2}, {"_id": "b"}], "long": []}
+    candidates = response_index._with_overlaps(categorized)
+    assert candidates["short"] == ([{"_id": "a"}, {"_id": "b"}], [2, 0], False)
+    assert candidates["long"] == ([], [], False)
+
+
+def test_server_top_k_uses_server_overlap_and_leaves_collection_intact(index_collection, monkeypatch):
+    monkeypatch.setattr(response_index, "INDEX_SEARCH_MODE", "server")
+    structure = {"構成比": {NAMES[0]: 40, NAMES[1]: 30}, "keywords": ["仕事", "疲れ"]}
+
+    hits = response_index.search_index_top_k(structure, k=2, per_category=False, min_score=0)
+    assert [(h["document"]["_id"], h["keyword_overlap"]) for h in hits] == [("a1", 2), ("a4", 1)]
+    assert all("keyword_overlap" not in h["document"] for h in hits)
+
+    # 結果はコピーで渡されるので、保存側のドキュメントから一致数は消えない
+    assert index_collection.get("a1")["keyword_overlap"] == 2
+    again = response_index.search_index_top_k(structure, k=2, per_category=False, min_score=0)
+    assert [h["keyword_overlap"] for h in again] == [2, 1]
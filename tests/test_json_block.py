@@ -0,0 +1,68 @@
+import json
+
+from module.utils.json_block import JsonBlockScanner, find_json_block, strip_json_block
+
+EMOTION = {"主感情": "喜び", "構成比": {"喜び": 60, "信頼": 40}, "状況": "括弧 } と { を含む \"引用\" 文"}
+
+
+def test_bare_trailing_object():
+    text = "ありがとう！\n（感情　喜び:60%、信頼:40%）\n\n" + json.dumps(EMOTION, ensure_ascii=False, indent=2)
+    block = find_json_block(text)
+    assert block.data == EMOTION
+    assert block.display_text == "ありがとう！\n（感情　喜び:60%、信頼:40%）"
+
+
+def test_fenced_object_and_last_block_wins():
+    text = 'まず {"a": 1} と書きます。\n```json\n' + json.dumps(EMOTION, ensure_ascii=False) + "\n```\n"
+    block = find_json_block(text)
+    assert block.data == EMOTION
+    assert block.display_text == 'まず {"a": 1} と書きます。'
+
+
+def test_falls_back_to_earlier_parsable_block():
+    text = '{"主感情": "怒り"} 応答 {壊れた: JSON}'
+    block = find_json_block(text)
+    assert block.data == {"主感情": "怒り"}
+
+
+def test_no_object():
+    assert find_json_block("JSONはありません") is None
+    assert strip_json_block("  JSONはありません  ") == "JSONはありません"
+
+
+def test_incremental_feed_matches_single_pass():
+    text = "応答です。" + json.dumps(EMOTION, ensure_ascii=False)
+    scanner = JsonBlockScanner()
+    for i in range(0, len(text), 3):
+        scanner.feed(text[i:i + 3])
+        if i == 6:
+            assert scanner.open_start == len("応答です。")
+    assert scanner.spans == JsonBlockScanner().feed(text).spans
+    assert scanner.result().data == EMOTION
+
+
+def test_escaped_quote_split_across_chunks():
+    text = '{"s": "a\\\\"}x{"t": "\\"}"}'
+    scanner = JsonBlockScanner()
+    for ch in text:
+        scanner.feed(ch)
+    assert scanner.result().data == {"t": '"}'}
+
+
+def test_helpers_share_one_scan_per_request(monkeypatch):
+    import module.utils.json_block as json_block
+    from module.utils.request_context import end_request_context, start_request_context
+
+    scans = []
+    original = json_block.JsonBlockScanner.result
+    monkeypatch.setattr(json_block.JsonBlockScanner, "result", lambda self: scans.append(1) or original(self))
+
+    text = 'こんにちは\n{"主感情": "喜び"}'
+    token = start_request_context()
+    try:
+        assert find_json_block(text).data == {"主感情": "喜び"}
+        assert strip_json_block(text) == "こんにちは"
+        assert find_json_block(text).data == {"主感情": "喜び"}
+    finally:
+        end_request_context(token)
+    assert len(scans) == 1
@@ -0,0 +1,60 @@
+from module.utils.log_sink import MongoLogSink
+
+
+def _make_sink(collection, **kwargs):
+    kwargs.setdefault("flush_interval", 60.0)
+    return MongoLogSink(collection_getter=lambda: collection, **kwargs)
+
+
+def test_flush_writes_with_insert_many(fake_collection):
+    col = fake_collection()
+    sink = _make_sink(col, batch_size=100)
+    for i in range(5):
+        sink.put({"level": "INFO", "message": str(i)})
+    sink.flush()
+    assert [d["message"] for d in col.docs] == ["0", "1", "2", "3", "4"]
+    sink.shutdown()
+
+
+def test_batch_size_triggers_write(fake_collection):
+    col = fake_collection()
+    sink = _make_sink(col, batch_size=3)
+    for i in range(6):
+        sink.put({"level": "INFO", "message": str(i)})
+    sink.flush()
+    assert all(len(b) <= 3 for b in col.batches)
+    assert len(col.docs) == 6
+    sink.shutdown()
+
+
+def test_drop_oldest_policy(fake_collection):
+    col = fake_collection()
+    sink = _make_sink(col, maxsize=2, overflow_policy="drop_oldest")
+    # ライターを起動させずにキューの挙動だけを見る
+    sink._writer = object()
+    for i in range(3):
+        sink.put({"level": "INFO", "message": str(i)})
+    assert [e["message"] for e in sink._buffer] == ["1", "2"]
+    assert sink.stats["dropped"] == 1
+
+
+def test_drop_debug_policy(fake_collection):
+    col = fake_collection()
+    sink = _make_sink(col, maxsize=2, overflow_policy="drop_debug")
+    sink._writer = object()
+    sink.put({"level": "INFO", "message": "a"})
+    sink.put({"level": "DEBUG", "message": "b"})
+    sink.put({"level": "ERROR", "message": "c"})
+    assert [e["message"] for e in sink._buffer] == ["a", "c"]
+    assert sink.put({"level": "DEBUG", "message": "d"}) is False
+    assert [e["message"] for e in sink._buffer] == ["a", "c"]
+
+
+def test_shutdown_flushes_remaining(fake_collection):
+    col = fake_collection()
+    sink = _make_sink(col, batch_size=100)
+    for i in range(10):
+        sink.put({"level": "INFO", "message": str(i)})
+    sink.shutdown()
+    assert len(col.docs) == 10
+    assert sink.put({"level": "INFO", "message": "late"}) is False
@@ -0,0 +1,83 @@
+import pytest
+
+from module.emotion import main_emotion
+from module.params import emotion_map
+from module.response import memory_lookup
+from module.response.memory_record_cache import MemoryRecordCache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = MemoryRecordCache(maxsize=16, ttl=60, negative_ttl=60)
+    monkeypatch.setattr(memory_lookup, "get_memory_record_cache", lambda: cache)
+    return cache
+
+
+def _doc(category, emotion, dates):
+    return {
+        "category": category,
+        "emotion": emotion,
+        "data": {"履歴": [{"date": d, "状況": f"{category}-{d}"} for d in dates]}
+    }
+
+
+def test_find_history_records_one_query(monkeypatch, fake_collection):
+    col = fake_collection([
+        _doc("short", "Joy", ["20250101000000", "20250102000000"]),
+        _doc("short", "Joy", ["20250102000000"]),
+        _doc("long", "Joy", ["20250102000000"]),
+        _doc("long", "Anger", ["20250102000000"]),
+    ])
+    monkeypatch.setattr(memory_lookup, "get_collection", lambda name: col)
+
+    found = memory_lookup.find_history_records("Joy", "20250102000000")
+    assert found["short"]["状況"] == "short-20250102000000"
+    assert found["intermediate"] is None
+    assert found["long"]["状況"] == "long-20250102000000"
+    assert len(col.calls) == 1
+    assert col.calls[0][1]["data.履歴.$"] == 1
+
+
+def test_missing_keys_skip_query(monkeypatch, fake_collection):
+    col = fake_collection([])
+    monkeypatch.setattr(memory_lookup, "get_collection", lambda name: col)
+    assert memory_lookup.find_history_record(None, "short", "20250101000000") is None
+    assert col.calls == []
+
+
+def test_cached_categories_skip_query(monkeypatch, fresh_cache, fake_collection):
+    col = fake_collection([_doc("short", "Joy", ["20250102000000"])])
+    monkeypatch.setattr(memory_lookup, "get_collection", lambda name: col)
+
+    memory_lookup.find_history_records("Joy", "20250102000000")
+    found = memory_lookup.find_history_records("Joy", "20250102000000")
+    assert found["short"]["状況"] == "short-20250102000000"
+    assert found["long"] is None
+    assert len(col.calls) == 1
+
+    # 忘却で消えたカテゴリだけを引き直す
+    fresh_cache.invalidate("Joy", "short", "20250102000000")
+    memory_lookup.find_history_records("Joy", "20250102000000")
+    assert len(col.calls) == 2
+    assert col.calls[1][0]["category"]["$in"] == ["short"]
+
+
+@pytest.mark.parametrize("history", [None, [{"date": "20250103000000", "状況": "書き込み"}]])
+def test_written_record_cache_agrees_with_lookup(monkeypatch, fresh_cache, history, fake_collection):
+    col = fake_collection([])
+    monkeypatch.setattr(main_emotion, "get_collection", lambda name: col)
+    monkeypatch.setattr(main_emotion, "get_memory_record_cache", lambda: fresh_cache)
+    monkeypatch.setattr(main_emotion, "save_index_data", lambda **kwargs: None)
+    monkeypatch.setattr(memory_lookup, "get_collection", lambda name: col)
+
+    data = {"date": "20250103000000", "主感情": next(iter(emotion_map.values())), "重み": 50}
+    if history is not None:
+        data["履歴"] = history
+    main_emotion.write_structured_emotion_data(data)
+    emotion = col.docs[0]["emotion"]
+
+    cached = memory_lookup.find_history_record(emotion, "short", "20250103000000")
+    fresh_cache.clear()
+    from_db = memory_lookup.find_history_record(emotion, "short", "20250103000000")
+    assert cached == from_db
+    assert (from_db is None) == (history is None)
@@ -0,0 +1,47 @@
+from module.response.memory_record_cache import MemoryRecordCache
+
+
+def test_lru_eviction_and_stats():
+    cache = MemoryRecordCache(maxsize=2, ttl=60, negative_ttl=60)
+    cache.put("Joy", "short", "d1", {"date": "d1"})
+    cache.put("Joy", "short", "d2", {"date": "d2"})
+    assert cache.get("Joy", "short", "d1") == (True, {"date": "d1"})
+    cache.put("Joy", "short", "d3", {"date": "d3"})  # d2 が最も古い
+
+    assert cache.get("Joy", "short", "d2") == (False, None)
+    assert cache.get("Joy", "short", "d1")[0]
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["size"] == 2
+
+
+def test_ttl_and_negative_ttl(clock):
+    cache = MemoryRecordCache(maxsize=10, ttl=100, negative_ttl=10, clock=clock)
+    cache.put("Joy", "long", "d1", {"date": "d1"})
+    cache.put("Joy", "short", "d1", None)
+    assert cache.get("Joy", "short", "d1") == (True, None)
+
+    clock.now = 20
+    assert cache.get("Joy", "short", "d1") == (False, None)
+    assert cache.get("Joy", "long", "d1")[0]
+    clock.now = 200
+    assert cache.get("Joy", "long", "d1") == (False, None)
+    assert cache.stats()["expirations"] == 2
+
+
+def test_invalidation_by_key_and_date():
+    cache = MemoryRecordCache(maxsize=10, ttl=60)
+    cache.put("Joy", "short", "d1", {"date": "d1"})
+    cache.put("Anger", "intermediate", "d1", {"date": "d1"})
+    cache.put("Joy", "short", "d2", {"date": "d2"})
+
+    cache.invalidate("Joy", "short", "d1")
+    assert not cache.get("Joy", "short", "d1")[0]
+    assert cache.get("Anger", "intermediate", "d1")[0]
+
+    cache.invalidate_date("d1")
+    assert not cache.get("Anger", "intermediate", "d1")[0]
+    assert cache.get("Joy", "short", "d2")[0]
+    assert cache.stats()["invalidations"] == 2
@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from module.utils import metrics
+from module.utils.metrics import (
+    MongoCommandMetricsListener,
+    counter,
+    end_request_timing,
+    format_server_timing,
+    histogram,
+    render_prometheus,
+    span,
+    start_request_timing,
+    timed,
+)
+
+
+def _stage_count(stage: str) -> int:
+    series = metrics.STAGE_SECONDS._series.get((stage,))
+    return series[2] if series else 0
+
+
+def test_registry_returns_same_metric_and_renders_prometheus_text():
+    requests = counter("test_metrics_requests_total", "Test requests", ("status",))
+    assert counter("test_metrics_requests_total", "Test requests", ("status",)) is requests
+    requests.inc(status="ok")
+    requests.inc(2, status='er"r')
+
+    latency = histogram("test_metrics_latency_seconds", "Test latency", ("stage",), buckets=(0.1, 1.0))
+    latency.observe(0.05, stage="a")
+    latency.observe(0.5, stage="a")
+    latency.observe(5.0, stage="a")
+
+    text = render_prometheus()
+    assert "# TYPE test_metrics_requests_total counter" in text
+    assert 'test_metrics_requests_total{status="ok"} 1.0' in text
+    assert 'test_metrics_requests_total{status="er\\"r"} 2' in text
+    # バケットは累積、+Inf は総数
+    assert 'test_metrics_latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_metrics_latency_seconds_bucket{stage="a",le="1.0"} 2' in text
+    assert 'test_metrics_latency_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_metrics_latency_seconds_sum{stage="a"} 5.55' in text
+    assert 'test_metrics_latency_seconds_count{stage="a"} 3' in text
+    assert text.endswith("\n")
+
+
+def test_span_records_histogram_request_timing_and_errors():
+    errors = metrics.STAGE_ERRORS._values.get(("test.fail",), 0.0)
+    token = start_request_timing()
+    with span("test.ok"):
+        pass
+    with span("test.ok"):
+        pass
+    with pytest.raises(ValueError):
+        with span("test.fail"):
+            raise ValueError("boom")
+    timings = end_request_timing(token)
+
+    assert timings["test.ok"][1] == 2
+    assert timings["test.fail"][1] == 1
+    assert metrics.STAGE_ERRORS._values[("test.fail",)] == errors + 1
+    assert _stage_count("test.ok") >= 2
+    header = format_server_timing(timings)
+    assert header.startswith("test.ok;dur=") and 'desc="x2"' in header
+
+
+def test_span_outside_request_only_updates_histogram():
+    before = _stage_count("test.background")
+    with span("test.background"):
+        pass
+    assert _stage_count("test.background") == before + 1
+
+
+def test_timed_wraps_sync_and_async_functions():
+    @timed("test.timed_sync")
+    def add(a, b):
+        return a + b
+
+    @timed("test.timed_async")
+    async def add_async(a, b):
+        await asyncio.sleep(0)
+        return a + b
+
+    token = start_request_timing()
+    assert add(1, 2) == 3
+    assert asyncio.run(add_async(2, 3)) == 5
+    timings = end_request_timing(token)
+    assert add.__name__ == "add"
+    assert timings["test.timed_sync"][1] == 1
+    # asyncio.run は現在のコンテキストのコピーで動くが、内訳の dict は共有される
+    assert timings["test.timed_async"][1] == 1
+
+
+def test_mongo_listener_records_commands_and_calls_hooks():
+    succeeded, failed = [], []
+    listener = MongoCommandMetricsListener(on_success=succeeded.append, on_failure=failed.append)
+    ok = SimpleNamespace(command_name="test_find", duration_micros=2_000)
+    error = SimpleNamespace(command_name="test_find", duration_micros=1_000, failure={"errtype": "AutoReconnect"})
+
+    token = start_request_timing()
+    listener.succeeded(ok)
+    listener.failed(error)
+    timings = end_request_timing(token)
+
+    assert succeeded == [ok] and failed == [error]
+    assert timings["mongo.test_find"] == [0.003, 2]
+    assert metrics.MONGO_COMMAND_SECONDS._series[("test_find", "ok")][2] == 1
+    assert metrics.MONGO_COMMAND_SECONDS._series[("test_find", "error")][2] == 1
+    assert 'yumia_mongo_command_duration_seconds_count{command="test_find",status="error"} 1' in render_prometheus()
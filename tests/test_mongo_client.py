@@ -0,0 +1,116 @@
+import threading
+from types import SimpleNamespace
+
+from pymongo.errors import AutoReconnect
+
+from module.mongo.mongo_client import MongoConnectionManager
+
+
+class FakeClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.pings = 0
+        self.closed = False
+        self.admin = SimpleNamespace(command=self._command)
+
+    def _command(self, name):
+        self.pings += 1
+        if self.fail:
+            raise AutoReconnect("down")
+        return {"ok": 1}
+
+    def close(self):
+        self.closed = True
+
+    def __getitem__(self, name):
+        return {}
+
+
+def _manager(client, **kwargs):
+    kwargs.setdefault("heartbeat_interval", 0)
+    manager = MongoConnectionManager(uri="mongodb://fake", **kwargs)
+    manager._create_client = lambda: client
+    return manager
+
+
+def test_breaker_opens_after_failures_and_probes_after_reset():
+    client = FakeClient()
+    manager = _manager(client, failure_threshold=2, reset_after=3600)
+    assert manager.get_client() is client
+
+    manager.record_failure()
+    assert manager.get_client() is client
+    manager.record_failure()
+    assert manager.state == "open"
+    assert manager.get_client() is None
+    assert manager.get_collection("emotion_data") is None
+
+    # 待ち時間を過ぎたら1回だけ ping で確かめて閉じる
+    manager.reset_after = 0
+    pings = client.pings
+    assert manager.get_client() is client
+    assert manager.state == "closed"
+    assert client.pings == pings + 1
+
+
+def test_command_network_failures_feed_the_breaker():
+    manager = _manager(FakeClient(), failure_threshold=2)
+    manager.get_client()
+
+    # サーバーのエラー応答（重複キーなど）は数えない
+    manager._on_command_failed(SimpleNamespace(failure={"ok": 0, "code": 11000, "errmsg": "duplicate key"}))
+    manager._on_command_failed(SimpleNamespace(failure={"errtype": "AutoReconnect", "errmsg": "reset"}))
+    assert manager.state == "closed"
+    # 成功したコマンドで連続失敗の数は戻る
+    manager._on_command_succeeded(SimpleNamespace())
+    manager._on_command_failed(SimpleNamespace(failure={"errtype": "NetworkTimeout", "errmsg": "timeout"}))
+    assert manager.state == "closed"
+    manager._on_command_failed(SimpleNamespace(failure={"errtype": "NetworkTimeout", "errmsg": "timeout"}))
+    assert manager.state == "open"
+
+
+def test_close_stops_heartbeat_before_clearing_client():
+    errors = []
+    original_hook = threading.excepthook
+    threading.excepthook = errors.append
+    try:
+        client = FakeClient()
+        manager = _manager(client, heartbeat_interval=0.001)
+        manager.get_client()
+        heartbeat = manager._heartbeat
+        while client.pings < 5:
+            pass
+        manager.close()
+        assert not heartbeat.is_alive()
+        assert client.closed
+        assert manager._client is None
+    finally:
+        threading.excepthook = original_hook
+    assert errors == []
+
+
+def test_failed_first_connect_counts_as_failure():
+    manager = _manager(FakeClient(fail=True), failure_threshold=1, reset_after=3600)
+    assert manager.get_client() is None
+    assert manager.state == "open"
+    assert manager.get_client() is None
+
+
+def test_async_client_listener_shares_the_breaker(monkeypatch):
+    import module.mongo.async_mongo_client as async_client
+
+    created = {}
+    manager = _manager(FakeClient(), failure_threshold=1)
+    manager.get_client()
+    monkeypatch.setenv("MONGODB_URI", "mongodb://fake")
+    monkeypatch.setattr(async_client, "_async_client", None)
+    monkeypatch.setattr(async_client, "get_connection_manager", lambda: manager)
+    monkeypatch.setattr(async_client, "AsyncMongoClient", lambda uri, **options: created.update(options) or object())
+
+    assert async_client.get_async_mongo_client() is not None
+    listener = created["event_listeners"][0]
+    listener.failed(SimpleNamespace(command_name="find", duration_micros=10, failure={"errtype": "AutoReconnect"}))
+    assert manager.state == "open"
+    # ブレーカーが開いている間は非同期側も待たずに諦める
+    monkeypatch.setattr(async_client, "_async_client", None)
+    assert async_client.get_async_mongo_client() is None
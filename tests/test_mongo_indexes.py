@@ -0,0 +1,35 @@
+from module.mongo.mongo_indexes import INDEX_SPECS, ensure_indexes, _plan_stages
+
+
+def test_ensure_indexes_is_idempotent(fake_database):
+    db = fake_database
+    total = sum(len(specs) for specs in INDEX_SPECS.values())
+
+    first = ensure_indexes(db)
+    assert len(first["created"]) == total
+    assert first["failed"] == []
+
+    second = ensure_indexes(db)
+    assert second["created"] == []
+    assert len(second["existing"]) == total
+
+
+def test_existing_index_with_other_name_is_not_recreated(fake_database):
+    db = fake_database
+    db["dialogue_history"].indexes["timestamp_-1"] = {"key": [("timestamp", -1.0)]}
+    result = ensure_indexes(db)
+    assert "dialogue_history.timestamp_desc" in result["existing"]
+    assert "timestamp_desc" not in db["dialogue_history"].indexes
+
+
+def test_dry_run_does_not_create(fake_database):
+    db = fake_database
+    result = ensure_indexes(db, dry_run=True)
+    assert result["created"]
+    assert list(db["emotion_index"].indexes) == ["_id_"]
+
+
+def test_plan_stages():
+    plan = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+    assert _plan_stages(plan) == ["LIMIT", "FETCH", "IXSCAN"]
+    assert _plan_stages({"stage": "COLLSCAN"}) == ["COLLSCAN"]
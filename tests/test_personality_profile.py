@@ -0,0 +1,53 @@
+import pytest
+
+import module.emotion.personality_profile as profile
+
+
+@pytest.fixture
+def collections(monkeypatch, fake_collection):
+    data = fake_collection(rows=[{"_id": "Joy", "count": 3}, {"_id": "Trust", "count": 1}, {"_id": "", "count": 2}])
+    profiles = fake_collection()
+    monkeypatch.setattr(profile, "get_collection", {"emotion_data": data, "personality_profile": profiles}.get)
+    profile.invalidate_personality_profile()
+    yield data, profiles
+    profile.invalidate_personality_profile()
+
+
+def test_first_load_rebuilds_then_reads_locally(collections):
+    data, profiles = collections
+    assert profile.load_personality_counts() == {"Joy": 3, "Trust": 1}
+    assert profiles.get("long_emotions")["total"] == 4
+    profile.load_personality_counts()
+    assert data.aggregations == 1
+
+
+def test_increments_update_document_and_local_copy(collections, monkeypatch):
+    data, profiles = collections
+    profile.load_personality_counts()
+    profile.record_long_emotion("Trust")
+    profile.record_long_emotion("Trust")
+    profile.record_long_emotion("Joy", delta=-3)
+    assert profile.load_personality_counts() == {"Trust": 3}
+    assert profiles.get("long_emotions")["counts"] == {"Joy": 0, "Trust": 3}
+
+    # 期限切れ後はドキュメント1件を読み直す（集計はしない）
+    monkeypatch.setattr(profile, "PERSONALITY_PROFILE_TTL_SEC", 0)
+    profiles.get("long_emotions")["counts"]["Fear"] = 2
+    assert profile.load_personality_counts() == {"Trust": 3, "Fear": 2}
+    assert data.aggregations == 1
+
+
+def test_rebuild_sums_names_that_differ_only_by_whitespace(collections):
+    data, profiles = collections
+    data.rows = [{"_id": "Joy", "count": 3}, {"_id": "Joy ", "count": 2}, {"_id": " ", "count": 1}]
+    assert profile.rebuild_personality_profile() == {"Joy": 5}
+    assert profiles.get("long_emotions")["total"] == 5
+
+
+def test_first_increment_rebuilds_instead_of_creating_partial_profile(collections):
+    data, profiles = collections
+    profile.record_long_emotion("Fear")
+    # 1感情だけのプロファイルではなく、emotion_data の long 全体を数え直したもの
+    assert profiles.get("long_emotions")["counts"] == {"Joy": 3, "Trust": 1}
+    assert data.aggregations == 1
+    assert profile.load_personality_counts() == {"Joy": 3, "Trust": 1}
@@ -0,0 +1,57 @@
+import os
+
+from module.utils import utils
+from module.llm import prompt_builder
+from module.llm.prompt_builder import build_prompt_messages, build_system_prompt, count_tokens
+
+CASE = {
+    "主感情": "喜び",
+    "構成比": {"喜び": 60, "信頼": 40},
+    "状況": "長い状況説明" * 40,
+    "心理反応": "長い心理反応" * 40,
+    "keywords": ["挨拶"]
+}
+HISTORY = {"short": CASE, "intermediate": CASE, "long": CASE}
+BEST_MATCH = {"emotion": "Joy", "date": "20250101000000"}
+
+
+def _use_prompt_dir(monkeypatch, tmp_path):
+    (tmp_path / "system_prompt.txt").write_text("SYSTEM", encoding="utf-8")
+    (tmp_path / "dialogue_prompt.txt").write_text("DIALOGUE", encoding="utf-8")
+    monkeypatch.setattr(utils, "PROMPT_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "_prompt_file_cache", {})
+
+
+def test_static_prefix_is_stable_and_hot_reloads(monkeypatch, tmp_path):
+    _use_prompt_dir(monkeypatch, tmp_path)
+    first = build_system_prompt()
+    assert first == "SYSTEM\n\nDIALOGUE"
+    assert build_system_prompt() is first
+
+    path = tmp_path / "dialogue_prompt.txt"
+    path.write_text("DIALOGUE v2", encoding="utf-8")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert build_system_prompt() == "SYSTEM\n\nDIALOGUE v2"
+
+
+def test_budget_trims_then_drops_memory_cases(monkeypatch, tmp_path):
+    _use_prompt_dir(monkeypatch, tmp_path)
+
+    _, unbounded = build_prompt_messages("こんにちは", [], BEST_MATCH, HISTORY, None, budget=100_000)
+    assert unbounded["memory_cases"] == {"kept": 3, "trimmed": 0, "dropped": 0}
+
+    budget = unbounded["total"] - 300
+    messages, report = build_prompt_messages("こんにちは", [], BEST_MATCH, HISTORY, None, budget=budget)
+    cases = report["memory_cases"]
+    assert cases["trimmed"] + cases["dropped"] > 0
+    assert report["total"] <= budget
+    assert messages[0]["content"] == "SYSTEM\n\nDIALOGUE"
+
+
+def test_heuristic_token_count(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "_get_encoder", lambda: None)
+    prompt_builder.count_tokens.cache_clear()
+    assert count_tokens("abcd" * 4) == 4
+    assert count_tokens("こんにちは") == 5
+    prompt_builder.count_tokens.cache_clear()
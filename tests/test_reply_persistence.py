@@ -0,0 +1,44 @@
+import os
+import json
+import asyncio
+
+from module.emotion import main_emotion
+from module.params import emotion_map
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+from module.llm import llm_client  # noqa: E402
+
+
+def _bare_json_reply() -> str:
+    name = next(iter(emotion_map.values()))
+    emotion = {"主感情": name, "重み": 50, "構成比": {name: 100}, "keywords": ["挨拶"]}
+    # dialogue_prompt / fake_openai_server と同じ、フェンス無しの末尾JSON
+    return f"こんにちは。今日もよろしくね。\n\n{json.dumps(emotion, ensure_ascii=False, indent=2)}"
+
+
+def test_bare_json_reply_is_persisted(monkeypatch):
+    written = []
+    monkeypatch.setattr(main_emotion, "write_structured_emotion_data", written.append)
+
+    display, emotion = llm_client.finalize_llm_response(_bare_json_reply(), "20260101000000")
+    assert display == "こんにちは。今日もよろしくね。"
+
+    main_emotion.store_reply_emotion(emotion)
+    assert len(written) == 1
+    assert written[0]["主感情"] == emotion["主感情"]
+    assert written[0]["date"] == "20260101000000"
+    assert "voicevox_settings" not in written[0] and "live2d" not in written[0]
+
+
+def test_bare_json_reply_is_persisted_async(monkeypatch):
+    written = []
+
+    async def write(data):
+        written.append(data)
+
+    monkeypatch.setattr(main_emotion, "write_structured_emotion_data_async", write)
+    _, emotion = llm_client.finalize_llm_response(_bare_json_reply(), "20260101000000")
+    record = asyncio.run(main_emotion.store_reply_emotion_async(emotion))
+    assert written == [record]
+    assert asyncio.run(main_emotion.store_reply_emotion_async({})) is None
+    assert len(written) == 1
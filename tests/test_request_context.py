@@ -0,0 +1,81 @@
+import asyncio
+
+from module.utils.request_context import (
+    request_memoized,
+    remember,
+    start_request_context,
+    end_request_context,
+    bind_request_context,
+    current_request_context,
+)
+
+
+def test_memoizes_within_request_only():
+    calls = []
+
+    @request_memoized("load")
+    def load(key):
+        calls.append(key)
+        return {"value": key}
+
+    load("a")
+    load("a")
+    assert calls == ["a", "a"]  # リクエスト外ではメモしない
+
+    token = start_request_context()
+    first = load("a")
+    first["value"] = "changed"
+    assert load("a") == {"value": "a"}
+    load("b")
+    stats = end_request_context(token)
+
+    assert calls == ["a", "a", "a", "b"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["by_name"]["load"] == {"hits": 1, "misses": 2}
+
+
+def test_sync_and_async_share_entries_and_remember_overrides():
+    calls = []
+
+    @request_memoized("current")
+    def load():
+        calls.append("sync")
+        return {"喜び": 1.0}
+
+    @request_memoized("current")
+    async def load_async():
+        calls.append("async")
+        return {"喜び": 0.0}
+
+    async def run():
+        token = start_request_context()
+        first = load()
+        second = await load_async()
+        remember("current", {"喜び": 0.5})
+        third = await load_async()
+        return first, second, third, end_request_context(token)
+
+    first, second, third, stats = asyncio.run(run())
+    assert calls == ["sync"]
+    assert first == second == {"喜び": 1.0}
+    assert third == {"喜び": 0.5}
+    assert stats["hits"] == 2
+
+
+def test_bind_request_context_reuses_results():
+    calls = []
+
+    @request_memoized("parse")
+    def parse(text):
+        calls.append(text)
+        return len(text)
+
+    token = start_request_context()
+    parse("abc")
+    context = current_request_context()
+    end_request_context(token)
+
+    with bind_request_context(context):
+        assert parse("abc") == 3
+    assert calls == ["abc"]
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+
+import openai
+import pytest
+
+import module.llm.resilient_completion as rc
+
+
+class FakeCompletions:
+    def __init__(self, behaviours):
+        self.behaviours = list(behaviours)
+        self.models = []
+
+    def create(self, model, **request):
+        self.models.append(model)
+        behaviour = self.behaviours.pop(0)
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        return behaviour
+
+
+class AsyncFakeCompletions(FakeCompletions):
+    async def create(self, model, **request):
+        self.models.append(model)
+        delay, behaviour = self.behaviours.pop(0)
+        await asyncio.sleep(delay)
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        return behaviour
+
+
+class FakeClient:
+    def __init__(self, completions):
+        self.chat = type("Chat", (), {"completions": completions})()
+        self.options = []
+
+    def with_options(self, **options):
+        self.options.append(options)
+        return self
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rc, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(rc, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(rc, "LLM_FALLBACK_MODEL", "")
+
+
+def test_retries_transient_errors_only():
+    client = FakeClient(FakeCompletions([TimeoutError("slow"), TimeoutError("slow"), "ok"]))
+    assert rc.create_completion(client, "main", messages=[]) == "ok"
+    assert client.chat.completions.models == ["main"] * 3
+    assert all(o["max_retries"] == 0 for o in client.options)
+
+    client = FakeClient(FakeCompletions([ValueError("bad request"), "ok"]))
+    with pytest.raises(ValueError):
+        rc.create_completion(client, "main", messages=[])
+    assert len(client.chat.completions.models) == 1
+
+
+def test_fallback_model_near_deadline(monkeypatch):
+    monkeypatch.setattr(rc, "LLM_FALLBACK_MODEL", "cheap")
+    monkeypatch.setattr(rc, "LLM_FALLBACK_WHEN_REMAINING_SEC", 5)
+    client = FakeClient(FakeCompletions(["ok"]))
+    assert rc.create_completion(client, "main", deadline=rc.Deadline(3), messages=[]) == "ok"
+    assert client.chat.completions.models == ["cheap"]
+
+
+def test_is_retryable_status_codes():
+    assert rc.is_retryable(TimeoutError())
+    assert not rc.is_retryable(ValueError())
+    error = openai.APIStatusError.__new__(openai.APIStatusError)
+    error.status_code = 503
+    assert rc.is_retryable(error)
+    error.status_code = 400
+    assert not rc.is_retryable(error)
+
+
+def test_async_hedge_takes_first_finisher(monkeypatch):
+    monkeypatch.setattr(rc, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(rc, "LLM_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(rc, "LLM_HEDGE_MIN_DELAY_SEC", 0.02)
+    monkeypatch.setattr(rc, "_latencies", rc.LatencyTracker())
+    rc._latencies.record("main", 0.01)
+
+    completions = AsyncFakeCompletions([(5, "slow"), (0.01, "hedged")])
+    client = FakeClient(completions)
+
+    async def main():
+        return await rc.create_completion_async(client, "main", messages=[])
+
+    assert asyncio.run(main()) == "hedged"
+    assert completions.models == ["main", "main"]
+
+
+def test_sync_hedge_runs_on_llm_executor(monkeypatch):
+    monkeypatch.setattr(rc, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(rc, "LLM_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(rc, "LLM_HEDGE_MIN_DELAY_SEC", 0.02)
+    monkeypatch.setattr(rc, "_latencies", rc.LatencyTracker())
+    rc._latencies.record("main", 0.01)
+
+    threads = []
+    release = threading.Event()
+
+    class SlowThenFast(FakeCompletions):
+        def create(self, model, **request):
+            threads.append(threading.current_thread().name)
+            if len(threads) == 1:
+                release.wait(2)
+                return "slow"
+            return "hedged"
+
+    client = FakeClient(SlowThenFast([]))
+    try:
+        assert rc.create_completion(client, "main", messages=[]) == "hedged"
+    finally:
+        release.set()
+    assert len(threads) == 2
+    assert all(name.startswith("llm-attempt") for name in threads)
+
+
+def test_latency_quantile():
+    tracker = rc.LatencyTracker(window=100)
+    for i in range(1, 101):
+        tracker.record("m", i / 100)
+    assert tracker.quantile("m", 0.95) == 0.95
+    assert tracker.quantile("m", 0.95, min_samples=200) is None
+    assert tracker.quantile("other", 0.5) is None
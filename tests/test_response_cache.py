@@ -0,0 +1,41 @@
+from module.llm.response_cache import ResponseCache, normalize_input, quantize_emotion, response_cache_key
+
+
+def test_key_ignores_trailing_marks_and_width():
+    assert normalize_input("おはよう！！") == normalize_input("おはよう")
+    assert normalize_input("ＨＥＬＬＯ  world?") == "hello world"
+    key = response_cache_key("おはよう〜", {"喜び": 50.0}, None)
+    assert key == response_cache_key("おはよう。", {"喜び": 52.0}, None)
+    assert key != response_cache_key("おはよう", {"悲しみ": 50.0}, None)
+    assert key != response_cache_key("おはよう", {"喜び": 50.0}, {"_id": "abc"})
+
+
+def test_quantize_emotion_keeps_top_levels():
+    # 現在感情と同じ、合計100に正規化した 0..100 のベクトル
+    vector = {"喜び": 45.0, "期待": 25.5, "信頼": 21.0, "驚き": 8.5, "恐れ": 0.0}
+    assert quantize_emotion(vector) == (("信頼", 1), ("喜び", 2), ("期待", 1))
+    assert quantize_emotion({"驚き": 12.0}) == ()
+    assert quantize_emotion(None) == ()
+
+
+def test_key_survives_between_turn_drift():
+    before = {"喜び": 41.27, "信頼": 33.4, "期待": 15.33, "驚き": 10.0}
+    after = {"喜び": 41.61, "信頼": 32.9, "期待": 15.49, "驚き": 10.0}
+    assert response_cache_key("おはよう", before, None) == response_cache_key("おはよう", after, None)
+
+
+def test_lru_ttl_and_hits(clock):
+    cache = ResponseCache(maxsize=2, ttl=100, use_mongo=False, clock=clock)
+    cache.put("a", "こんにちは", {"主感情": "喜び"})
+    cache.put("b", "やあ", {"主感情": "信頼"})
+    assert cache.get("a")["hits"] == 1
+    assert cache.get("a")["hits"] == 2
+
+    cache.put("c", "おはよう", {"主感情": "期待"})  # b が最も古い
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    clock.now = 150
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert len(cache) == 0
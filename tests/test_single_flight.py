@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from module.utils.single_flight import SingleFlight, single_flight
+
+
+def test_threads_share_one_call():
+    release = threading.Event()
+    calls = []
+
+    @single_flight("test_load")
+    def load(key):
+        calls.append(key)
+        release.wait(timeout=5)
+        return {"key": key}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(load, "a") for _ in range(4)]
+        while load.flight.in_flight() == 0:
+            pass
+        threading.Event().wait(0.05)  # 後続が待ちに入るまで少し待つ
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert calls == ["a"]
+    assert all(r is results[0] for r in results)
+    assert load.flight.in_flight() == 0
+    assert load("b") == {"key": "b"}  # 完了後は保持しない
+    assert calls == ["a", "b"]
+
+
+def test_async_callers_share_result_and_errors():
+    calls = []
+    flight = SingleFlight("test_async", copy_result=True)
+
+    async def complete(text):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return {"text": text}
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        results = await asyncio.gather(*(flight.do_async("k", complete, "hi") for _ in range(3)))
+        assert calls == ["hi"]
+        assert results == [{"text": "hi"}] * 3
+        assert len({id(r) for r in results}) == 3  # leader も含めて全員コピー
+
+        errors = await asyncio.gather(*(flight.do_async("e", fail) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(e, ValueError) for e in errors)
+
+    asyncio.run(main())
+
+
+def test_leader_mutation_does_not_reach_followers():
+    release = threading.Event()
+    flight = SingleFlight("test_copy", copy_result=True)
+
+    def load():
+        release.wait(timeout=5)
+        return {"short": [{"_id": "a", "keyword_overlap": 2}]}
+
+    def call():
+        result = flight.do("k", load)
+        # 呼び出し側が結果を書き換える（_with_overlaps の pop と同じ）
+        return [doc.pop("keyword_overlap", 0) for doc in result["short"]]
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(call) for _ in range(3)]
+        while flight.in_flight() == 0:
+            pass
+        threading.Event().wait(0.05)
+        release.set()
+        assert [f.result() for f in futures] == [[2], [2], [2]]
+
+
+def test_cancelled_sole_caller_cancels_work():
+    flight = SingleFlight("test_cancel")
+    started = []
+
+    async def slow():
+        started.append(True)
+        await asyncio.sleep(10)
+
+    async def main():
+        waiter = asyncio.ensure_future(flight.do_async("k", slow))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+        assert flight.in_flight() == 0
+
+    asyncio.run(main())
+    assert started == [True]
@@ -0,0 +1,36 @@
+from module.llm.stream_filter import JsonTailFilter
+from module.utils.json_block import strip_json_block
+
+RESPONSE = (
+    "こんにちは、ご主人。今のやりとり、とても嬉しかったです。\n"
+    "（感情　誇り:40%、信頼:30%、希望:30%）\n\n"
+    '{\n  "主感情": "誇り",\n  "構成比": {"誇り": 40, "信頼": 30, "希望": 30}\n}'
+)
+
+
+def _stream(text, size):
+    tail_filter = JsonTailFilter()
+    visible = "".join(tail_filter.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return visible, tail_filter.finish(), tail_filter
+
+
+def test_json_block_is_withheld_from_stream():
+    for size in (1, 3, 7, len(RESPONSE)):
+        visible, rest, tail_filter = _stream(RESPONSE, size)
+        assert "{" not in visible
+        assert (visible + rest).strip() == strip_json_block(RESPONSE)
+        assert tail_filter.text == RESPONSE
+        assert tail_filter.block.data["主感情"] == "誇り"
+
+
+def test_fenced_json_is_withheld():
+    text = "了解です。\n```json\n{\"主感情\": \"喜び\"}\n```"
+    visible, rest, _ = _stream(text, 2)
+    assert (visible + rest).strip() == "了解です。"
+
+
+def test_held_text_without_json_is_released_at_finish():
+    text = "記号 `code` を含む応答です。"
+    visible, rest, _ = _stream(text, 4)
+    assert visible == "記号 "
+    assert visible + rest == text
@@ -0,0 +1,67 @@
+import json
+from types import SimpleNamespace
+
+from module.llm import structured_output
+from module.llm.structured_output import (
+    completion_kwargs,
+    parse_structured_message,
+    reply_schema,
+    storable_emotion_record,
+    to_emotion_data,
+)
+
+REPLY = {
+    "response": "こんにちは。（感情　喜び:60%、信頼:40%）",
+    "emotion": {
+        "主感情": "喜び",
+        "構成比": [{"感情": "喜び", "割合": 60}, {"感情": "信頼", "割合": 40}],
+        "重み": 50,
+        "状況": "挨拶",
+        "心理反応": "嬉しい",
+        "関係性変化": "なし",
+        "関連": ["挨拶"],
+        "keywords": ["こんにちは"]
+    }
+}
+
+
+def test_strict_schema_requires_every_property():
+    def check(schema):
+        if schema.get("type") == "object":
+            assert schema["additionalProperties"] is False
+            assert set(schema["required"]) == set(schema["properties"])
+            for child in schema["properties"].values():
+                check(child)
+        elif schema.get("type") == "array":
+            check(schema["items"])
+
+    check(reply_schema())
+
+
+def test_completion_kwargs_per_mode():
+    assert completion_kwargs("off") == {}
+    assert completion_kwargs("json_schema")["response_format"]["json_schema"]["strict"] is True
+    tool = completion_kwargs("tool")
+    assert tool["tool_choice"]["function"]["name"] == structured_output.TOOL_NAME
+
+
+def test_parse_message_for_json_schema_and_tool():
+    message = SimpleNamespace(content=json.dumps(REPLY, ensure_ascii=False), tool_calls=None)
+    assert parse_structured_message(message, "json_schema") == REPLY
+
+    call = SimpleNamespace(function=SimpleNamespace(name=structured_output.TOOL_NAME, arguments=json.dumps(REPLY)))
+    assert parse_structured_message(SimpleNamespace(content=None, tool_calls=[call]), "tool") == REPLY
+
+    assert parse_structured_message(SimpleNamespace(content="ただの文章", tool_calls=None), "json_schema") is None
+
+
+def test_to_emotion_data_matches_legacy_shape():
+    data = to_emotion_data(REPLY["emotion"])
+    assert data["構成比"] == {"喜び": 60, "信頼": 40}
+    assert data["データ種別"] == "emotion"
+    assert data["主感情"] == "喜び"
+
+    data["voicevox_settings"] = {"speaker": 3}
+    data["live2d"] = {}
+    assert "voicevox_settings" not in storable_emotion_record(data)
+    assert "live2d" not in storable_emotion_record(data)